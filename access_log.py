@@ -0,0 +1,223 @@
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+# Structured access log: one record per request or tunnel, handed to a bounded queue by the handler
+# threads and written in batches by a single background thread. When the queue is full the record is
+# dropped and counted; handlers never block on disk I/O. Files rotate by size (log, log.1, ... log.N).
+#
+# Formats: 'jsonl' (one JSON object per line) or 'binary' (length-prefixed records, see _pack_binary;
+# `python access_log.py dump FILE` converts binary logs back to JSONL).
+
+FIELDS = ('ts', 'client', 'host', 'port', 'method', 'route', 'status', 'bytes_up', 'bytes_down',
+          'connect_ms', 'duration_ms')
+
+ROUTES = (None, 'direct', 'socks', 'cache', 'local', 'coalesced')
+BINARY_MAGIC = b'PXAL\x01'
+# ts, port, status, route, bytes_up, bytes_down, connect_ms, duration_ms
+_FIXED = struct.Struct('<dHhBQQff')
+_SIZE = struct.Struct('<H')
+
+
+def _pack_str(value):
+    data = (value or '').encode('utf-8')[:255]
+    return bytes([len(data)]) + data
+
+
+def _pack_binary(rec) -> bytes:
+    ts, client, host, port, method, route, status, up, down, connect_ms, duration_ms = rec
+    body = _FIXED.pack(ts, port or 0, -1 if status is None else status,
+                       ROUTES.index(route) if route in ROUTES else 0, up, down,
+                       -1.0 if connect_ms is None else connect_ms, duration_ms)
+    body += _pack_str(client) + _pack_str(host) + _pack_str(method)
+    return _SIZE.pack(len(body)) + body
+
+
+def _pack_json(rec) -> bytes:
+    return (json.dumps(dict(zip(FIELDS, rec)), separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def read_binary(path):
+    """逐条读取二进制访问日志，产生与 JSONL 相同字段的 dict"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError(f"{path}: not a binary access log")
+    pos = len(BINARY_MAGIC)
+    while pos + _SIZE.size <= len(data):
+        (size,) = _SIZE.unpack_from(data, pos)
+        pos += _SIZE.size
+        if pos + size > len(data):
+            break  # truncated tail (crash mid-write)
+        ts, port, status, route, up, down, connect_ms, duration_ms = _FIXED.unpack_from(data, pos)
+        off = pos + _FIXED.size
+        strings = []
+        for _ in range(3):
+            n = data[off]
+            strings.append(data[off + 1:off + 1 + n].decode('utf-8', 'replace'))
+            off += 1 + n
+        pos += size
+        yield {'ts': ts, 'client': strings[0], 'host': strings[1] or None, 'port': port or None,
+               'method': strings[2] or None, 'route': ROUTES[route] if route < len(ROUTES) else None,
+               'status': None if status < 0 else status, 'bytes_up': up, 'bytes_down': down,
+               'connect_ms': None if connect_ms < 0 else round(connect_ms, 3),
+               'duration_ms': round(duration_ms, 3)}
+
+
+class AccessLog:
+    def __init__(self, path, fmt='jsonl', max_bytes=64 * 1024 * 1024, backups=5, queue_size=10000,
+                 batch_size=512, flush_interval=1.0):
+        if fmt not in ('jsonl', 'binary'):
+            raise ValueError(f"access_log_format must be 'jsonl' or 'binary', got {fmt!r}")
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = int(max_bytes)
+        self.backups = int(backups)
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self._pack = _pack_binary if fmt == 'binary' else _pack_json
+        self._queue = queue.Queue(maxsize=int(queue_size))
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {'records': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'rotations': 0, 'errors': 0}
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='AccessLog', daemon=True)
+        self._thread.start()
+
+    def log_flow(self, flow, finished=None):
+        """处理线程调用：把一个 Flow 转为记录放入队列，队列满时丢弃并计数，从不阻塞"""
+        finished = time.time() if finished is None else finished
+        rec = (flow.started, flow.client, flow.host, flow.port, flow.method, flow.route, flow.status,
+               flow.bytes_up, flow.bytes_down,
+               None if flow.connect_time is None else round(flow.connect_time * 1000, 3),
+               round((finished - flow.started) * 1000, 3))
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return
+        with self._lock:
+            self._stats['records'] += 1
+
+    def _open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'ab')
+        if new and self.fmt == 'binary':
+            self._file.write(BINARY_MAGIC)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        """按大小轮转：path -> path.1 -> ... -> path.N，最旧的删除"""
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        with self._lock:
+            self._stats['rotations'] += 1
+        self._open()
+
+    def _write_batch(self, batch):
+        try:
+            if self._file is None:
+                self._open()
+            header = len(BINARY_MAGIC) if self.fmt == 'binary' else 0
+            pending = []
+            pending_size = 0
+            for rec in batch:
+                data = self._pack(rec)
+                # 超过大小上限时先写出已累积的部分再轮转（文件至少包含一条记录）
+                if self.max_bytes and self._size + pending_size + len(data) > self.max_bytes \
+                        and self._size + pending_size > header:
+                    self._file.write(b''.join(pending))
+                    pending, pending_size = [], 0
+                    self._rotate()
+                pending.append(data)
+                pending_size += len(data)
+            self._file.write(b''.join(pending))
+            self._file.flush()
+            self._size += pending_size
+            with self._lock:
+                self._stats['written'] += len(batch)
+                self._stats['batches'] += 1
+        except Exception:
+            with self._lock:
+                self._stats['errors'] += 1
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except Exception:
+                    pass
+                self._file = None
+
+    def _run(self):
+        while True:
+            try:
+                rec = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if not self._running:
+                    break
+                continue
+            if rec is None:
+                break
+            batch = [rec]
+            # 批量取出已排队的记录，一次写入
+            while len(batch) < self.batch_size:
+                try:
+                    rec = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if rec is None:
+                    self._running = False
+                    break
+                batch.append(rec)
+            self._write_batch(batch)
+            if not self._running and self._queue.empty():
+                break
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    def close(self, timeout=2.0):
+        """写出队列中剩余的记录并关闭文件"""
+        self._running = False
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s['queued'] = self._queue.qsize()
+        return s
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Inspect proxy access logs')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    d = sub.add_parser('dump', help='print a binary access log as JSONL')
+    d.add_argument('path')
+    args = parser.parse_args(argv)
+    for rec in read_binary(args.path):
+        sys.stdout.write(json.dumps(rec, separators=(',', ':')) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+import gc
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Microbenchmarks for the per-request hot paths of ProxyServer: reading and framing a request head off
+# the client socket, rewriting the request for the origin, parse_host_port, rule matching against small
+# and large (in-memory and memory-mapped) rule sets, reading a large chunked request body, the
+# reachability-cache lookup in front of a direct connect and a small-write round trip through the tunnel
+# relay. Each case calls the proxy's own method on a ProxyServer that is never started; socket-bound
+# cases read recorded request bytes from a socketpair, so no network, DNS or upstream is involved. The
+# tunnel cases run relay() between loopback TCP connections with the socket-option profile applied, once
+# with the default TCP_NODELAY and once with Nagle left on.
+#
+# A case runs a calibrated number of calls per round (at least --min-time seconds) for --rounds rounds
+# with the garbage collector off; the report gives the per-call median over rounds, the interquartile
+# range and the fastest round. --save writes the results as a baseline, --compare checks the current
+# run against one and exits 1 when a case is slower than the baseline by more than --tolerance.
+#
+#   python bench.py --save bench_baseline.json
+#   python bench.py --compare bench_baseline.json --tolerance 0.15
+
+# 录制的请求头（curl、Chrome、Firefox 发给 HTTP 代理的原始字节）
+CURL_GET = (b"GET http://example.com/ HTTP/1.1\r\n"
+            b"Host: example.com\r\n"
+            b"User-Agent: curl/8.5.0\r\n"
+            b"Accept: */*\r\n"
+            b"Proxy-Connection: Keep-Alive\r\n"
+            b"\r\n")
+
+CHROME_GET = (b"GET http://www.example.org/assets/app.js?v=3f9a1c HTTP/1.1\r\n"
+              b"Host: www.example.org\r\n"
+              b"Proxy-Connection: keep-alive\r\n"
+              b"sec-ch-ua: \"Chromium\";v=\"124\", \"Google Chrome\";v=\"124\", \"Not-A.Brand\";v=\"99\"\r\n"
+              b"sec-ch-ua-mobile: ?0\r\n"
+              b"User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+              b"Chrome/124.0.0.0 Safari/537.36\r\n"
+              b"sec-ch-ua-platform: \"Windows\"\r\n"
+              b"Accept: */*\r\n"
+              b"Sec-Fetch-Site: same-origin\r\n"
+              b"Sec-Fetch-Mode: no-cors\r\n"
+              b"Sec-Fetch-Dest: script\r\n"
+              b"Referer: http://www.example.org/dashboard\r\n"
+              b"Accept-Encoding: gzip, deflate\r\n"
+              b"Accept-Language: zh-CN,zh;q=0.9,en;q=0.8\r\n"
+              b"Cookie: _ga=GA1.1.1843291046.1712041833; session=6a3f0c2e9b1d4f7a8c5e2b0d9f1a3c7e; "
+              b"prefs=%7B%22theme%22%3A%22dark%22%2C%22lang%22%3A%22zh-CN%22%2C%22tz%22%3A%22Asia%2FShanghai%22%7D; "
+              b"_gid=GA1.1.918273645.1712041833; csrftoken=Yx2v8QmN4tR7kL1pZ9wA3sD6fG0hJ5cB\r\n"
+              b"If-None-Match: W/\"5e1-18e9f3a2c40\"\r\n"
+              b"If-Modified-Since: Tue, 02 Apr 2024 06:30:33 GMT\r\n"
+              b"\r\n")
+
+FIREFOX_POST = (b"POST http://api.example.net/v1/events HTTP/1.1\r\n"
+                b"Host: api.example.net\r\n"
+                b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0\r\n"
+                b"Accept: application/json\r\n"
+                b"Accept-Language: en-US,en;q=0.5\r\n"
+                b"Accept-Encoding: gzip, deflate\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: 57\r\n"
+                b"Origin: http://www.example.net\r\n"
+                b"Connection: keep-alive\r\n"
+                b"Proxy-Connection: keep-alive\r\n"
+                b"\r\n"
+                b"{\"event\":\"click\",\"target\":\"#save\",\"ts\":1712041833000}\n\n")
+
+HEADS = {'curl': CURL_GET, 'chrome': CHROME_GET, 'firefox_post': FIREFOX_POST}
+
+
+def chunked_body(total=1024 * 1024, chunk=16 * 1024):
+    """生成 chunked 编码的请求体（最后一块带扩展，结尾带 trailer）"""
+    out = []
+    left = total
+    i = 0
+    while left > 0:
+        n = min(chunk, left)
+        ext = b';name=last' if n == left else b''
+        out.append(b'%x%s\r\n' % (n, ext) + bytes([97 + i % 26]) * n + b'\r\n')
+        left -= n
+        i += 1
+    out.append(b'0\r\nX-Checksum: 1f3870be\r\n\r\n')
+    return b''.join(out)
+
+
+# 规则集：小列表接近默认配置，大列表接近加载了域名列表与 CN-IP 段的规则文件
+SMALL_RULES = ['localhost', '127.0.0.1', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16',
+               'example.com', 'intranet.corp', 'lan', '::1']
+LOOKUP_HOSTS = ['example.com', 'cdn.static.example.com', 'www.google.com', 'a.b.c.d.e.unknown-host.net',
+                '192.168.1.20', '8.8.8.8', 'api.github.com', 'domain-1234.example']
+# 域名解析结果固定下来，CIDR 规则对域名的匹配只走 DNS 缓存
+RESOLVED = {'example.com': '93.184.216.34', 'cdn.static.example.com': '93.184.216.35',
+            'www.google.com': '142.250.72.196', 'a.b.c.d.e.unknown-host.net': '203.0.113.9',
+            'api.github.com': '140.82.112.6', 'domain-1234.example': '198.51.100.77'}
+
+
+def large_rules(domains=50000, networks=5000):
+    entries = [f"domain-{i}.example" for i in range(domains)]
+    entries += [f"{1 + i // 256 % 223}.{i % 256}.0.0/16" for i in range(networks)]
+    return entries
+
+
+def _socketpair():
+    a, b = socket.socketpair()
+    for s in (a, b):
+        s.settimeout(5.0)
+    return a, b
+
+
+def _tcp_pair():
+    """回环 TCP 连接的两端（Nagle 与延迟 ACK 只在真实 TCP 上出现，socketpair 测不到）"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        a = socket.create_connection(listener.getsockname(), timeout=5.0)
+        b, _ = listener.accept()
+    b.settimeout(5.0)
+    return a, b
+
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError('peer closed')
+        data += chunk
+    return data
+
+
+def cases(server, tmpdir):
+    """产出 (name, call, prepare, close)：prepare（可为 None）在计时之外于每次调用前执行"""
+    from ipaddress import ip_address
+
+    # 请求头读取与解析（handle_client 的前半段）
+    for name, fixture in HEADS.items():
+        client, sock = _socketpair()
+        head_end = fixture.index(b'\r\n\r\n') + 4
+
+        def read_head(sock=sock, fixture=fixture):
+            header_data = server._read_request_head(sock)
+            lines = header_data.decode('iso-8859-1').split('\r\n')
+            server._body_framing(lines)
+
+        def send(client=client, fixture=fixture[:head_end]):
+            client.sendall(fixture)
+
+        yield f"read_head[{name}]", read_head, send, (client.close, sock.close)
+
+    # 请求重写（handle_http_request 发往源站的请求头）
+    for name, fixture in HEADS.items():
+        lines = fixture.split(b'\r\n\r\n', 1)[0].decode('iso-8859-1').split('\r\n')
+
+        def rewrite(lines=lines):
+            server._rewrite_request('GET', '/assets/app.js?v=3f9a1c', 'HTTP/1.1', lines).encode('iso-8859-1')
+
+        yield f"rewrite[{name}]", rewrite, None, ()
+
+    for name, url in (('connect', 'www.example.org:443'), ('absolute', 'http://www.example.org:8080/path?q=1')):
+        yield f"parse_host_port[{name}]", (lambda url=url: server.parse_host_port(url)), None, ()
+
+    # 规则匹配：每次调用依次查询一组命中/未命中的主机
+    now = time.time()
+    for host, addr in RESOLVED.items():
+        server._dns_cache[host] = ([ip_address(addr)], now + 86400)
+    big = large_rules()
+    for name, entries, snapshot in (('small', SMALL_RULES, None), ('large', big, None),
+                                    ('large_snapshot', big, os.path.join(tmpdir, 'rules'))):
+        server.set_rules(bypass_list=entries, rule_snapshot=snapshot)
+        rules = server._bypass_rules
+
+        def match(rules=rules):
+            for host in LOOKUP_HOSTS:
+                server._host_in_list(host, rules)
+
+        yield f"host_in_list[{name}]", match, None, ()
+    server.set_rules()
+
+    # 大 chunked 请求体：后台线程连续写入同一份录制数据，每次调用读完一个完整请求体
+    body = chunked_body()
+    client, sock = _socketpair()
+    stop = threading.Event()
+
+    def feed():
+        try:
+            while not stop.is_set():
+                client.sendall(body)
+        except OSError:
+            pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    yield "read_chunked_body[1MB]", (lambda: server._read_chunked_body(sock)), None, \
+        (stop.set, sock.close, client.close)
+
+    # 可达性缓存：缓存已满，查询命中一条近期失败记录（不发起连接）
+    for i in range(server.REACH_CACHE_SIZE):
+        server._remember_reach((f"host-{i}.example", 443), False, now + 86400)
+    yield "reach_cache[hit_failure]", (lambda: server._try_direct_connect('host-2048.example', 443)), None, ()
+
+    # 隧道往返：客户端与源站各用两次 10 字节的写入收发一轮，中间经 relay() 转发
+    from relay import relay
+    from sockopts import SocketProfile
+    for name, nodelay in (('nodelay', True), ('nagle', False)):
+        profile = SocketProfile({'client': {'nodelay': nodelay}, 'direct': {'nodelay': nodelay}})
+        app, client_side = _tcp_pair()
+        upstream, origin = _tcp_pair()
+        profile.apply(client_side, 'client')
+        profile.apply(upstream, 'direct')
+        for s in (app, origin):
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+        stop = threading.Event()
+
+        def echo(origin=origin):
+            try:
+                while True:
+                    data = _recv_exact(origin, 20)
+                    origin.sendall(data[:10])
+                    origin.sendall(data[10:])
+            except OSError:
+                pass
+
+        threading.Thread(target=echo, daemon=True).start()
+        relay_thread = threading.Thread(target=relay, args=(client_side, upstream, server.buffer_pool),
+                                        kwargs={'should_stop': stop.is_set}, daemon=True)
+        relay_thread.start()
+
+        def round_trip(app=app):
+            app.sendall(b'0123456789')
+            app.sendall(b'abcdefghij')
+            _recv_exact(app, 20)
+
+        yield f"tunnel_rtt[{name}]", round_trip, None, \
+            (stop.set, app.close, origin.close, lambda t=relay_thread: t.join(5), client_side.close, upstream.close)
+
+
+def measure(call, prepare=None, rounds=15, min_time=0.02):
+    """返回每次调用的耗时统计（纳秒）：各轮平均值的中位数、四分位距与最快一轮"""
+    clock = time.perf_counter_ns
+
+    def run(number):
+        if prepare is None:
+            started = clock()
+            for _ in range(number):
+                call()
+            return clock() - started
+        total = 0
+        for _ in range(number):
+            prepare()
+            started = clock()
+            call()
+            total += clock() - started
+        return total
+
+    # 预热并校准每轮调用次数
+    number = 1
+    while True:
+        if run(number) >= min_time * 1e9 or number >= 1 << 24:
+            break
+        number *= 2
+    samples = sorted(run(number) / number for _ in range(rounds))
+    q = statistics.quantiles(samples, n=4) if len(samples) >= 2 else [samples[0]] * 3
+    return {'median_ns': round(statistics.median(samples), 1), 'iqr_ns': round(q[2] - q[0], 1),
+            'min_ns': round(samples[0], 1), 'number': number, 'rounds': rounds}
+
+
+def environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'system': platform.system()}
+
+
+def compare(results, baseline, tolerance):
+    """返回 {name: (baseline_median, ratio, regressed)}；基线中没有的用例不比较"""
+    out = {}
+    for name, r in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        ratio = r['median_ns'] / base['median_ns'] if base['median_ns'] else 1.0
+        out[name] = (base['median_ns'], ratio, ratio > 1 + tolerance)
+    return out
+
+
+def _fmt_ns(ns):
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} us"
+    return f"{ns:.0f} ns"
+
+
+def format_report(results, diff=None):
+    lines = [f"{'case':30} {'median':>10} {'iqr':>10} {'min':>10}" + (f" {'baseline':>10} {'change':>8}" if diff else '')]
+    for name, r in results.items():
+        line = f"{name:30} {_fmt_ns(r['median_ns']):>10} {_fmt_ns(r['iqr_ns']):>10} {_fmt_ns(r['min_ns']):>10}"
+        if diff and name in diff:
+            base, ratio, regressed = diff[name]
+            line += f" {_fmt_ns(base):>10} {(ratio - 1) * 100:+7.1f}%{'  REGRESSION' if regressed else ''}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Microbenchmark the proxy\'s per-request hot paths')
+    parser.add_argument('-k', '--filter', action='append', default=[], metavar='TEXT',
+                        help='only run cases whose name contains TEXT (repeatable)')
+    parser.add_argument('--rounds', type=int, default=15, help='timed rounds per case')
+    parser.add_argument('--min-time', type=float, default=0.02, help='minimum seconds per round')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a baseline and exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed slowdown of the median against the baseline (default 0.15 = 15%%)')
+    args = parser.parse_args(argv)
+
+    from proxy_server import ProxyServer
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != environment():
+            print(f"warning: baseline was recorded on {baseline.get('environment')}, now {environment()}",
+                  file=sys.stderr)
+
+    server = ProxyServer(logger=None, log_level='WARNING')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, call, prepare, close in cases(server, tmpdir):
+            try:
+                if args.filter and not any(f in name for f in args.filter):
+                    continue
+                gc.collect()
+                gc.disable()
+                try:
+                    results[name] = measure(call, prepare, args.rounds, args.min_time)
+                finally:
+                    gc.enable()
+            finally:
+                for fn in close:
+                    fn()
+        # 内存映射的快照需在删除临时目录之前释放
+        server.set_rules()
+        gc.collect()
+
+    diff = compare(results, baseline, args.tolerance) if baseline else None
+    print(format_report(results, diff))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if diff and any(regressed for _, _, regressed in diff.values()):
+        print('FAIL: slower than baseline by more than %.0f%%' % (args.tolerance * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
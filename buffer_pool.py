@@ -0,0 +1,125 @@
+import select
+import socket
+import threading
+import time
+
+# Shared pool of fixed-size bytearray slabs for socket reads. The total memory of all slabs is capped by
+# a budget; when every slab is in use, readers wait for one to be returned instead of allocating, so a
+# traffic spike turns into TCP backpressure rather than a growing heap. Readers first wait until their
+# socket is readable and only then borrow a slab, so idle connections hold no buffer memory. The wait for
+# a slab is bounded by the reader's socket timeout: a pool held by stalled tunnels fails the read with
+# socket.timeout like a silent peer would, instead of hanging the handler thread.
+
+
+class BufferPool:
+    def __init__(self, slab_size=16384, budget=64 * 1024 * 1024):
+        self.slab_size = int(slab_size)
+        self.max_slabs = max(1, int(budget) // self.slab_size)
+        self._cond = threading.Condition()
+        self._free = []
+        self._allocated = 0
+        self._in_use = 0
+        self._stats = {'acquired': 0, 'waits': 0, 'wait_seconds': 0.0, 'peak_in_use': 0, 'exhausted': 0,
+                       'timeouts': 0}
+
+    def acquire(self, timeout=None) -> bytearray:
+        """借出一个 slab；预算用尽时阻塞等待归还（背压）。timeout 秒内等不到时抛出 socket.timeout"""
+        with self._cond:
+            if not self._free and self._allocated >= self.max_slabs:
+                started = time.monotonic()
+                deadline = None if timeout is None else started + timeout
+                self._stats['waits'] += 1
+                try:
+                    while not self._free and self._allocated >= self.max_slabs:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self._stats['timeouts'] += 1
+                            raise socket.timeout('buffer pool exhausted')
+                        self._cond.wait(remaining)
+                finally:
+                    self._stats['wait_seconds'] += time.monotonic() - started
+            if self._free:
+                buf = self._free.pop()
+            else:
+                buf = bytearray(self.slab_size)
+                self._allocated += 1
+            self._in_use += 1
+            self._stats['acquired'] += 1
+            if self._in_use > self._stats['peak_in_use']:
+                self._stats['peak_in_use'] = self._in_use
+            return buf
+
+    def try_acquire(self):
+        """非阻塞借出：预算用尽时返回 None（供单线程事件循环使用，不能在循环里阻塞）"""
+        with self._cond:
+            if not self._free and self._allocated >= self.max_slabs:
+                self._stats['exhausted'] += 1
+                return None
+            if self._free:
+                buf = self._free.pop()
+            else:
+                buf = bytearray(self.slab_size)
+                self._allocated += 1
+            self._in_use += 1
+            self._stats['acquired'] += 1
+            if self._in_use > self._stats['peak_in_use']:
+                self._stats['peak_in_use'] = self._in_use
+            return buf
+
+    def release(self, buf):
+        with self._cond:
+            self._in_use -= 1
+            self._free.append(buf)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            s = dict(self._stats)
+            s['wait_seconds'] = round(s['wait_seconds'], 3)
+            s['slab_size'] = self.slab_size
+            s['budget_bytes'] = self.max_slabs * self.slab_size
+            s['allocated_bytes'] = self._allocated * self.slab_size
+            s['in_use'] = self._in_use
+            s['utilization'] = round(self._in_use / self.max_slabs, 3)
+        return s
+
+
+class ReadWaiter:
+    """等待套接字可读（或对端关闭）而不占用缓冲区；遵守套接字自身的超时设置"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._poll = None
+        # poll has no FD_SETSIZE limit; select() is the fallback on Windows
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+            self._poll.register(sock, select.POLLIN | select.POLLPRI)
+
+    def wait(self):
+        timeout = self.sock.gettimeout()
+        if self._poll is not None:
+            ready = self._poll.poll(None if timeout is None else timeout * 1000)
+        else:
+            ready = select.select([self.sock], [], [], timeout)[0]
+        if not ready:
+            raise socket.timeout('timed out')
+
+
+def pooled_chunks(pool, sock, limit=None):
+    """逐块读取 sock 直到 EOF，产出指向池中 slab 的 memoryview（仅在下一次迭代前有效，需要保留时请复制）。
+    limit 为最多读取的总字节数。可读等待与借出 slab 的等待都以套接字的超时为限，超时抛出 socket.timeout"""
+    waiter = ReadWaiter(sock)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        waiter.wait()
+        buf = pool.acquire(sock.gettimeout())
+        try:
+            view = memoryview(buf)
+            n = sock.recv_into(view if remaining is None else view[:remaining])
+            if not n:
+                return
+            if remaining is not None:
+                remaining -= n
+            yield view[:n]
+        finally:
+            pool.release(buf)
@@ -0,0 +1,105 @@
+import threading
+import time
+
+# Circuit breaker for the upstream SOCKS proxy. After `failure_threshold` consecutive failures to reach
+# the upstream the breaker opens: callers fail fast instead of each waiting for a connect timeout. While
+# open, a background thread probes the upstream every `probe_interval` seconds (state 'half_open' during
+# a probe) and closes the breaker as soon as a probe succeeds.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, probe, failure_threshold=5, probe_interval=10.0, name='upstream', logger=None):
+        # probe() -> bool, must not raise and should use a short timeout
+        self._probe = probe
+        self.failure_threshold = int(failure_threshold)
+        self.probe_interval = float(probe_interval)
+        self.name = name
+        self._log = logger
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._thread = None
+        self._stats = {'failures': 0, 'opens': 0, 'closes': 0, 'rejected': 0, 'probes': 0, 'probe_failures': 0}
+
+    def allow(self) -> bool:
+        """断路器闭合时允许请求；打开或探测中直接拒绝（快速失败）"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            self._stats['rejected'] += 1
+        return False
+
+    def record_success(self):
+        if self._failures or self.state != CLOSED:
+            with self._lock:
+                self._failures = 0
+                if self.state != CLOSED:
+                    self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self.state == CLOSED and self.failure_threshold and self._failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def _transition(self, state):
+        """在持有锁时调用：切换状态、记录日志，打开时启动探测线程"""
+        previous, self.state = self.state, state
+        if state == OPEN and previous == CLOSED:
+            self._opened_at = time.monotonic()
+            self._stats['opens'] += 1
+            if self._log:
+                self._log(f"Circuit breaker for {self.name} opened after {self._failures} consecutive failures")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._probe_loop, name='CircuitBreakerProbe', daemon=True)
+                self._thread.start()
+        elif state == CLOSED:
+            self._stats['closes'] += 1
+            self._failures = 0
+            if self._log and self._opened_at is not None:
+                self._log(f"Circuit breaker for {self.name} closed after "
+                          f"{time.monotonic() - self._opened_at:.1f}s")
+            self._opened_at = None
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self.state = HALF_OPEN
+                self._stats['probes'] += 1
+            ok = False
+            try:
+                ok = bool(self._probe())
+            except Exception:
+                ok = False
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                if ok:
+                    self._transition(CLOSED)
+                    return
+                self._stats['probe_failures'] += 1
+                self.state = OPEN
+
+    def reset(self):
+        """上游配置变化时调用：清除失败计数并闭合断路器"""
+        with self._lock:
+            self._failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['state'] = self.state
+            s['consecutive_failures'] = self._failures
+            s['open_seconds'] = round(time.monotonic() - self._opened_at, 1) if self._opened_at else 0.0
+        return s
@@ -0,0 +1,203 @@
+import threading
+
+# Request coalescing for plain-HTTP GETs. The first request for a key (URL plus the request headers a
+# response commonly varies on) becomes the leader and fetches from upstream as usual; every chunk it
+# relays to its own client is also appended to a shared Fetch. Identical requests arriving while the
+# fetch is open join as followers and stream the same bytes from offset 0, so late joiners still get the
+# whole response. Whether a response may be shared is decided from its head: responses that set cookies,
+# are private/no-store, or vary on headers the followers do not have in common are not shared, and those
+# followers fetch on their own. Once a response outgrows the buffer the fetch closes to new joiners and
+# bytes every reader has consumed are released.
+
+# request headers that are part of the key
+KEY_HEADERS = ('accept', 'accept-encoding', 'accept-language', 'authorization', 'cookie',
+               'if-none-match', 'if-modified-since')
+
+
+class Fetch:
+    __slots__ = ('key', 'req_headers', 'cond', 'chunks', 'base', 'size', 'head', 'shareable', 'vary',
+                 'done', 'open', 'readers')
+
+    def __init__(self, key, req_headers):
+        self.key = key
+        self.req_headers = req_headers
+        self.cond = threading.Condition()
+        self.chunks = []  # retained response bytes, starting at absolute offset `base`
+        self.base = 0
+        self.size = 0  # total bytes published so far
+        self.head = b''
+        self.shareable = None  # None until the response head has been parsed
+        self.vary = ()
+        self.done = False
+        self.open = True  # accepting new followers
+        self.readers = {}  # follower id -> absolute offset
+
+
+class Coalescer:
+    def __init__(self, max_buffer=8 * 1024 * 1024, wait_timeout=30.0):
+        self.max_buffer = int(max_buffer)
+        self.wait_timeout = float(wait_timeout)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {'leaders': 0, 'coalesced': 0, 'late_joins': 0, 'fallbacks': 0, 'not_shareable': 0,
+                       'bytes_saved': 0, 'dropped_followers': 0}
+
+    @staticmethod
+    def eligible(req_headers) -> bool:
+        """只合并不带请求体、不是范围请求的 GET（调用方保证方法与请求体）"""
+        return 'range' not in req_headers and 'expect' not in req_headers
+
+    @staticmethod
+    def key(url, req_headers):
+        return (url,) + tuple(req_headers.get(h, '') for h in KEY_HEADERS)
+
+    def join(self, key, req_headers):
+        """返回 (fetch, is_leader)：已有进行中的相同请求时作为跟随者加入，否则成为领取者"""
+        with self._lock:
+            fetch = self._inflight.get(key)
+            if fetch is not None and fetch.open:
+                with fetch.cond:
+                    if fetch.open:
+                        fetch.readers[id(req_headers)] = 0
+                        if fetch.size:
+                            self._stats['late_joins'] += 1
+                        return fetch, False
+            fetch = Fetch(key, req_headers)
+            self._inflight[key] = fetch
+            self._stats['leaders'] += 1
+            return fetch, True
+
+    def _close(self, fetch):
+        """不再接受新的跟随者"""
+        fetch.open = False
+        with self._lock:
+            if self._inflight.get(fetch.key) is fetch:
+                del self._inflight[fetch.key]
+
+    def _parse_head(self, fetch):
+        from http_cache import parse_response_head
+        idx = fetch.head.find(b'\r\n\r\n')
+        try:
+            _, _, headers = parse_response_head(fetch.head[:idx])
+        except Exception:
+            return False
+        vary = []
+        for k, v in headers:
+            name = k.lower()
+            if name == 'set-cookie':
+                return False
+            if name == 'cache-control' and any(d in v.lower() for d in ('private', 'no-store')):
+                return False
+            if name == 'vary':
+                vary.extend(h.strip().lower() for h in v.split(',') if h.strip())
+        if '*' in vary:
+            return False
+        fetch.vary = tuple(h for h in vary if h not in KEY_HEADERS)
+        return True
+
+    def feed(self, fetch, data):
+        """领取者每转发一块响应数据调用一次"""
+        if fetch.shareable is False:
+            return
+        data = bytes(data)
+        close = False
+        with fetch.cond:
+            if fetch.shareable is None:
+                fetch.head += data
+                if b'\r\n\r\n' in fetch.head:
+                    fetch.shareable = self._parse_head(fetch)
+                    fetch.head = b''
+                    close = not fetch.shareable
+            fetch.chunks.append(data)
+            fetch.size += len(data)
+            if fetch.open and fetch.size > self.max_buffer:
+                close = True
+            fetch.cond.notify_all()
+        if close:
+            if fetch.shareable is False:
+                with self._lock:
+                    self._stats['not_shareable'] += 1
+            self._close(fetch)
+        if not fetch.open:
+            self._trim(fetch)
+
+    def _trim(self, fetch):
+        """关闭加入后释放所有跟随者都已读过的数据；落后超过缓冲上限的跟随者立即丢弃，领取者从不等待"""
+        with fetch.cond:
+            floor = fetch.size - self.max_buffer
+            slow = [rid for rid, offset in fetch.readers.items() if offset < floor]
+            for rid in slow:
+                del fetch.readers[rid]
+            low = min(fetch.readers.values(), default=fetch.size)
+            while fetch.chunks and fetch.base + len(fetch.chunks[0]) <= low:
+                fetch.base += len(fetch.chunks.pop(0))
+            if slow:
+                fetch.cond.notify_all()
+        if slow:
+            with self._lock:
+                self._stats['dropped_followers'] += len(slow)
+
+    def finish(self, fetch):
+        """领取者结束（正常或出错）；没有任何数据时跟随者各自回源"""
+        with fetch.cond:
+            fetch.done = True
+            if fetch.shareable is None and not fetch.size:
+                fetch.shareable = False
+            fetch.cond.notify_all()
+        self._close(fetch)
+
+    def stream(self, fetch, req_headers, send) -> bool:
+        """跟随者：把共享响应逐块交给 send(data)。响应不可共享时返回 False（调用方自行回源）"""
+        rid = id(req_headers)
+        sent = 0
+        try:
+            with fetch.cond:
+                if not fetch.cond.wait_for(lambda: fetch.shareable is not None or fetch.done, self.wait_timeout):
+                    return self._fallback()
+                if not fetch.shareable or any(req_headers.get(h, '') != fetch.req_headers.get(h, '')
+                                              for h in fetch.vary):
+                    return self._fallback()
+            while True:
+                with fetch.cond:
+                    fetch.cond.wait_for(lambda: rid not in fetch.readers or fetch.size > fetch.readers[rid]
+                                        or fetch.done, self.wait_timeout)
+                    if rid not in fetch.readers:
+                        return True  # dropped for falling too far behind
+                    offset = fetch.readers[rid]
+                    if offset >= fetch.size:
+                        if fetch.done:
+                            return True
+                        continue
+                    pos = fetch.base
+                    pending = []
+                    for chunk in fetch.chunks:
+                        end = pos + len(chunk)
+                        if end > offset:
+                            pending.append(chunk[max(0, offset - pos):])
+                        pos = end
+                for data in pending:
+                    send(data)
+                    sent += len(data)
+                with fetch.cond:
+                    if rid in fetch.readers:
+                        fetch.readers[rid] = fetch.readers[rid] + sum(len(d) for d in pending)
+                    fetch.cond.notify_all()
+        finally:
+            with fetch.cond:
+                fetch.readers.pop(rid, None)
+                fetch.cond.notify_all()
+            if sent:
+                with self._lock:
+                    self._stats['coalesced'] += 1
+                    self._stats['bytes_saved'] += sent
+
+    def _fallback(self):
+        with self._lock:
+            self._stats['fallbacks'] += 1
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['inflight'] = len(self._inflight)
+        return s
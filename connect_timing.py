@@ -0,0 +1,85 @@
+import threading
+
+from collections import OrderedDict
+
+# Adaptive connect timeouts. For every (host, port, route) the observed connect times are smoothed the
+# way TCP estimates its retransmission timeout (RFC 6298): srtt is an EWMA of the samples, rttvar an
+# EWMA of their deviation, and the timeout for the next attempt is srtt + k * rttvar clamped to
+# [min_timeout, max_timeout]. A timed-out attempt doubles the deviation so a merely slow host gets more
+# time on the next try. Destinations without history keep the caller's default timeout.
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+# connects through the SOCKS upstream include the remote hop and feed the circuit breaker, so they are
+# never cut shorter than this
+SOCKS_MIN_TIMEOUT = 1.0
+
+
+class ConnectTimer:
+    def __init__(self, min_timeout=0.1, max_timeout=10.0, k=4.0, max_entries=4096):
+        self.min_timeout = float(min_timeout)
+        self.max_timeout = float(max_timeout)
+        self.k = float(k)
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        # (host, port, route) -> [srtt, rttvar, samples]
+        self._table = OrderedDict()
+        self._stats = {'learned': 0, 'default': 0, 'samples': 0, 'timeouts': 0}
+
+    @staticmethod
+    def key(host, port, route):
+        return str(host).lower(), int(port), route
+
+    def timeout(self, key, default) -> float:
+        """返回本次连接应使用的超时：有历史时由 srtt + k*rttvar 推导，否则使用 default（均受上下限约束）"""
+        floor = max(self.min_timeout, SOCKS_MIN_TIMEOUT) if key[2] == 'socks' else self.min_timeout
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is None:
+                self._stats['default'] += 1
+                return min(max(float(default), floor), self.max_timeout)
+            self._stats['learned'] += 1
+            srtt, rttvar = entry[0], entry[1]
+        return min(max(srtt + self.k * rttvar, floor), self.max_timeout)
+
+    def record(self, key, seconds):
+        """记录一次成功连接的耗时"""
+        with self._lock:
+            self._stats['samples'] += 1
+            entry = self._table.get(key)
+            if entry is None:
+                self._table[key] = [seconds, seconds / 2, 1]
+                if len(self._table) > self.max_entries:
+                    self._table.popitem(last=False)
+                return
+            self._table.move_to_end(key)
+            entry[1] = (1 - BETA) * entry[1] + BETA * abs(entry[0] - seconds)
+            entry[0] = (1 - ALPHA) * entry[0] + ALPHA * seconds
+            entry[2] += 1
+
+    def record_timeout(self, key):
+        """连接超时：加倍偏差（退避），下次尝试给更长的时间"""
+        with self._lock:
+            self._stats['timeouts'] += 1
+            entry = self._table.get(key)
+            if entry is not None:
+                entry[1] = min(entry[1] * 2 + self.min_timeout / self.k, self.max_timeout)
+
+    def snapshot(self, key):
+        """返回 (srtt, rttvar, samples)，没有历史返回 None"""
+        with self._lock:
+            entry = self._table.get(key)
+            return tuple(entry) if entry is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['destinations'] = len(self._table)
+            routes = {}
+            for (host, port, route), (srtt, rttvar, n) in self._table.items():
+                r = routes.setdefault(route, [0, 0.0])
+                r[0] += 1
+                r[1] += srtt
+        s['routes'] = {route: {'destinations': n, 'mean_srtt_ms': round(total / n * 1000, 2)}
+                       for route, (n, total) in routes.items()}
+        return s
@@ -0,0 +1,468 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime, formatdate
+
+# Shared HTTP cache for plain-HTTP GET/HEAD (core of RFC 9111):
+# freshness lifetime, ETag/Last-Modified revalidation, Vary, and a memory tier backed by an
+# optional disk tier. Both tiers are size-limited with LRU eviction; entries evicted from memory
+# are demoted to disk.
+
+# statuses that may be cached with a heuristic lifetime (RFC 9110 15.1)
+HEURISTIC_STATUSES = (200, 203, 204, 206, 300, 301, 308, 404, 405, 410, 414, 501)
+# statuses we are willing to store at all (206 needs range merging, not supported)
+STORABLE_STATUSES = (200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501)
+# headers never stored nor replayed from the cache
+HOP_BY_HOP = ('connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailer', 'transfer-encoding', 'upgrade', 'content-length', 'age')
+# headers a 304 must not overwrite on the stored response (RFC 9111 3.2)
+NOT_UPDATED_BY_304 = ('content-length', 'content-encoding', 'content-type', 'content-range')
+
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX = 24 * 3600
+
+
+def parse_cache_control(value):
+    """解析 Cache-Control 头，返回 {directive: value or True}"""
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' in part:
+            k, v = part.split('=', 1)
+            directives[k.strip().lower()] = v.strip().strip('"')
+        else:
+            directives[part.lower()] = True
+    return directives
+
+
+def parse_http_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except Exception:
+        return None
+
+
+class CacheEntry:
+    def __init__(self, key, status, reason, headers, body, request_time, response_time, vary=None):
+        self.key = key
+        self.status = int(status)
+        self.reason = reason
+        # list of (name, value) in original order, hop-by-hop headers removed
+        self.headers = headers
+        self.body = body
+        self.request_time = request_time
+        self.response_time = response_time
+        self.vary = vary or {}
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(k) + len(v) + 4 for k, v in self.headers) + 256
+
+    def header(self, name):
+        name = name.lower()
+        for k, v in self.headers:
+            if k.lower() == name:
+                return v
+        return None
+
+    def cache_control(self):
+        return parse_cache_control(', '.join(v for k, v in self.headers if k.lower() == 'cache-control'))
+
+    def freshness_lifetime(self):
+        cc = self.cache_control()
+        for directive in ('s-maxage', 'max-age'):
+            if directive in cc:
+                lifetime = _seconds(cc[directive])
+                if lifetime is not None:
+                    return lifetime
+        date = parse_http_date(self.header('date')) or self.response_time
+        expires = self.header('expires')
+        if expires is not None:
+            exp = parse_http_date(expires)
+            # invalid Expires means already expired
+            return max(0, exp - date) if exp is not None else 0
+        last_modified = parse_http_date(self.header('last-modified'))
+        if last_modified is not None and self.status in HEURISTIC_STATUSES and 'no-cache' not in cc:
+            return min(HEURISTIC_MAX, max(0, (date - last_modified) * HEURISTIC_FRACTION))
+        return 0
+
+    def current_age(self, now=None):
+        """按 RFC 9111 4.2.3 计算当前年龄"""
+        now = time.time() if now is None else now
+        date = parse_http_date(self.header('date')) or self.response_time
+        apparent_age = max(0, self.response_time - date)
+        age_value = _seconds(self.header('age')) or 0
+        response_delay = max(0, self.response_time - self.request_time)
+        corrected_initial_age = max(apparent_age, age_value + response_delay)
+        return corrected_initial_age + max(0, now - self.response_time)
+
+    def is_fresh(self, now=None):
+        if 'no-cache' in self.cache_control():
+            return False
+        return self.freshness_lifetime() > self.current_age(now)
+
+    def has_validators(self):
+        return self.header('etag') is not None or self.header('last-modified') is not None
+
+    def to_meta(self):
+        return {'key': self.key, 'status': self.status, 'reason': self.reason, 'headers': self.headers,
+                'request_time': self.request_time, 'response_time': self.response_time, 'vary': self.vary}
+
+    @classmethod
+    def from_meta(cls, meta, body):
+        return cls(meta['key'], meta['status'], meta['reason'], [tuple(h) for h in meta['headers']], body,
+                   meta['request_time'], meta['response_time'], meta.get('vary'))
+
+
+class HttpCache:
+    def __init__(self, memory_limit=32 * 1024 * 1024, disk_dir=None, disk_limit=256 * 1024 * 1024,
+                 max_object_size=8 * 1024 * 1024):
+        self.memory_limit = int(memory_limit)
+        self.disk_dir = disk_dir
+        self.disk_limit = int(disk_limit)
+        self.max_object_size = int(max_object_size)
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()     # key -> CacheEntry
+        self._memory_bytes = 0
+        self._disk = OrderedDict()       # key -> size on disk
+        self._disk_bytes = 0
+        self._vary = {}                  # url -> tuple of lower-case header names from Vary
+        self._stats = {'lookups': 0, 'hits': 0, 'revalidated': 0, 'misses': 0, 'stores': 0,
+                       'bytes_saved': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # ---- keys ----
+    def _variant_key(self, url, req_headers, vary_names=None):
+        if vary_names is None:
+            vary_names = self._vary.get(url, ())
+        if not vary_names:
+            return url
+        return url + '\n' + '\n'.join(f"{n}={req_headers.get(n, '')}" for n in vary_names)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache')
+
+    # ---- lookups ----
+    def lookup(self, url, req_headers):
+        """查找缓存：返回 (entry, state)，state 为 'fresh'、'stale' 或 'miss'。
+        req_headers 为小写头名到值的字典，用于 Vary 匹配和请求侧 Cache-Control"""
+        cc = parse_cache_control(req_headers.get('cache-control'))
+        if 'no-store' in cc:
+            return None, 'miss'
+        with self._lock:
+            self._stats['lookups'] += 1
+            key = self._variant_key(url, req_headers)
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            on_disk = entry is None and key in self._disk
+        if on_disk:
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._insert_memory(entry)
+        if entry is None:
+            return None, 'miss'
+        no_cache = 'no-cache' in cc or 'no-cache' in req_headers.get('pragma', '').lower()
+        max_age = _seconds(cc.get('max-age')) if 'max-age' in cc else None
+        fresh = entry.is_fresh() and not no_cache
+        if fresh and max_age is not None and entry.current_age() > max_age:
+            fresh = False
+        if fresh:
+            return entry, 'fresh'
+        return entry, 'stale'
+
+    def record_hit(self, entry, revalidated=False):
+        with self._lock:
+            self._stats['hits'] += 1
+            if revalidated:
+                self._stats['revalidated'] += 1
+            self._stats['bytes_saved'] += len(entry.body)
+
+    def record_miss(self):
+        with self._lock:
+            self._stats['misses'] += 1
+
+    def conditional_headers(self, entry):
+        """返回用于向源站再验证的条件请求头"""
+        headers = []
+        etag = entry.header('etag')
+        if etag is not None:
+            headers.append(('If-None-Match', etag))
+        last_modified = entry.header('last-modified')
+        if last_modified is not None:
+            headers.append(('If-Modified-Since', last_modified))
+        return headers
+
+    # ---- storing ----
+    def is_storable(self, method, status, resp_headers, req_headers):
+        if method != 'GET' or status not in STORABLE_STATUSES:
+            return False
+        req_cc = parse_cache_control(req_headers.get('cache-control'))
+        cc = parse_cache_control(', '.join(v for k, v in resp_headers if k.lower() == 'cache-control'))
+        if 'no-store' in req_cc or 'no-store' in cc or 'private' in cc:
+            return False
+        names = {k.lower() for k, v in resp_headers}
+        if 'set-cookie' in names and 'public' not in cc:
+            return False
+        if 'authorization' in req_headers and not ('public' in cc or 's-maxage' in cc or 'must-revalidate' in cc):
+            return False
+        for k, v in resp_headers:
+            if k.lower() == 'vary' and '*' in v:
+                return False
+        explicit = ('max-age' in cc or 's-maxage' in cc or 'public' in cc or 'expires' in names)
+        return explicit or 'etag' in names or ('last-modified' in names and status in HEURISTIC_STATUSES)
+
+    def store(self, url, method, status, reason, resp_headers, body, req_headers, request_time, response_time):
+        """存储一个完整响应（body 已解除 chunked 编码），不可缓存时返回 False"""
+        if len(body) > self.max_object_size:
+            return False
+        if not self.is_storable(method, status, resp_headers, req_headers):
+            return False
+        headers = [(k, v) for k, v in resp_headers if k.lower() not in HOP_BY_HOP]
+        vary_names = []
+        for k, v in headers:
+            if k.lower() == 'vary':
+                vary_names.extend(n.strip().lower() for n in v.split(',') if n.strip())
+        vary_names = tuple(sorted(set(vary_names)))
+        with self._lock:
+            if self._vary.get(url, ()) != vary_names:
+                self._drop_url(url)
+                self._vary[url] = vary_names
+            key = self._variant_key(url, req_headers, vary_names)
+            vary = {n: req_headers.get(n, '') for n in vary_names}
+            self._stats['stores'] += 1
+        entry = CacheEntry(key, status, reason, headers, body, request_time, response_time, vary)
+        self._insert_memory(entry)
+        return True
+
+    def freshen(self, entry, resp_headers_304, request_time, response_time):
+        """收到 304 后用新的头部更新已存储的响应并重置时间"""
+        updates = [(k, v) for k, v in resp_headers_304
+                   if k.lower() not in HOP_BY_HOP and k.lower() not in NOT_UPDATED_BY_304]
+        names = {k.lower() for k, v in updates}
+        headers = [(k, v) for k, v in entry.headers if k.lower() not in names] + updates
+        fresh = CacheEntry(entry.key, entry.status, entry.reason, headers, entry.body,
+                           request_time, response_time, entry.vary)
+        self._insert_memory(fresh)
+        return fresh
+
+    def invalidate(self, url):
+        """不安全方法（POST/PUT/DELETE 等）成功后使该 URL 的所有变体失效"""
+        with self._lock:
+            self._drop_url(url)
+
+    def _drop_url(self, url):
+        prefix = url + '\n'
+        for key in [k for k in self._memory if k == url or k.startswith(prefix)]:
+            self._memory_bytes -= self._memory.pop(key).size
+        for key in [k for k in self._disk if k == url or k.startswith(prefix)]:
+            self._remove_disk(key)
+
+    def _insert_memory(self, entry):
+        demoted = []
+        with self._lock:
+            old = self._memory.pop(entry.key, None)
+            if old is not None:
+                self._memory_bytes -= old.size
+            if entry.key in self._disk:
+                self._remove_disk(entry.key)
+            if entry.size > self.memory_limit:
+                demoted.append(entry)
+            else:
+                self._memory[entry.key] = entry
+                self._memory_bytes += entry.size
+            while self._memory_bytes > self.memory_limit and self._memory:
+                key, victim = self._memory.popitem(last=False)
+                self._memory_bytes -= victim.size
+                self._stats['memory_evictions'] += 1
+                demoted.append(victim)
+        if self.disk_dir:
+            for victim in demoted:
+                self._write_disk(victim)
+
+    # ---- disk tier ----
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.cache'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    meta_len = int.from_bytes(f.read(4), 'big')
+                    meta = json.loads(f.read(meta_len).decode('utf-8'))
+                st = os.stat(path)
+                entries.append((st.st_atime, meta['key'], st.st_size))
+                url = meta['key'].split('\n', 1)[0]
+                self._vary[url] = tuple(sorted(meta.get('vary') or {}))
+            except Exception:
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _write_disk(self, entry):
+        if entry.size > self.disk_limit:
+            return
+        path = self._disk_path(entry.key)
+        meta = json.dumps(entry.to_meta()).encode('utf-8')
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(len(meta).to_bytes(4, 'big'))
+                f.write(meta)
+                f.write(entry.body)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+            return
+        size = 4 + len(meta) + len(entry.body)
+        with self._lock:
+            old = self._disk.pop(entry.key, None)
+            if old is not None:
+                self._disk_bytes -= old
+            self._disk[entry.key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.disk_limit and self._disk:
+                key = next(iter(self._disk))
+                self._remove_disk(key)
+                self._stats['disk_evictions'] += 1
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                meta_len = int.from_bytes(f.read(4), 'big')
+                meta = json.loads(f.read(meta_len).decode('utf-8'))
+                body = f.read()
+            if meta.get('key') != key:
+                return None
+            return CacheEntry.from_meta(meta, body)
+        except Exception:
+            with self._lock:
+                self._remove_disk(key)
+            return None
+
+    def _remove_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+        try:
+            os.remove(self._disk_path(key))
+        except Exception:
+            pass
+
+    # ---- responses ----
+    def render(self, entry, head_only=False, not_modified=False):
+        """把缓存条目渲染成发给客户端的完整响应（Connection: close）"""
+        if not_modified:
+            keep = ('cache-control', 'content-location', 'date', 'etag', 'expires', 'vary', 'last-modified')
+            headers = [(k, v) for k, v in entry.headers if k.lower() in keep]
+            status_line = 'HTTP/1.1 304 Not Modified'
+            body = b''
+        else:
+            headers = list(entry.headers)
+            headers.append(('Content-Length', str(len(entry.body))))
+            status_line = f'HTTP/1.1 {entry.status} {entry.reason}'
+            body = b'' if head_only else entry.body
+        if not any(k.lower() == 'date' for k, v in headers):
+            headers.append(('Date', formatdate(usegmt=True)))
+        headers.append(('Age', str(int(entry.current_age()))))
+        headers.append(('X-Cache', 'HIT'))
+        headers.append(('Connection', 'close'))
+        head = status_line + '\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers) + '\r\n'
+        return head.encode('iso-8859-1') + body
+
+    def client_not_modified(self, entry, req_headers):
+        """根据客户端自带的条件头判断是否可以直接回 304"""
+        inm = req_headers.get('if-none-match')
+        if inm is not None:
+            etag = entry.header('etag')
+            if etag is None:
+                return False
+            tags = [t.strip() for t in inm.split(',')]
+            weak = lambda t: t[2:] if t.startswith('W/') else t
+            return '*' in tags or weak(etag) in [weak(t) for t in tags]
+        ims = parse_http_date(req_headers.get('if-modified-since'))
+        lm = parse_http_date(entry.header('last-modified'))
+        return ims is not None and lm is not None and lm <= ims
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['memory_entries'] = len(self._memory)
+            s['memory_bytes'] = self._memory_bytes
+            s['disk_entries'] = len(self._disk)
+            s['disk_bytes'] = self._disk_bytes
+        served = s['hits'] + s['misses']
+        s['hit_ratio'] = round(s['hits'] / served, 4) if served else 0.0
+        return s
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for key in list(self._disk):
+                self._remove_disk(key)
+            self._vary.clear()
+
+
+def parse_response_head(head_bytes):
+    """解析响应头部字节，返回 (status, reason, [(name, value)])"""
+    text = head_bytes.decode('iso-8859-1')
+    lines = text.split('\r\n')
+    parts = lines[0].split(' ', 2)
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+    headers = []
+    for l in lines[1:]:
+        if not l:
+            continue
+        k_v = l.split(':', 1)
+        if len(k_v) == 2:
+            headers.append((k_v[0].strip(), k_v[1].strip()))
+    return status, reason, headers
+
+
+def decode_chunked(data):
+    """解码完整的 chunked 响应体，数据不完整时返回 None"""
+    out = bytearray()
+    pos = 0
+    while True:
+        end = data.find(b'\r\n', pos)
+        if end == -1:
+            return None
+        try:
+            size = int(data[pos:end].split(b';')[0].strip(), 16)
+        except Exception:
+            return None
+        pos = end + 2
+        if size == 0:
+            return bytes(out)
+        if pos + size + 2 > len(data):
+            return None
+        out += data[pos:pos + size]
+        pos += size + 2
@@ -2,7 +2,7 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
-from proxy_server import ProxyServer
+from proxy_server import ProxyServer, options_from_config
 from system_proxy import ProxyConfig
 import queue
 import logging
@@ -10,6 +10,10 @@ import json
 from pathlib import Path
 
 class ProxyGUI:
+    # config.json 中由界面控件直接编辑的键
+    GUI_CONFIG_KEYS = ('proxy_host', 'proxy_port', 'upstream_host', 'upstream_port', 'auto_set_system_proxy',
+                       'bypass_list', 'proxy_list', 'success_ttl', 'fail_ttl')
+
     def __init__(self, root):
         self.root = root
         self.root.title("SOCKS代理转发器")
@@ -35,6 +39,8 @@ class ProxyGUI:
 
         # config path (store next to this module)
         self.config_path = Path(__file__).resolve().parent / 'config.json'
+        # config.json 中没有对应界面控件的高级选项（如缓存设置），保存时原样写回并传给服务器
+        self._extra_config = {}
 
         # 启动轮询队列的循环（在 init_widgets 之后会被调用）
         self.init_widgets()
@@ -127,6 +133,8 @@ class ProxyGUI:
         ttk.Button(btn_frame2, text="保存配置", command=self.save_config).grid(row=0, column=0, padx=5)
         ttk.Button(btn_frame2, text="载入配置", command=self.load_config_file).grid(row=0, column=1, padx=5)
         ttk.Button(btn_frame2, text="清除可达缓存", command=self.clear_reach_cache).grid(row=0, column=2, padx=5)
+        ttk.Button(btn_frame2, text="性能采样", command=self.profile_server).grid(row=0, column=3, padx=5)
+        ttk.Button(btn_frame2, text="应用配置", command=self.apply_config).grid(row=0, column=4, padx=5)
 
         adv_frame.columnconfigure(1, weight=1)
     def load_config(self):
@@ -216,30 +224,21 @@ class ProxyGUI:
             self.log_message("本地代理端口不是有效的整数")
             return
 
-        try:
-            upstream_port = int(self.upstream_port.get())
-        except Exception:
-            self.log_message("上游 SOCKS 端口不是有效的整数")
-            return
-
         # 创建并启动代理服务器
         if self.server is None:
-            # 将 enqueue_log 作为 logger 回调传给后台服务器，服务器线程会将日志入队
-            bypass = [s.strip() for s in self.bypass_entry.get().split(',') if s.strip()] if hasattr(self, 'bypass_entry') else []
-            proxylist = [s.strip() for s in self.proxylist_entry.get().split(',') if s.strip()] if hasattr(self, 'proxylist_entry') else []
-            try:
-                sttl = int(self.success_ttl.get())
-            except Exception:
-                sttl = 300
+            options = self._server_options()
+            if options is None:
+                return
             try:
-                fttl = int(self.fail_ttl.get())
-            except Exception:
-                fttl = 30
-
-            self.server = ProxyServer(local_host=self.proxy_host.get(), local_port=local_port,
-                                      socks_host=self.upstream_host.get(), socks_port=upstream_port,
-                                      logger=self.enqueue_log, success_ttl=sttl, fail_ttl=fttl,
-                                      bypass_list=bypass, proxy_list=proxylist)
+                # 将 enqueue_log 作为 logger 回调传给后台服务器，服务器线程会将日志入队
+                self.server = ProxyServer(logger=self.enqueue_log, **options)
+            except ValueError as e:
+                self.log_message(f"配置无效: {e}")
+                return
+            # POST /reload 重新读取 config.json
+            config_path = self.config_path
+            self.server.config_source = lambda: options_from_config(
+                json.loads(config_path.read_text(encoding='utf-8')), base_dir=config_path.parent)
 
         self.server_thread = threading.Thread(target=self.server.start, daemon=True)
         self.server_thread.start()
@@ -257,6 +256,55 @@ class ProxyGUI:
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         
+    def _server_options(self):
+        """由界面控件与高级配置生成 ProxyServer 参数；端口无效时记录日志并返回 None"""
+        try:
+            local_port = int(self.proxy_port.get())
+        except Exception:
+            self.log_message("本地代理端口不是有效的整数")
+            return None
+        try:
+            upstream_port = int(self.upstream_port.get())
+        except Exception:
+            self.log_message("上游 SOCKS 端口不是有效的整数")
+            return None
+        bypass = [s.strip() for s in self.bypass_entry.get().split(',') if s.strip()] if hasattr(self, 'bypass_entry') else []
+        proxylist = [s.strip() for s in self.proxylist_entry.get().split(',') if s.strip()] if hasattr(self, 'proxylist_entry') else []
+        try:
+            sttl = int(self.success_ttl.get())
+        except Exception:
+            sttl = 300
+        try:
+            fttl = int(self.fail_ttl.get())
+        except Exception:
+            fttl = 30
+
+        try:
+            extra = options_from_config(self._extra_config, base_dir=self.config_path.parent)
+        except Exception as e:
+            self.log_message(f"高级配置无效，已忽略: {e}")
+            extra = {}
+        return dict(extra, local_host=self.proxy_host.get(), local_port=local_port,
+                    socks_host=self.upstream_host.get(), socks_port=upstream_port,
+                    success_ttl=sttl, fail_ttl=fttl, bypass_list=bypass, proxy_list=proxylist)
+
+    def apply_config(self):
+        """把界面上的配置热应用到运行中的服务器（规则、TTL 与上游），不中断已有连接"""
+        try:
+            if not self.server:
+                self.log_message('没有运行中的服务器可应用配置')
+                return
+            options = self._server_options()
+            if options is None:
+                return
+            report = self.server.reload(**options)
+            self.log_message(f"已应用配置: {', '.join(report['applied']) or '无变化'} "
+                             f"(编译 {report['compile_ms']} ms, 替换 {report['swap_ms']} ms)")
+            if report['restart_required']:
+                self.log_message(f"以下设置需重启代理后生效: {', '.join(report['restart_required'])}")
+        except Exception as e:
+            self.log_message(f'应用配置失败，保持当前配置: {e}')
+
     def stop_proxy(self):
         """停止代理"""
         # 停止服务器
@@ -298,6 +346,8 @@ class ProxyGUI:
             'success_ttl': int(self.success_ttl.get()) if self.success_ttl.get().isdigit() else 300,
             'fail_ttl': int(self.fail_ttl.get()) if self.fail_ttl.get().isdigit() else 30
         }
+        for k, v in self._extra_config.items():
+            cfg.setdefault(k, v)
         try:
             p = self.config_path
             p.write_text(json.dumps(cfg, indent=2), encoding='utf-8')
@@ -326,6 +376,7 @@ class ProxyGUI:
                     pass
                 return
             data = json.loads(p.read_text(encoding='utf-8'))
+            self._extra_config = {k: v for k, v in data.items() if k not in self.GUI_CONFIG_KEYS}
             self.proxy_host.set(data.get('proxy_host', 'localhost'))
             self.proxy_port.set(str(data.get('proxy_port', '8080')))
             self.upstream_host.set(data.get('upstream_host', 'localhost'))
@@ -366,6 +417,21 @@ class ProxyGUI:
         except Exception as e:
             self.log_message(f'清除缓存失败: {e}')
         
+    def profile_server(self):
+        """对运行中的服务器采样（时长取 profile_seconds），再次点击提前结束"""
+        try:
+            if not self.server:
+                self.log_message('没有运行中的服务器可采样')
+                return
+            if self.server.profiler is not None and self.server.profiler.running:
+                self.server.stop_profile()
+                return
+            path = self.server.start_profile()
+            if path:
+                self.log_message(f'开始性能采样，结果将写入 {path}')
+        except Exception as e:
+            self.log_message(f'性能采样失败: {e}')
+
     def run_proxy(self):
         """运行代理服务器"""
         try:
@@ -0,0 +1,109 @@
+import json
+
+# Proxy Auto-Config generation from compiled RuleSet objects.
+# Domains are emitted as JS object keys so FindProxyForURL does one hash lookup per host label,
+# which keeps evaluation cheap even with thousands of rules. IP literals are matched against
+# networks; with resolve_ips (the server's rule_resolve_ips) a hostname that misses the domain
+# rules is resolved once with dnsResolve() and its address checked against the networks too,
+# as the server does. Browsers only hand IPv4 results to isInNet(), so IPv6 networks stay server-side.
+
+PAC_CONTENT_TYPE = 'application/x-ns-proxy-autoconfig'
+
+_PAC_TEMPLATE = """\
+var PROXY = %(proxy)s;
+var DIRECT = "DIRECT";
+var hasOwn = Object.prototype.hasOwnProperty;
+var RESOLVE_IPS = %(resolve_ips)s;
+var proxyRules = %(proxy_rules)s;
+var bypassRules = %(bypass_rules)s;
+var isIPv4 = /^\\d+\\.\\d+\\.\\d+\\.\\d+$/;
+
+function matchDomain(host, table) {
+    var h = host;
+    while (true) {
+        if (hasOwn.call(table, h)) {
+            return true;
+        }
+        var i = h.indexOf(".");
+        if (i < 0) {
+            return false;
+        }
+        h = h.substring(i + 1);
+    }
+}
+
+function matchNets(ip, nets) {
+    for (var i = 0; i < nets.length; i++) {
+        if (isInNet(ip, nets[i][0], nets[i][1])) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function matchRules(host, rules, resolved) {
+    if (hasOwn.call(rules.ips, host)) {
+        return true;
+    }
+    if (isIPv4.test(host)) {
+        return matchNets(host, rules.nets);
+    }
+    if (matchDomain(host, rules.domains)) {
+        return true;
+    }
+    // CIDR 规则同样匹配域名解析得到的地址
+    if (RESOLVE_IPS && rules.nets.length) {
+        var ip = resolved();
+        return !!ip && matchNets(ip, rules.nets);
+    }
+    return false;
+}
+
+function FindProxyForURL(url, host) {
+    host = host.toLowerCase();
+    if (host.charAt(0) === "[") {
+        host = host.substring(1, host.length - 1);
+    }
+    var ip;
+    function resolved() {
+        if (ip === undefined) {
+            ip = dnsResolve(host);
+        }
+        return ip;
+    }
+    if (matchRules(host, proxyRules, resolved)) {
+        return PROXY;
+    }
+    if (matchRules(host, bypassRules, resolved)) {
+        return DIRECT;
+    }
+    return PROXY;
+}
+"""
+
+
+def _rules_to_js(ruleset):
+    domains = {}
+    ips = {}
+    nets = []
+    if ruleset is not None:
+        for d in sorted(ruleset.domains):
+            domains[d] = 1
+        for ip in sorted(ruleset.ips, key=lambda a: (a.version, int(a))):
+            ips[str(ip)] = 1
+        for net in ruleset.networks:
+            # isInNet() only understands IPv4 dotted masks
+            if net.version == 4:
+                nets.append([str(net.network_address), str(net.netmask)])
+    return json.dumps({'domains': domains, 'ips': ips, 'nets': nets}, separators=(',', ':'))
+
+
+def generate_pac(bypass_rules, proxy_rules, proxy_addr, resolve_ips=False) -> str:
+    """根据编译后的绕过/强制代理规则生成 PAC 脚本。proxy_addr 为 'host:port'；
+    resolve_ips 为真时域名未命中的主机经 dnsResolve() 解析后再与 CIDR 规则比较"""
+    return _PAC_TEMPLATE % {
+        'proxy': json.dumps(f'PROXY {proxy_addr}'),
+        'resolve_ips': json.dumps(bool(resolve_ips)),
+        'proxy_rules': _rules_to_js(proxy_rules),
+        'bypass_rules': _rules_to_js(bypass_rules),
+    }
@@ -0,0 +1,193 @@
+import heapq
+import math
+import select
+import socket
+import threading
+import time
+
+# Predictive pre-connect: an exponentially decayed access count per (host, port) together with the
+# route the last connection took. A background thread keeps a few already-connected spare sockets for
+# the most frequently visited destinations, so a new request for one of them skips the direct connect
+# or SOCKS handshake entirely.
+
+# destinations need at least this (decayed) score before spares are kept for them
+MIN_SCORE = 2.0
+# bound on the number of tracked destinations; the lowest scores are dropped beyond it
+MAX_TRACKED = 4096
+
+
+class Preconnector:
+    def __init__(self, opener, top_n=20, spares=1, spare_idle=15.0, half_life=600.0, interval=1.0, logger=None):
+        # opener(host, port, route) -> connected socket or None; route is 'direct' or 'socks'
+        self._opener = opener
+        self.top_n = int(top_n)
+        self.spares = max(1, int(spares))
+        # seconds a spare may sit unused before it is closed (origins drop idle connections)
+        self.spare_idle = float(spare_idle)
+        self.half_life = float(half_life)
+        self.interval = float(interval)
+        self._log = logger
+        self._lock = threading.Lock()
+        # (host, port) -> [score, updated_at, route]
+        self._scores = {}
+        # (host, port) -> list of (sock, route, created_at)
+        self._pool = {}
+        self._running = False
+        self._thread = None
+        # set when a spare is taken or a tracked destination misses, so refills don't wait for the interval
+        self._wake = threading.Event()
+        self._stats = {'hits': 0, 'misses': 0, 'opened': 0, 'failed': 0, 'expired': 0, 'stale': 0}
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='Preconnector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self.clear()
+
+    # ---- access model ----
+    def _decayed(self, entry, now):
+        return entry[0] * math.pow(0.5, (now - entry[1]) / self.half_life)
+
+    def record(self, host, port, route):
+        """记录一次到 (host, port) 的成功连接及其路由，用于预测热门目标"""
+        key = (str(host).lower(), int(port))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                self._scores[key] = [1.0, now, route]
+                if len(self._scores) > MAX_TRACKED:
+                    self._prune(now)
+            else:
+                entry[0] = self._decayed(entry, now) + 1.0
+                entry[1] = now
+                entry[2] = route
+
+    def _prune(self, now):
+        keep = heapq.nlargest(MAX_TRACKED // 2, self._scores.items(), key=lambda kv: self._decayed(kv[1], now))
+        self._scores = dict(keep)
+
+    def top(self, now=None):
+        """返回当前得分最高的目标 [((host, port), route), ...]"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ranked = heapq.nlargest(self.top_n, ((self._decayed(e, now), key, e[2]) for key, e in self._scores.items()))
+        return [(key, route) for score, key, route in ranked if score >= MIN_SCORE]
+
+    # ---- spare sockets ----
+    @staticmethod
+    def _alive(sock) -> bool:
+        """空闲备用连接是否仍然可用：可读且读到 EOF/错误说明对端已关闭"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+            return sock.recv(1, socket.MSG_PEEK) != b''
+        except Exception:
+            return False
+
+    def claim(self, host, port, allow_direct=True):
+        """取出一条到 (host, port) 的备用连接，返回 (socket, route)；没有可用连接时返回 None"""
+        key = (str(host).lower(), int(port))
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                spares = self._pool.get(key) or []
+                pick = next((i for i, spare in enumerate(spares) if allow_direct or spare[1] != 'direct'), None)
+                if pick is None:
+                    # only destinations we model count as misses; one-off hosts never get spares
+                    if key in self._scores:
+                        self._stats['misses'] += 1
+                        self._wake.set()
+                    return None
+                sock, route, created = spares.pop(pick)
+            if now - created < self.spare_idle and self._alive(sock):
+                with self._lock:
+                    self._stats['hits'] += 1
+                self._wake.set()
+                return sock, route
+            self._close(sock)
+            with self._lock:
+                self._stats['stale'] += 1
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        """关闭所有备用连接（规则或上游变化后调用）"""
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for spares in pool.values():
+            for sock, route, created in spares:
+                self._close(sock)
+
+    def _run(self):
+        while self._running:
+            try:
+                self.refill()
+            except Exception as e:
+                if self._log:
+                    self._log(f"Pre-connect refill error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refill(self):
+        """关闭过期或不再热门的备用连接，并为热门目标补足备用连接"""
+        now = time.monotonic()
+        wanted = dict(self.top(now))
+        expired = []
+        with self._lock:
+            for key in list(self._pool):
+                keep = []
+                for spare in self._pool[key]:
+                    if key in wanted and now - spare[2] < self.spare_idle:
+                        keep.append(spare)
+                    else:
+                        expired.append(spare[0])
+                if keep:
+                    self._pool[key] = keep
+                else:
+                    del self._pool[key]
+            self._stats['expired'] += len(expired)
+            missing = [(key, route, self.spares - len(self._pool.get(key, ())))
+                       for key, route in wanted.items() if len(self._pool.get(key, ())) < self.spares]
+        for sock in expired:
+            self._close(sock)
+        for (host, port), route, count in missing:
+            for _ in range(count):
+                if not self._running:
+                    return
+                sock = None
+                try:
+                    sock = self._opener(host, port, route)
+                except Exception:
+                    sock = None
+                if sock is not None and not self._running:
+                    self._close(sock)
+                    return
+                with self._lock:
+                    if sock is None:
+                        self._stats['failed'] += 1
+                        break
+                    self._stats['opened'] += 1
+                    self._pool.setdefault((host, port), []).append((sock, route, time.monotonic()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['spares'] = sum(len(v) for v in self._pool.values())
+            s['tracked'] = len(self._scores)
+        lookups = s['hits'] + s['misses']
+        s['hit_ratio'] = round(s['hits'] / lookups, 3) if lookups else 0.0
+        return s
@@ -0,0 +1,157 @@
+import threading
+import time
+
+from collections import deque
+
+# Priority scheduling between interactive and bulk flows sharing the SOCKS upstream. Every relay loop
+# reports each chunk it forwards; a flow is interactive while it is young or small and turns bulk once it
+# has both run longer than `bulk_seconds` and moved more than `bulk_bytes` (a long-lived but quiet
+# connection such as a chat socket stays interactive). Bulk never turns back.
+#
+# The scheduler measures the aggregate throughput of all scheduled flows and keeps a slowly decaying
+# estimate of the link capacity. While interactive traffic has been seen within the last `active_window`
+# seconds, the bulk class as a whole is held to its weighted share of that capacity by a token bucket:
+# a bulk relay loop that overdraws the bucket sleeps, stops reading its upstream socket, and TCP
+# backpressure leaves the rest of the link to interactive flows. With no interactive traffic bulk flows
+# run unthrottled, so an idle link is never wasted.
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+CLASSES = (INTERACTIVE, BULK)
+
+# throughput is sampled over ticks of this length and smoothed
+_TICK = 0.1
+_ALPHA = 0.3
+# the capacity estimate halves in roughly 35 s without a new peak
+_CAPACITY_DECAY = 0.998
+# a single wait never exceeds this, so a bulk loop still notices stop requests and slow ticks
+_MAX_WAIT = 0.25
+_TTFB_SAMPLES = 1024
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class FlowScheduler:
+    def __init__(self, bulk_bytes=1024 * 1024, bulk_seconds=2.0, interactive_weight=4, bulk_weight=1,
+                 active_window=0.5, min_bulk_rate=64 * 1024):
+        self.bulk_bytes = int(bulk_bytes)
+        self.bulk_seconds = float(bulk_seconds)
+        self.interactive_weight = max(1e-3, float(interactive_weight))
+        self.bulk_weight = max(1e-3, float(bulk_weight))
+        self.active_window = float(active_window)
+        self.min_bulk_rate = float(min_bulk_rate)
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._tick_at = now
+        self._window = {c: 0 for c in CLASSES}
+        self._rate = {c: 0.0 for c in CLASSES}
+        self._capacity = 0.0
+        self._last_interactive = 0.0
+        self._tokens = 0.0
+        self._refill_at = now
+        self._active = {c: 0 for c in CLASSES}
+        self._ttfb = {c: deque(maxlen=_TTFB_SAMPLES) for c in CLASSES}
+        self._stats = {c: {'flows': 0, 'bytes': 0, 'delayed_chunks': 0, 'delay_seconds': 0.0} for c in CLASSES}
+        self._stats[BULK]['demoted'] = 0
+
+    def classify(self, flow) -> str:
+        """按已传输字节数与持续时间给流分类；一旦成为 bulk 不再回到 interactive"""
+        if flow.priority == BULK:
+            return BULK
+        if flow.bytes_up + flow.bytes_down >= self.bulk_bytes and time.time() - flow.started >= self.bulk_seconds:
+            return BULK
+        return INTERACTIVE
+
+    def _tick(self, now):
+        dt = now - self._tick_at
+        if dt < _TICK:
+            return
+        total = 0.0
+        for c in CLASSES:
+            self._rate[c] = _ALPHA * (self._window[c] / dt) + (1 - _ALPHA) * self._rate[c]
+            self._window[c] = 0
+            total += self._rate[c]
+        self._capacity = max(self._capacity * _CAPACITY_DECAY ** (dt / _TICK), total)
+        self._tick_at = now
+
+    def bulk_rate(self) -> float:
+        """交互流活跃时 bulk 类整体允许的速率（字节/秒），否则为 0（不限速）"""
+        if time.monotonic() - self._last_interactive > self.active_window:
+            return 0.0
+        share = self.bulk_weight / (self.bulk_weight + self.interactive_weight)
+        return max(self.min_bulk_rate, self._capacity * share)
+
+    def on_bytes(self, flow, nbytes):
+        """转发循环每转发一块数据调用一次；bulk 流在交互流活跃且超出份额时在这里等待"""
+        klass = self.classify(flow)
+        wait = 0.0
+        with self._lock:
+            if flow.priority != klass:
+                self._active[flow.priority] -= 1
+                self._active[klass] += 1
+                self._stats[BULK]['demoted'] += 1
+                flow.priority = klass
+            now = time.monotonic()
+            self._tick(now)
+            self._window[klass] += nbytes
+            self._stats[klass]['bytes'] += nbytes
+            if klass == INTERACTIVE:
+                self._last_interactive = now
+                return
+            rate = self.bulk_rate()
+            if not rate:
+                # 链路上没有交互流：bulk 不受限，交互流出现后从空桶重新计量
+                self._tokens = 0.0
+                self._refill_at = now
+                return
+            self._tokens = min(rate * _TICK, self._tokens + (now - self._refill_at) * rate)
+            self._refill_at = now
+            self._tokens -= nbytes
+            if self._tokens < 0:
+                wait = min(_MAX_WAIT, -self._tokens / rate)
+                self._stats[BULK]['delayed_chunks'] += 1
+                self._stats[BULK]['delay_seconds'] += wait
+        if wait:
+            time.sleep(wait)
+
+    def start(self, flow):
+        """新流开始参与调度（默认交互类）"""
+        flow.priority = INTERACTIVE
+        with self._lock:
+            self._active[INTERACTIVE] += 1
+
+    def finish(self, flow):
+        """流结束：按最终类别记录首字节延迟"""
+        if flow.priority is None:
+            return
+        with self._lock:
+            self._active[flow.priority] -= 1
+            self._stats[flow.priority]['flows'] += 1
+            if flow.first_byte is not None:
+                self._ttfb[flow.priority].append(flow.first_byte - flow.started)
+        flow.priority = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._tick(time.monotonic())
+            s = {}
+            for c in CLASSES:
+                cs = dict(self._stats[c])
+                # flows counts finished flows by final class plus the ones currently in the class
+                cs['flows'] += self._active[c]
+                cs['delay_seconds'] = round(cs['delay_seconds'], 3)
+                cs['active'] = self._active[c]
+                cs['rate_kbps'] = round(self._rate[c] / 1024, 1)
+                ttfb = list(self._ttfb[c])
+                for name, q in (('ttfb_p50_ms', 0.5), ('ttfb_p99_ms', 0.99)):
+                    v = _percentile(ttfb, q)
+                    cs[name] = None if v is None else round(v * 1000, 1)
+                s[c] = cs
+            s['capacity_kbps'] = round(self._capacity / 1024, 1)
+            s['bulk_limit_kbps'] = round(self.bulk_rate() / 1024, 1)
+        return s
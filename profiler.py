@@ -0,0 +1,133 @@
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter
+
+# On-demand sampling profiler. While running, a background thread wakes every `interval` seconds, takes
+# the stack of every other thread from sys._current_frames() and counts identical stacks. When the
+# duration is over the counts are written in collapsed-stack format ("thread;frame;frame count" per line),
+# which flamegraph.pl, speedscope and inferno read directly. Nothing is imported or running until a
+# profile is requested, so the proxy pays nothing while the profiler is off.
+#
+# Samples are wall-clock: a thread blocked in poll()/accept() is counted in the function that waits.
+# Pass idle=False to drop samples whose innermost frame is one of the known wait points.
+
+# thread names like "Thread-12 (handle_client)" are folded to "Thread (handle_client)"
+_THREAD_NUM = re.compile(r'-\d+')
+# (file, function) of the innermost frame when a thread is only waiting
+IDLE_FRAMES = {
+    ('relay.py', 'poll'), ('buffer_pool.py', 'wait'), ('socket.py', 'accept'), ('threading.py', 'wait'),
+    ('tunnel_reaper.py', '_run'), ('preconnect.py', '_run'), ('access_log.py', '_run'),
+    ('circuit_breaker.py', '_probe_loop'), ('queue.py', 'get'), ('selectors.py', 'select'),
+    ('threading.py', '_wait_for_tstate_lock'),
+}
+
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, output_dir=None, idle=True, logger=None):
+        self.interval = max(0.001, float(interval))
+        self.output_dir = output_dir or os.getcwd()
+        self.idle = bool(idle)
+        self._log = logger
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.path = None
+        self._stats = {'runs': 0, 'samples': 0, 'stacks': 0, 'overruns': 0, 'last_path': None}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=30.0, path=None):
+        """开始采样 duration 秒，结束后写出折叠栈文件；已在采样时返回 None，否则返回输出路径"""
+        with self._lock:
+            if self.running:
+                return None
+            if path is None:
+                path = os.path.join(self.output_dir, time.strftime('profile-%Y%m%d-%H%M%S.collapsed'))
+            self.path = path
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(float(duration), path),
+                                            name='SamplingProfiler', daemon=True)
+            self._thread.start()
+        if self._log:
+            self._log(f"Profiling for {duration:.0f}s every {self.interval * 1000:.0f} ms -> {path}")
+        return path
+
+    def stop(self, timeout=5.0):
+        """提前结束采样（已采集的样本仍会写出）"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _sample(self, counts, own):
+        names = {t.ident: _THREAD_NUM.sub('', t.name) for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.idle and (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread'))
+            stack.reverse()
+            counts[';'.join(stack)] += 1
+
+    def _run(self, duration, path):
+        counts = Counter()
+        own = threading.get_ident()
+        samples = overruns = 0
+        deadline = time.monotonic() + duration
+        next_at = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            self._sample(counts, own)
+            samples += 1
+            # 固定节拍采样；采样本身超过间隔时跳过错过的节拍而不是追赶
+            next_at += self.interval
+            if next_at < time.monotonic():
+                overruns += 1
+                next_at = time.monotonic() + self.interval
+            self._stop.wait(max(0.0, next_at - time.monotonic()))
+        try:
+            self.write(counts, path)
+        except Exception as e:
+            if self._log:
+                self._log(f"Failed to write profile {path}: {e}")
+            path = None
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['samples'] += samples
+            self._stats['stacks'] += len(counts)
+            self._stats['overruns'] += overruns
+            self._stats['last_path'] = path
+        if self._log and path:
+            self._log(f"Profile written to {path} ({samples} samples, {len(counts)} distinct stacks)")
+
+    @staticmethod
+    def write(counts, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for stack, n in sorted(counts.items()):
+                f.write(f"{stack} {n}\n")
+        os.replace(tmp, path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s['running'] = self.running
+        s['interval_ms'] = round(self.interval * 1000, 3)
+        return s
@@ -3,7 +3,17 @@ import threading
 import time
 import logging
 import ipaddress
-from urllib.parse import urlparse
+import json
+import os
+from urllib.parse import urlparse, parse_qs
+
+from collections import OrderedDict
+
+from rules import RuleSet, CompiledRuleSet, build_rules
+from tunnel_reaper import TunnelReaper
+from sockopts import SocketProfile
+from buffer_pool import BufferPool, pooled_chunks
+from relay import relay, RelayStats
 
 # optional dependency: PySocks (pip install pysocks)
 try:
@@ -14,33 +24,447 @@ except Exception:
     HAS_PYSOCKS = False
 
 
+class UpstreamError(Exception):
+    """直连与 SOCKS 回退均无法建立上游连接"""
+
+
+class UpstreamUnavailable(UpstreamError):
+    """上游 SOCKS 断路器处于打开状态，未尝试连接"""
+
+
+if HAS_PYSOCKS:
+    class _SocksSocket(socks.socksocket):
+        """记录 SOCKS5 握手进度：开始写 CONNECT 请求的目标地址时，上游已完成问候与认证"""
+        greeted = False
+
+        def _write_SOCKS5_address(self, addr, file):
+            self.greeted = True
+            return super()._write_SOCKS5_address(addr, file)
+
+
+class Flow:
+    """一次客户端请求或隧道的上下文：客户端地址、目标与双向字节数，贯穿各转发循环"""
+    __slots__ = ('client', 'host', 'port', 'method', 'route', 'status', 'bytes_up', 'bytes_down', 'started',
+                 'connect_time', 'dest_slot', 'first_byte', 'priority', 'sni')
+
+    def __init__(self, client=None):
+        self.client = client
+        self.host = None
+        self.port = None
+        # request method, 'CONNECT' for tunnels and 'SOCKS5' for native SOCKS clients
+        self.method = None
+        # 'direct' or 'socks' once an upstream connection is open; 'cache' / 'local' when answered here
+        self.route = None
+        # HTTP status sent to the client (SOCKS5 reply code for SOCKS clients)
+        self.status = None
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.started = time.time()
+        # seconds spent opening the upstream connection
+        self.connect_time = None
+        # destination key holding a connection slot in the shaper, released by handle_client
+        self.dest_slot = None
+        # wall time of the first byte relayed to the client
+        self.first_byte = None
+        # 'interactive' / 'bulk' while scheduled by the flow scheduler (SOCKS upstream only)
+        self.priority = None
+        # TLS SNI host name of a CONNECT to an IP literal (sni_peek)
+        self.sni = None
+
+
 class ProxyServer:
     def __init__(self, local_host='localhost', local_port=8080, socks_host='localhost', socks_port=1080,
                  logger=None, success_ttl: int = 300, fail_ttl: int = 30,
-                 bypass_list=None, proxy_list=None, log_level=None):
+                 bypass_list=None, proxy_list=None, log_level=None, pac_enabled=True,
+                 cache_enabled=False, cache_memory_mb=32, cache_dir=None, cache_disk_mb=256,
+                 cache_max_object_mb=8, client_rate=0, client_burst=0, dest_rate=0, dest_burst=0,
+                 max_conns_per_client=0, max_conns_per_dest=0, socks_inbound=False, socks_listen_port=0,
+                 tunnel_idle_timeout=300, tunnel_max_lifetime=0, rule_files=None, rule_snapshot=None,
+                 rule_base_dir=None, rule_resolve_ips=True, socket_options=None, preconnect_top_n=0,
+                 preconnect_spares=1, preconnect_idle=15, preconnect_half_life=600, access_log=None,
+                 access_log_format='jsonl', access_log_max_mb=64, access_log_backups=5, access_log_queue=10000,
+                 socks_breaker_threshold=5, socks_breaker_probe_interval=10, adaptive_timeouts=True,
+                 connect_timeout_min=0.05, connect_timeout_max=10.0, connect_timeout_k=4.0, buffer_pool_mb=64,
+                 buffer_slab_kb=16, relay_high_water_kb=256, relay_low_water_kb=64, profile_dir=None,
+                 profile_interval_ms=10, profile_seconds=30, local_dns_list=None, coalesce_requests=False,
+                 coalesce_buffer_mb=8, priority_scheduling=False, priority_bulk_kb=1024, priority_bulk_seconds=2,
+                 priority_interactive_weight=4, priority_bulk_weight=1, route_selection=False,
+                 route_probe_interval=300, route_switch_margin=1.25, sni_peek=False, sni_peek_ports=(443,),
+                 sni_peek_timeout=1.0):
+        # constructor options as given; reload() diffs a new configuration against them
+        self._options = {k: v for k, v in locals().items() if k not in ('self', 'logger')}
         self.local_host = local_host
         self.local_port = local_port
-        self.socks_host = socks_host
-        self.socks_port = int(socks_port)
+        # (host, port) of the upstream SOCKS5 server, replaced as a whole by reload()
+        self._upstream = (socks_host, int(socks_port))
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # native SOCKS5 inbound: auto-detected on the main port when socks_inbound is set,
+        # and/or served on a separate socks_listen_port
+        self.socks_inbound = bool(socks_inbound)
+        self.socks_listen_port = int(socks_listen_port or 0)
+        self._socks_listener = None
         self.running = False
+        # set once the listeners accept connections
+        self.ready = threading.Event()
         # logger may be a callable for GUI integration; also use stdlib logging
         self.logger = logger
         self._logger = logging.getLogger('ProxyServer')
         if log_level is not None:
             self._logger.setLevel(log_level)
+        # per-role socket options (listener / client / direct / socks); raises ValueError on a bad profile
+        self.sockopts = SocketProfile(socket_options, logger=self._log)
+        # all socket reads borrow fixed-size slabs from one pool with a total memory budget
+        self.buffer_pool = BufferPool(slab_size=int(float(buffer_slab_kb) * 1024),
+                                      budget=int(float(buffer_pool_mb) * 1024 * 1024))
+        # per-direction write queue limits of a tunnel: reading pauses above high, resumes below low
+        self.relay_high_water = int(float(relay_high_water_kb) * 1024)
+        self.relay_low_water = int(float(relay_low_water_kb) * 1024)
+        if not 0 <= self.relay_low_water < self.relay_high_water:
+            raise ValueError("relay_low_water_kb must be lower than relay_high_water_kb")
+        self.relay_stats = RelayStats()
 
-        # reachability cache: (host,port) -> (success:bool, expires_at:float)
-        self._reach_cache = {}
+        # reachability cache: (host,port) -> (success:bool, expires_at:float), LRU-bounded
+        self._reach_cache = OrderedDict()
+        self._reach_lock = threading.Lock()
         self._success_ttl = int(success_ttl)
         self._fail_ttl = int(fail_ttl)
 
         # lists for bypassing or forcing proxy. Accept list of domains, ips, or CIDR.
-        self.bypass_list = bypass_list or []
-        self.proxy_list = proxy_list or []
-        # keep track of client threads so we can attempt to join them on stop
+        # compiled into RuleSet objects by set_rules(); the PAC script is derived from them.
+        # Bulk rule files can be added and compiled into a memory-mapped snapshot (rule_snapshot).
+        self.pac_enabled = bool(pac_enabled)
+        self._pac_cache = {}
+        self._pac_lock = threading.Lock()
+        self.rule_base_dir = rule_base_dir
+        # also match CIDR rules against the addresses a hostname resolves to
+        self.rule_resolve_ips = bool(rule_resolve_ips)
+        self._dns_cache = OrderedDict()
+        self._dns_lock = threading.Lock()
+        self._dns_stats = {'lookups': 0, 'lookup_seconds': 0.0, 'failures': 0, 'cache_hits': 0,
+                           'avoided': 0, 'socks_by_name': 0, 'socks_by_ip': 0}
+        # names on the SOCKS path are passed to the upstream (ATYP 0x03) unless listed here, in which case
+        # they are resolved locally and the address is sent instead (e.g. intranet / split-horizon names)
+        self.local_dns_list = list(local_dns_list or [])
+        self._local_dns_rules = RuleSet(self.local_dns_list)
+        self.set_rules(bypass_list, proxy_list, rule_files, rule_snapshot)
+        # hot reload (SIGHUP, POST /reload, GUI): config_source returns fresh constructor options,
+        # usually options_from_config() of the re-read config.json
+        self.config_source = None
+        self._reload_lock = threading.Lock()
+        self._reload_stats = {'reloads': 0, 'failures': 0, 'last': None}
+
+        # optional shared HTTP cache for plain-HTTP GET/HEAD
+        self.http_cache = None
+        if cache_enabled:
+            from http_cache import HttpCache
+            self.http_cache = HttpCache(memory_limit=int(float(cache_memory_mb) * 1024 * 1024),
+                                        disk_dir=cache_dir or None,
+                                        disk_limit=int(float(cache_disk_mb) * 1024 * 1024),
+                                        max_object_size=int(float(cache_max_object_mb) * 1024 * 1024))
+        # optional per-client / per-destination rate limits and connection caps
+        self.shaper = None
+        if client_rate or dest_rate or max_conns_per_client or max_conns_per_dest:
+            from shaping import TrafficShaper
+            self.shaper = TrafficShaper(client_rate=client_rate, client_burst=client_burst,
+                                        dest_rate=dest_rate, dest_burst=dest_burst,
+                                        max_conns_per_client=max_conns_per_client,
+                                        max_conns_per_dest=max_conns_per_dest)
+        # idle / max-lifetime limits for CONNECT and SOCKS5 tunnels, enforced by one timer wheel
+        self.reaper = TunnelReaper(idle_timeout=tunnel_idle_timeout, max_lifetime=tunnel_max_lifetime,
+                                   logger=self._log)
+        # per-destination connect timeouts learned from observed connect times
+        self.connect_timer = None
+        if adaptive_timeouts:
+            from connect_timing import ConnectTimer
+            self.connect_timer = ConnectTimer(min_timeout=connect_timeout_min, max_timeout=connect_timeout_max,
+                                              k=connect_timeout_k)
+        # fail fast while the upstream SOCKS proxy is down; probes close the breaker when it recovers
+        self.socks_breaker = None
+        if socks_breaker_threshold:
+            from circuit_breaker import CircuitBreaker
+            self.socks_breaker = CircuitBreaker(self._probe_socks, failure_threshold=socks_breaker_threshold,
+                                                probe_interval=socks_breaker_probe_interval,
+                                                name=f"SOCKS upstream {self.socks_host}:{self.socks_port}",
+                                                logger=self._log)
+        # optional warm spare connections for the most visited destinations
+        self.preconnect = None
+        if preconnect_top_n:
+            from preconnect import Preconnector
+            self.preconnect = Preconnector(self._preconnect_open, top_n=preconnect_top_n, spares=preconnect_spares,
+                                           spare_idle=preconnect_idle, half_life=preconnect_half_life,
+                                           logger=self._log)
+        # optional structured access log, written in batches by a background thread
+        self.access_log = None
+        if access_log:
+            from access_log import AccessLog
+            path = access_log
+            if rule_base_dir and not os.path.isabs(path):
+                path = os.path.join(rule_base_dir, path)
+            self.access_log = AccessLog(path, fmt=access_log_format,
+                                        max_bytes=int(float(access_log_max_mb) * 1024 * 1024),
+                                        backups=access_log_backups, queue_size=access_log_queue)
+        # optional coalescing of concurrent identical plain-HTTP GETs into one upstream fetch
+        self.coalescer = None
+        if coalesce_requests:
+            from coalesce import Coalescer
+            self.coalescer = Coalescer(max_buffer=int(float(coalesce_buffer_mb) * 1024 * 1024))
+        # optional weighted scheduling of interactive vs bulk flows on the SOCKS upstream
+        self.scheduler = None
+        if priority_scheduling:
+            from priority import FlowScheduler
+            self.scheduler = FlowScheduler(bulk_bytes=int(float(priority_bulk_kb) * 1024),
+                                           bulk_seconds=priority_bulk_seconds,
+                                           interactive_weight=priority_interactive_weight,
+                                           bulk_weight=priority_bulk_weight)
+        # CONNECT to an IP literal: read the TLS ClientHello first and route by its SNI host name
+        self.sni_peek = bool(sni_peek)
+        self.sni_peek_ports = {int(p) for p in (sni_peek_ports or ())}
+        self.sni_peek_timeout = float(sni_peek_timeout)
+        self._sni_lock = threading.Lock()
+        self._sni_stats = {'peeked': 0, 'found': 0, 'missing': 0}
+        # optional per-domain choice between direct and SOCKS by measured connect time and throughput
+        self.route_selector = None
+        if route_selection:
+            from route_select import RouteSelector
+            self.route_selector = RouteSelector(probe_interval=route_probe_interval,
+                                                switch_margin=route_switch_margin)
+        # sampling profiler, created on the first start_profile() (admin endpoint, signal or GUI)
+        self.profiler = None
+        self.profile_dir = profile_dir
+        if profile_dir and rule_base_dir and not os.path.isabs(profile_dir):
+            self.profile_dir = os.path.join(rule_base_dir, profile_dir)
+        self.profile_interval = float(profile_interval_ms) / 1000
+        self.profile_seconds = float(profile_seconds)
+        # keep track of client threads so we can attempt to join them on stop; finished threads are
+        # pruned whenever the list doubles
         self._client_threads = []
+        self._prune_threads_at = 256
+
+    @property
+    def socks_host(self):
+        return self._upstream[0]
+
+    @property
+    def socks_port(self):
+        return self._upstream[1]
+
+    @property
+    def _bypass_rules(self):
+        return self._rules[0]
+
+    @property
+    def _proxy_rules(self):
+        return self._rules[1]
+
+    def set_rules(self, bypass_list=None, proxy_list=None, rule_files=None, rule_snapshot=None):
+        """设置并编译绕过/强制代理列表（及规则文件），同时使已生成的 PAC 失效。
+        给出 rule_snapshot 时规则编译为 '<rule_snapshot>.bypass' / '.proxy' 快照文件并内存映射。
+        编译在替换之前完成，出错时当前规则保持不变；两个规则集一次替换，请求不会看到新旧混合的规则"""
+        started = time.perf_counter()
+        rules = self._compile_rules(bypass_list, proxy_list, rule_files, rule_snapshot, self.rule_base_dir)
+        self._install_rules(bypass_list, proxy_list, rule_files, rule_snapshot, rules)
+        if self.rule_files or self.rule_snapshot:
+            self._log(f"Loaded {len(self._bypass_rules)} bypass / {len(self._proxy_rules)} proxy rules "
+                      f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    @staticmethod
+    def _compile_rules(bypass_list, proxy_list, rule_files, rule_snapshot, base_dir):
+        """编译规则集，返回 (bypass, proxy)；不触及当前生效的规则"""
+        rule_files = list(rule_files or [])
+        snapshot = rule_snapshot or None
+        if snapshot and base_dir and not os.path.isabs(snapshot):
+            snapshot = os.path.join(base_dir, snapshot)
+        return (build_rules(list(bypass_list or []), rule_files, f"{snapshot}.bypass" if snapshot else None,
+                            base_dir, 'bypass'),
+                build_rules(list(proxy_list or []), rule_files, f"{snapshot}.proxy" if snapshot else None,
+                            base_dir, 'proxy'))
+
+    def _install_rules(self, bypass_list, proxy_list, rule_files, rule_snapshot, rules):
+        """换上已编译的规则集"""
+        self.bypass_list = list(bypass_list or [])
+        self.proxy_list = list(proxy_list or [])
+        self.rule_files = list(rule_files or [])
+        self.rule_snapshot = rule_snapshot or None
+        self._rules = rules
+        self._options.update(bypass_list=self.bypass_list, proxy_list=self.proxy_list, rule_files=self.rule_files,
+                             rule_snapshot=self.rule_snapshot)
+        with self._pac_lock:
+            self._pac_cache.clear()
+        # spare connections were opened under the old rules
+        if getattr(self, 'preconnect', None) is not None:
+            self.preconnect.clear()
+
+    # options reload() applies to the running server; everything else (listener, pools, optional
+    # components) is reported as restart_required
+    RELOADABLE = ('bypass_list', 'proxy_list', 'rule_files', 'rule_snapshot', 'rule_base_dir', 'rule_resolve_ips',
+                  'success_ttl', 'fail_ttl', 'socks_host', 'socks_port', 'local_dns_list', 'pac_enabled')
+    RULE_OPTIONS = ('bypass_list', 'proxy_list', 'rule_files', 'rule_snapshot', 'rule_base_dir')
+
+    @staticmethod
+    def _same_option(a, b) -> bool:
+        """比较新旧选项值：列表与元组按内容比较，None 与空列表视为相同"""
+        seq = (list, tuple, set)
+        if (a is None or isinstance(a, seq)) and (b is None or isinstance(b, seq)):
+            return list(a or []) == list(b or [])
+        return a == b
+
+    @staticmethod
+    def _default_options() -> dict:
+        """构造函数各参数的默认值"""
+        code = ProxyServer.__init__.__code__
+        names = code.co_varnames[1:code.co_argcount]
+        defaults = ProxyServer.__init__.__defaults__
+        return dict(zip(names[len(names) - len(defaults):], defaults))
+
+    def reload(self, **options) -> dict:
+        """热重载配置（参数同构造函数，通常来自 options_from_config）：先编译新规则，再一次性替换规则、
+        上游地址与其他可热更新的选项。进行中的隧道、可达性/DNS 缓存、缓冲池与统计保持不变；
+        未给出的选项保持当前值。返回报告：变化的选项、已生效/需重启的选项与编译、替换耗时。
+        编译失败时抛出异常，当前配置保持不变"""
+        wanted = dict(self._options)
+        wanted.update(options)
+        wanted.pop('logger', None)
+        with self._reload_lock:
+            try:
+                changed = sorted(k for k, v in wanted.items()
+                                 if k in self._options and not self._same_option(v, self._options[k]))
+                applied = [k for k in changed if k in self.RELOADABLE]
+                started = time.perf_counter()
+                rules = None
+                if any(k in self.RULE_OPTIONS for k in applied):
+                    rules = self._compile_rules(wanted['bypass_list'], wanted['proxy_list'], wanted['rule_files'],
+                                                wanted['rule_snapshot'], wanted['rule_base_dir'])
+                local_dns_rules = RuleSet(wanted['local_dns_list'] or []) if 'local_dns_list' in applied else None
+                upstream = (wanted['socks_host'], int(wanted['socks_port']))
+                compiled = time.perf_counter()
+            except Exception:
+                self._reload_stats['failures'] += 1
+                raise
+
+            if rules is not None:
+                self.rule_base_dir = wanted['rule_base_dir']
+                self._install_rules(wanted['bypass_list'], wanted['proxy_list'], wanted['rule_files'],
+                                    wanted['rule_snapshot'], rules)
+            if local_dns_rules is not None:
+                self.local_dns_list = list(wanted['local_dns_list'] or [])
+                self._local_dns_rules = local_dns_rules
+            if bool(wanted['rule_resolve_ips']) != self.rule_resolve_ips:
+                self.rule_resolve_ips = bool(wanted['rule_resolve_ips'])
+                with self._pac_lock:
+                    self._pac_cache.clear()
+            self._success_ttl = int(wanted['success_ttl'])
+            self._fail_ttl = int(wanted['fail_ttl'])
+            self.pac_enabled = bool(wanted['pac_enabled'])
+            if upstream != self._upstream:
+                self._upstream = upstream
+                # 新上游的健康状况未知；备用连接是经旧上游建立的
+                if self.socks_breaker is not None:
+                    self.socks_breaker.name = f"SOCKS upstream {upstream[0]}:{upstream[1]}"
+                    self.socks_breaker.reset()
+                if self.preconnect is not None:
+                    self.preconnect.clear()
+            for k in applied:
+                self._options[k] = wanted[k]
+            done = time.perf_counter()
+
+            report = {'changed': changed, 'applied': applied,
+                      'restart_required': [k for k in changed if k not in self.RELOADABLE],
+                      'compile_ms': round((compiled - started) * 1000, 2),
+                      'swap_ms': round((done - compiled) * 1000, 3),
+                      'bypass_rules': len(self._bypass_rules), 'proxy_rules': len(self._proxy_rules)}
+            self._reload_stats['reloads'] += 1
+            self._reload_stats['last'] = dict(report, at=time.time())
+        self._log(f"Reloaded configuration: applied {applied or 'nothing'} "
+                  f"(compile {report['compile_ms']} ms, swap {report['swap_ms']} ms)"
+                  + (f", restart required for {report['restart_required']}" if report['restart_required'] else ''))
+        return report
+
+    def reload_config(self) -> dict:
+        """从 config_source 重新读取配置并热重载。配置文件是完整的配置：其中没有的选项恢复构造函数默认值"""
+        if self.config_source is None:
+            raise ValueError("no configuration source to reload from")
+        options = self._default_options()
+        options.update(self.config_source())
+        return self.reload(**options)
+
+    def get_pac(self, proxy_addr=None) -> str:
+        """返回根据当前规则生成的 PAC 脚本（按代理地址缓存，规则变化时重新生成）"""
+        if not proxy_addr:
+            proxy_addr = f"{self.local_host}:{self.local_port}"
+        with self._pac_lock:
+            pac = self._pac_cache.get(proxy_addr)
+            if pac is None:
+                from pac import generate_pac
+                bypass_rules, proxy_rules = self._rules
+                pac = generate_pac(bypass_rules, proxy_rules, proxy_addr, self.rule_resolve_ips)
+                self._pac_cache[proxy_addr] = pac
+            return pac
+
+    def get_stats(self) -> dict:
+        """返回运行统计（供 /stats 端点与 GUI 使用）"""
+        stats = {
+            'running': self.running,
+            'reach_cache_entries': len(self._reach_cache),
+            'bypass_rules': len(self._bypass_rules),
+            'proxy_rules': len(self._proxy_rules),
+            'rule_snapshot': isinstance(self._proxy_rules, CompiledRuleSet),
+            'dns_cache_entries': len(self._dns_cache),
+            'reload': dict(self._reload_stats),
+        }
+        if self.http_cache is not None:
+            stats['http_cache'] = self.http_cache.stats()
+        if self.shaper is not None:
+            stats['shaping'] = self.shaper.stats()
+        if self.coalescer is not None:
+            stats['coalescing'] = self.coalescer.stats()
+        if self.scheduler is not None:
+            stats['priority'] = self.scheduler.stats()
+        if self.route_selector is not None:
+            stats['route_selection'] = self.route_selector.stats()
+        if self.sni_peek:
+            with self._sni_lock:
+                stats['sni'] = dict(self._sni_stats)
+        stats['tunnels'] = self.reaper.stats()
+        stats['buffer_pool'] = self.buffer_pool.stats()
+        stats['relay'] = self.relay_stats.stats()
+        stats['socket_options'] = self.sockopts.stats()
+        if self.preconnect is not None:
+            stats['preconnect'] = self.preconnect.stats()
+        if self.access_log is not None:
+            stats['access_log'] = self.access_log.stats()
+        if self.socks_breaker is not None:
+            stats['socks_breaker'] = self.socks_breaker.stats()
+        if self.connect_timer is not None:
+            stats['connect_timeouts'] = self.connect_timer.stats()
+        if self.profiler is not None:
+            stats['profiler'] = self.profiler.stats()
+        stats['dns'] = self.dns_stats()
+        return stats
+
+    def dns_stats(self) -> dict:
+        """本地解析次数与耗时，以及缓存命中/远程解析避免的本地查询和估算节省的时间"""
+        with self._dns_lock:
+            s = dict(self._dns_stats)
+        lookups = s['lookups']
+        avg = s.pop('lookup_seconds') / lookups if lookups else 0.0
+        s['avg_lookup_ms'] = round(avg * 1000, 3)
+        s['saved_ms'] = round((s['cache_hits'] + s['avoided']) * avg * 1000, 1)
+        return s
+
+    def start_profile(self, seconds=None, idle=True):
+        """开始一次采样分析，返回折叠栈输出路径；已在采样时返回 None"""
+        if self.profiler is None:
+            from profiler import SamplingProfiler
+            self.profiler = SamplingProfiler(interval=self.profile_interval, output_dir=self.profile_dir,
+                                             logger=self._log)
+        self.profiler.idle = bool(idle)
+        return self.profiler.start(self.profile_seconds if seconds is None else float(seconds))
+
+    def stop_profile(self):
+        """提前结束正在进行的采样（已采集的样本仍会写出）"""
+        if self.profiler is not None:
+            self.profiler.stop()
 
     def _log(self, message: str):
         try:
@@ -62,35 +486,66 @@ class ProxyServer:
     def start(self):
         """启动代理服务器"""
         try:
+            self.sockopts.apply(self.socket, 'listener')
             self.socket.bind((self.local_host, self.local_port))
-            self.socket.listen(5)
+            self.socket.listen(self.sockopts.backlog())
+            if self.socks_listen_port:
+                self._socks_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._socks_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.sockopts.apply(self._socks_listener, 'listener')
+                self._socks_listener.bind((self.local_host, self.socks_listen_port))
+                self._socks_listener.listen(self.sockopts.backlog())
             self.running = True
+            self.ready.set()
             self._log(f"Proxy server started on {self.local_host}:{self.local_port}")
-
-            while self.running:
-                try:
-                    client_socket, addr = self.socket.accept()
-                except OSError:
-                    # socket was likely closed via stop(); exit loop
-                    break
-                except Exception as e:
-                    self._log(f"Accept error: {e}")
-                    continue
-
-                t = threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True)
-                t.start()
-                self._client_threads.append(t)
-
+            if self.pac_enabled:
+                self._log(f"PAC available at http://{self.local_host}:{self.local_port}/proxy.pac")
+            if self._socks_listener is not None:
+                self._log(f"SOCKS5 listener started on {self.local_host}:{self.socks_listen_port}")
+                threading.Thread(target=self._accept_loop, args=(self._socks_listener,), daemon=True).start()
+            self.reaper.start()
+            if self.preconnect is not None:
+                self.preconnect.start()
+            self._accept_loop(self.socket)
         except Exception as e:
             self._log(f"Error starting proxy server: {e}")
+
+    def _accept_loop(self, listener):
+        while self.running:
+            try:
+                client_socket, addr = listener.accept()
+            except OSError:
+                # socket was likely closed via stop(); exit loop
+                break
+            except Exception as e:
+                self._log(f"Accept error: {e}")
+                continue
+
+            t = threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True)
+            t.start()
+            self._client_threads.append(t)
+            if len(self._client_threads) >= self._prune_threads_at:
+                self._client_threads = [t for t in self._client_threads if t.is_alive()]
+                self._prune_threads_at = max(256, 2 * len(self._client_threads))
     
     def stop(self):
         """停止代理服务器"""
         self.running = False
-        try:
-            self.socket.close()
-        except Exception:
-            pass
+        for listener in (self.socket, self._socks_listener):
+            if listener is None:
+                continue
+            # close() alone does not wake a thread blocked in accept() on Linux
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            try:
+                listener.close()
+            except Exception:
+                pass
+
+        # 转发循环没有轮询超时，关闭所有隧道的套接字来唤醒它们
+        self.reaper.shutdown_all()
 
         # attempt to join client threads briefly
         for t in list(self._client_threads):
@@ -101,21 +556,36 @@ class ProxyServer:
                 pass
 
         self._client_threads.clear()
+        self.reaper.stop()
+        if self.preconnect is not None:
+            self.preconnect.stop()
+        if self.access_log is not None:
+            self.access_log.close()
         self._log("Proxy server stopped")
         
-    def handle_client(self, client_socket):
+    def handle_client(self, client_socket, addr=None):
         """处理客户端请求（以 bytes 安全方式读取并根据方法分发）"""
+        flow = Flow(addr[0] if addr else None)
+        client_slot = False
         try:
+            if self.shaper is not None:
+                if not self.shaper.acquire_client(flow.client):
+                    self._log(f"Too many connections from {flow.client}, rejected")
+                    self._reject_too_many(client_socket, flow)
+                    return
+                client_slot = True
+
+            self.sockopts.apply(client_socket, 'client')
             client_socket.settimeout(5.0)
 
-            # 读取请求头（直到 CRLFCRLF）
-            header_data = b''
-            while b'\r\n\r\n' not in header_data:
-                chunk = client_socket.recv(4096)
-                if not chunk:
-                    break
-                header_data += chunk
+            # SOCKS5 客户端以版本字节 0x05 开头，HTTP 请求以方法名开头
+            if self.socks_inbound or self._socks_listener is not None:
+                first = client_socket.recv(1, socket.MSG_PEEK)
+                if first == b'\x05':
+                    self.handle_socks5(client_socket, flow)
+                    return
 
+            header_data = self._read_request_head(client_socket, flow)
             if not header_data:
                 return
 
@@ -130,27 +600,18 @@ class ProxyServer:
             # log the received request to the provided logger (thread-safe)
             self._log(f"Received request: {first_line}")
 
+            req_parts = first_line.split()
             if first_line.upper().startswith('CONNECT'):
-                self.handle_connect_request(client_socket, first_line)
+                self.handle_connect_request(client_socket, first_line, flow)
+            elif len(req_parts) >= 2 and self._is_local_request(req_parts[1], lines):
+                # origin-form 请求且目标是本代理自身（如 PAC 文件）
+                flow.method = req_parts[0].upper()
+                flow.route = 'local'
+                self.handle_local_request(client_socket, req_parts[0].upper(), req_parts[1], lines, flow)
             else:
                 # 处理普通HTTP请求（包含可能的请求体）
                 # 支持 Content-Length 或 Transfer-Encoding: chunked
-                content_length = 0
-                chunked = False
-                for l in lines[1:]:
-                    if not l:
-                        break
-                    parts = l.split(':', 1)
-                    if len(parts) == 2:
-                        key = parts[0].lower()
-                        val = parts[1].strip()
-                        if key == 'content-length':
-                            try:
-                                content_length = int(val)
-                            except Exception:
-                                content_length = 0
-                        elif key == 'transfer-encoding' and 'chunked' in val.lower():
-                            chunked = True
+                content_length, chunked = self._body_framing(lines)
 
                 body = b''
                 sep = b'\r\n\r\n'
@@ -161,91 +622,454 @@ class ProxyServer:
                     if already > 0:
                         body = header_data[-already:]
 
-                if content_length > 0:
-                    while len(body) < content_length:
-                        more = client_socket.recv(4096)
-                        if not more:
-                            break
+                if content_length > len(body):
+                    for more in pooled_chunks(self.buffer_pool, client_socket, content_length - len(body)):
                         body += more
                 elif chunked:
                     # read remaining chunked body from client (preserve chunk encoding)
                     body += self._read_chunked_body(client_socket)
 
-                self.handle_http_request(client_socket, header_data, body)
+                self.handle_http_request(client_socket, header_data, body, flow)
 
         except Exception as e:
             self._log(f"Error handling client: {e}")
         finally:
+            if self.shaper is not None:
+                if client_slot:
+                    self.shaper.release_client(flow.client)
+                if flow.dest_slot is not None:
+                    self.shaper.release_dest(flow.dest_slot)
             try:
                 client_socket.close()
             except Exception:
                 pass
+            if self.scheduler is not None:
+                self.scheduler.finish(flow)
+            if self.route_selector is not None and flow.route in ('direct', 'socks') and flow.first_byte:
+                self.route_selector.record_transfer(flow.sni or flow.host, flow.route, flow.bytes_down,
+                                                    time.time() - flow.first_byte)
+            if self.access_log is not None and flow.method is not None:
+                self.access_log.log_flow(flow)
 
-    def handle_connect_request(self, client_socket, first_line):
-        """处理HTTPS CONNECT请求：通过上游 SOCKS 建立到目标的隧道，然后双向转发（二进制）"""
-        try:
-            target_url = first_line.split()[1]
-            host, port = self.parse_host_port(target_url)
-            # decide whether to bypass proxy according to lists
-            if self._host_in_list(host, self.proxy_list):
-                # forced to proxy; skip direct attempt
-                direct_sock = None
-            else:
-                # 首先尝试直连目标
-                direct_sock = self._try_direct_connect(host, port, timeout=3.0)
-            if direct_sock:
-                try:
-                    client_socket.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
-                except Exception:
+    LOCAL_PATHS = ('/proxy.pac', '/wpad.dat', '/stats', '/profile', '/reload')
+    # requests whose header block exceeds this are rejected with 431
+    MAX_HEADER_BYTES = 65536
+
+    def _read_request_head(self, client_socket, flow=None):
+        """读取请求头（直到 CRLFCRLF，可能带有部分请求体）；头部过大时回复 431 并返回 None"""
+        header_data = b''
+        for chunk in pooled_chunks(self.buffer_pool, client_socket):
+            header_data += chunk
+            if b'\r\n\r\n' in header_data:
+                break
+            if len(header_data) > self.MAX_HEADER_BYTES:
+                self._send_reply(client_socket, b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+                                                b"Connection: close\r\n\r\n", flow)
+                return None
+        return header_data
+
+    @staticmethod
+    def _body_framing(lines):
+        """从请求头行得到请求体长度信息，返回 (content_length, chunked)"""
+        content_length = 0
+        chunked = False
+        for l in lines[1:]:
+            if not l:
+                break
+            parts = l.split(':', 1)
+            if len(parts) == 2:
+                key = parts[0].lower()
+                val = parts[1].strip()
+                if key == 'content-length':
                     try:
-                        direct_sock.close()
+                        content_length = int(val)
                     except Exception:
-                        pass
-                    return
+                        content_length = 0
+                elif key == 'transfer-encoding' and 'chunked' in val.lower():
+                    chunked = True
+        return content_length, chunked
 
-                # 直连成功，双向转发
-                self.forward_data(client_socket, direct_sock)
-                try:
-                    direct_sock.close()
-                except Exception:
-                    pass
+    def _header_value(self, lines, name):
+        """从请求头行中取出指定头部的值（不区分大小写），不存在返回 None"""
+        name = name.lower()
+        for l in lines[1:]:
+            if not l:
+                break
+            k_v = l.split(':', 1)
+            if len(k_v) == 2 and k_v[0].strip().lower() == name:
+                return k_v[1].strip()
+        return None
+
+    def _header_dict(self, lines) -> dict:
+        """把请求头行转换成 {小写头名: 值} 字典，重复头部以逗号合并"""
+        headers = {}
+        for l in lines[1:]:
+            if not l:
+                break
+            k_v = l.split(':', 1)
+            if len(k_v) == 2:
+                k = k_v[0].strip().lower()
+                v = k_v[1].strip()
+                headers[k] = f"{headers[k]}, {v}" if k in headers else v
+        return headers
+
+    def _is_local_request(self, target, lines) -> bool:
+        """origin-form 请求且路径属于本地端点、Host 指向本监听端口时，视为发给代理自身的请求"""
+        if not target.startswith('/') or target.split('?', 1)[0] not in self.LOCAL_PATHS:
+            return False
+        host = self._header_value(lines, 'host')
+        if not host:
+            return True
+        hostport = host.rsplit(']', 1)[-1]
+        if ':' in hostport:
+            try:
+                return int(hostport.rsplit(':', 1)[1]) == int(self.local_port)
+            except Exception:
+                return False
+        return int(self.local_port) == 80
+
+    def handle_local_request(self, client_socket, method, path, lines, flow=None):
+        """处理发给本地监听端口本身的请求：/proxy.pac、/wpad.dat、/stats、/profile 与 /reload"""
+        path, _, query = path.partition('?')
+        if self.pac_enabled and path in ('/proxy.pac', '/wpad.dat') and method in ('GET', 'HEAD'):
+            # PAC 中的代理地址优先使用客户端访问我们时的 Host 头（适配 0.0.0.0 监听）
+            proxy_addr = self._header_value(lines, 'host')
+            if proxy_addr and ':' not in proxy_addr.rsplit(']', 1)[-1]:
+                proxy_addr = f"{proxy_addr}:{self.local_port}"
+            body = self.get_pac(proxy_addr).encode('utf-8')
+            from pac import PAC_CONTENT_TYPE
+            self._send_local_response(client_socket, '200 OK', PAC_CONTENT_TYPE, body, method == 'HEAD', flow)
+            return
+        if path == '/stats' and method in ('GET', 'HEAD'):
+            body = json.dumps(self.get_stats(), indent=2).encode('utf-8')
+            self._send_local_response(client_socket, '200 OK', 'application/json', body, method == 'HEAD', flow)
+            return
+        if path == '/profile':
+            self._handle_profile_request(client_socket, method, query, flow)
+            return
+        if path == '/reload':
+            self._handle_reload_request(client_socket, method, flow)
+            return
+        self._send_local_response(client_socket, '404 Not Found', 'text/plain', b'Not Found', method == 'HEAD', flow)
+
+    def _handle_profile_request(self, client_socket, method, query, flow=None):
+        """GET /profile 查看采样状态；POST /profile?seconds=N[&idle=0] 开始，POST /profile?stop=1 提前结束。
+        会在本机写文件，只接受来自回环地址的请求"""
+        try:
+            loopback = ipaddress.ip_address(flow.client).is_loopback if flow is not None else False
+        except ValueError:
+            loopback = False
+        if not loopback:
+            self._send_local_response(client_socket, '403 Forbidden', 'text/plain', b'Forbidden', False, flow)
+            return
+        if method == 'POST':
+            params = parse_qs(query)
+            try:
+                if params.get('stop', ['0'])[0] not in ('', '0'):
+                    self.stop_profile()
+                    result = {'stopped': True}
+                else:
+                    seconds = float(params['seconds'][0]) if 'seconds' in params else None
+                    path = self.start_profile(seconds, idle=params.get('idle', ['1'])[0] != '0')
+                    result = {'started': path is not None, 'path': path or self.profiler.path}
+            except (ValueError, OSError) as e:
+                body = str(e).encode('utf-8')
+                self._send_local_response(client_socket, '400 Bad Request', 'text/plain', body, False, flow)
                 return
+        elif method in ('GET', 'HEAD'):
+            result = self.profiler.stats() if self.profiler is not None else {'running': False, 'runs': 0}
+        else:
+            self._send_local_response(client_socket, '405 Method Not Allowed', 'text/plain', b'Method Not Allowed',
+                                      False, flow)
+            return
+        body = json.dumps(result, indent=2).encode('utf-8')
+        self._send_local_response(client_socket, '200 OK', 'application/json', body, method == 'HEAD', flow)
 
-            # 直连失败，尝试通过上游 SOCKS 回退
-            if not HAS_PYSOCKS:
-                try:
-                    client_socket.send(b"HTTP/1.1 502 Bad Gateway\r\n\r\nPySocks not installed and direct connect failed")
-                except Exception:
-                    pass
+    def _handle_reload_request(self, client_socket, method, flow=None):
+        """GET /reload 查看上次重载的结果；POST /reload 重新读取配置文件并热重载。只接受来自回环地址的请求"""
+        try:
+            loopback = ipaddress.ip_address(flow.client).is_loopback if flow is not None else False
+        except ValueError:
+            loopback = False
+        if not loopback:
+            self._send_local_response(client_socket, '403 Forbidden', 'text/plain', b'Forbidden', False, flow)
+            return
+        if method == 'POST':
+            try:
+                result = self.reload_config()
+            except (ValueError, OSError) as e:
+                body = str(e).encode('utf-8')
+                self._send_local_response(client_socket, '400 Bad Request', 'text/plain', body, False, flow)
                 return
+        elif method in ('GET', 'HEAD'):
+            result = dict(self._reload_stats)
+        else:
+            self._send_local_response(client_socket, '405 Method Not Allowed', 'text/plain', b'Method Not Allowed',
+                                      False, flow)
+            return
+        body = json.dumps(result, indent=2).encode('utf-8')
+        self._send_local_response(client_socket, '200 OK', 'application/json', body, method == 'HEAD', flow)
+
+    def _send_local_response(self, client_socket, status, content_type, body, head_only=False, flow=None):
+        if flow is not None:
+            flow.status = int(status.split()[0])
+        header = (f"HTTP/1.1 {status}\r\n"
+                  f"Content-Type: {content_type}\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  "Cache-Control: no-cache\r\n"
+                  "Connection: close\r\n\r\n").encode('iso-8859-1')
+        payload = header if head_only else header + body
+        if flow is not None:
+            flow.bytes_down += len(payload)
+        try:
+            client_socket.sendall(payload)
+        except Exception:
+            pass
 
+    def _begin_flow(self, flow, host, port) -> bool:
+        """记录流的目标并占用目标连接名额；超过上限返回 False（由调用方按协议回复拒绝）"""
+        if flow is None:
+            return True
+        flow.host = host
+        flow.port = port
+        if self.shaper is not None and flow.dest_slot is None:
+            key = str(host).lower()
+            if not self.shaper.acquire_dest(key):
+                self._log(f"Too many connections to {host}, rejected")
+                return False
+            flow.dest_slot = key
+        return True
+
+    def _send_reply(self, client_socket, payload, flow=None):
+        """向客户端发送一个简单的 HTTP 应答（错误或拒绝），并把状态码记到流上"""
+        if flow is not None:
             try:
-                socks_sock = socks.socksocket()
-                socks_sock.set_proxy(socks.SOCKS5, self.socks_host, self.socks_port)
-                socks_sock.settimeout(10.0)
-                socks_sock.connect((host, port))
+                flow.status = int(payload.split(b' ', 2)[1])
+            except Exception:
+                pass
+        try:
+            client_socket.send(payload)
+        except Exception:
+            pass
+
+    def _send_upstream_error(self, client_socket, error, flow=None):
+        """上游不可用时回复 503（断路器打开，附 Retry-After），其余上游错误回复 502"""
+        if isinstance(error, UpstreamUnavailable):
+            retry = int(self.socks_breaker.probe_interval) if self.socks_breaker is not None else 10
+            payload = (f"HTTP/1.1 503 Service Unavailable\r\nRetry-After: {retry}\r\n"
+                       f"Connection: close\r\n\r\n{error}").encode('utf-8')
+        else:
+            payload = b"HTTP/1.1 502 Bad Gateway\r\n\r\n" + str(error).encode('utf-8')
+        self._send_reply(client_socket, payload, flow)
+
+    def _reject_too_many(self, client_socket, flow=None):
+        self._send_reply(client_socket, b"HTTP/1.1 429 Too Many Requests\r\nConnection: close\r\n\r\n", flow)
+
+    def _on_relay(self, flow, nbytes, downstream):
+        """转发循环每收到一块数据调用一次：累计字节数并按需节流"""
+        if flow is None:
+            return
+        if downstream:
+            if flow.first_byte is None:
+                flow.first_byte = time.time()
+            flow.bytes_down += nbytes
+        else:
+            flow.bytes_up += nbytes
+        if self.shaper is not None:
+            self.shaper.throttle(flow.client, flow.dest_slot, nbytes)
+        if flow.priority is not None:
+            self.scheduler.on_bytes(flow, nbytes)
+
+    def _recv_exact(self, sock, n):
+        data = b''
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed during handshake')
+            data += chunk
+        return data
 
-                # 回复客户端连接已建立
-                client_socket.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+    def _socks5_reply(self, client_socket, rep, bind=None, flow=None):
+        """发送 SOCKS5 应答，bind 为上游套接字的 (addr, port)，缺省为 0.0.0.0:0"""
+        if flow is not None:
+            flow.status = rep
+        atyp, addr, port = 0x01, b'\x00\x00\x00\x00', 0
+        if bind is not None:
+            try:
+                ip = ipaddress.ip_address(bind[0])
+                atyp = 0x01 if ip.version == 4 else 0x04
+                addr, port = ip.packed, int(bind[1])
+            except Exception:
+                pass
+        try:
+            client_socket.sendall(bytes([0x05, rep, 0x00, atyp]) + addr + port.to_bytes(2, 'big'))
+        except Exception:
+            pass
 
-                # 双向转发（二进制）
-                self.forward_data(client_socket, socks_sock)
+    def handle_socks5(self, client_socket, flow=None):
+        """处理原生 SOCKS5 客户端（仅 NO AUTH + CONNECT），与 CONNECT 请求共用直连优先/SOCKS 回退路由"""
+        if flow is not None:
+            flow.method = 'SOCKS5'
+        try:
+            ver, nmethods = self._recv_exact(client_socket, 2)
+            methods = self._recv_exact(client_socket, nmethods)
+            if 0x00 not in methods:
+                client_socket.sendall(b'\x05\xff')
+                return
+            client_socket.sendall(b'\x05\x00')
+
+            ver, cmd, rsv, atyp = self._recv_exact(client_socket, 4)
+            if atyp == 0x01:
+                host = socket.inet_ntop(socket.AF_INET, self._recv_exact(client_socket, 4))
+            elif atyp == 0x03:
+                length = self._recv_exact(client_socket, 1)[0]
+                host = self._recv_exact(client_socket, length).decode('idna')
+            elif atyp == 0x04:
+                host = socket.inet_ntop(socket.AF_INET6, self._recv_exact(client_socket, 16))
+            else:
+                self._socks5_reply(client_socket, 0x08, flow=flow)
+                return
+            port = int.from_bytes(self._recv_exact(client_socket, 2), 'big')
+            if cmd != 0x01:
+                # only CONNECT is supported
+                self._socks5_reply(client_socket, 0x07, flow=flow)
+                return
+            self._log(f"Received SOCKS5 CONNECT {host}:{port}")
+
+            if not self._begin_flow(flow, host, port):
+                # per-destination connection cap reached (counted in the shaping stats like the HTTP 429);
+                # SOCKS5 has no "too many connections" reply, 0x02 "not allowed" is the closest
+                self._socks5_reply(client_socket, 0x02, flow=flow)
+                return
+
+            try:
+                upstream, route = self._open_upstream(host, port, direct_timeout=3.0, flow=flow)
+            except UpstreamError as e:
+                # 0x01 general failure while the upstream is known to be down, else host unreachable
+                self._socks5_reply(client_socket, 0x01 if isinstance(e, UpstreamUnavailable) else 0x04, flow=flow)
+                return
+            try:
                 try:
-                    socks_sock.close()
+                    bind = upstream.getsockname()
+                except Exception:
+                    bind = None
+                self._socks5_reply(client_socket, 0x00, bind, flow)
+                self.forward_data(client_socket, upstream, flow)
+            finally:
+                try:
+                    upstream.close()
                 except Exception:
                     pass
-            except Exception as e:
-                self._log(f"Error in CONNECT request handling (socks fallback): {e}")
+        except Exception as e:
+            self._log(f"Error in SOCKS5 request handling: {e}")
+
+    def handle_connect_request(self, client_socket, first_line, flow=None):
+        """处理HTTPS CONNECT请求：通过上游 SOCKS 建立到目标的隧道，然后双向转发（二进制）"""
+        if flow is not None:
+            flow.method = 'CONNECT'
+        try:
+            target_url = first_line.split()[1]
+            host, port = self.parse_host_port(target_url)
+            if not self._begin_flow(flow, host, port):
+                self._reject_too_many(client_socket, flow)
+                return
+            if self.sni_peek and port in self.sni_peek_ports and self._is_ip_literal(host):
+                self._connect_by_sni(client_socket, host, port, flow)
+                return
+            # 强制代理列表直接走 SOCKS，否则首先尝试直连目标，失败回退到上游 SOCKS
+            try:
+                upstream, route = self._open_upstream(host, port, direct_timeout=3.0, flow=flow)
+            except UpstreamError as e:
+                self._send_upstream_error(client_socket, e, flow)
+                return
+
+            try:
+                # 回复客户端连接已建立，然后双向转发（二进制）
                 try:
-                    client_socket.send(b"HTTP/1.1 502 Bad Gateway\r\n\r\nCONNECT failed")
+                    client_socket.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+                except Exception:
+                    return
+                if flow is not None:
+                    flow.status = 200
+                self.forward_data(client_socket, upstream, flow)
+            finally:
+                try:
+                    upstream.close()
                 except Exception:
                     pass
 
         except Exception as e:
             self._log(f"Error in CONNECT request handling: {e}")
     
-    def handle_http_request(self, client_socket, header_bytes, body_bytes):
+    def _connect_by_sni(self, client_socket, host, port, flow=None):
+        """CONNECT 到 IP 字面量：先回复 200，读入 TLS ClientHello，以其中的 SNI 主机名匹配规则并选路，
+        再连接客户端请求的 IP。已读入的数据不复制，直接交给转发循环最先发往上游"""
+        from sni import peek_client_hello
+        try:
+            client_socket.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        except Exception:
+            return
+        if flow is not None:
+            flow.status = 200
+        preload, name = peek_client_hello(client_socket, self.buffer_pool, self.sni_peek_timeout)
+        upstream = None
+        try:
+            if name and self._is_ip_literal(name):
+                name = None
+            with self._sni_lock:
+                self._sni_stats['peeked'] += 1
+                self._sni_stats['found' if name else 'missing'] += 1
+            if name is not None:
+                self._log(f"CONNECT {host}:{port} carries SNI {name}")
+                if flow is not None:
+                    flow.sni = name
+            try:
+                upstream, route = self._open_upstream(host, port, direct_timeout=3.0, flow=flow, name=name)
+            except UpstreamError:
+                # 200 已经发出，只能关闭隧道
+                if flow is not None:
+                    flow.status = 502
+                return
+            self.forward_data(client_socket, upstream, flow, preload=preload)
+            preload = None
+        finally:
+            for slab, _ in preload or ():
+                self.buffer_pool.release(slab)
+            if upstream is not None:
+                try:
+                    upstream.close()
+                except Exception:
+                    pass
+
+    def _rewrite_request(self, method, path, version, lines, revalidate=None) -> str:
+        """生成发往源站的请求头：首行改为相对路径，去掉 Proxy-Connection 并固定 Connection: close；
+        revalidate 为缓存条目时改用该条目自己的校验器做条件请求"""
+        # 重写请求首行为相对路径（origin server 需要）
+        new_first = f"{method} {path} {version}\r\n"
+
+        # 过滤 Proxy-Connection 头并确保 Connection: close（简单处理）
+        new_headers = []
+        for l in lines[1:]:
+            if not l:
+                break
+            if l.lower().startswith('proxy-connection:'):
+                continue
+            if l.lower().startswith('connection:'):
+                # replace with close
+                continue
+            if revalidate is not None and l.lower().startswith(('if-none-match:', 'if-modified-since:')):
+                # 再验证时使用缓存条目自己的校验器
+                continue
+            new_headers.append(l)
+        if revalidate is not None:
+            for k, v in self.http_cache.conditional_headers(revalidate):
+                new_headers.append(f"{k}: {v}")
+        new_headers.append('Connection: close')
+        return new_first + '\r\n'.join(new_headers) + '\r\n\r\n'
+
+    def handle_http_request(self, client_socket, header_bytes, body_bytes, flow=None):
         """处理 HTTP 请求：通过上游 SOCKS 连接目标并发送原始请求（调整请求行为相对路径），然后将响应原样返回给客户端"""
+        fetch = None
         try:
             # 解析 header_text
             try:
@@ -259,6 +1083,8 @@ class ProxyServer:
             if len(parts) < 3:
                 return
             method, url_or_path, version = parts[0], parts[1], parts[2]
+            if flow is not None:
+                flow.method = method
 
             parsed = urlparse(url_or_path)
             if parsed.scheme and parsed.hostname:
@@ -291,134 +1117,400 @@ class ProxyServer:
                 path = url_or_path if url_or_path.startswith('/') else '/'
 
             if host is None:
-                try:
-                    client_socket.send(b"HTTP/1.1 400 Bad Request\r\n\r\nMissing Host")
-                except Exception:
-                    pass
+                self._send_reply(client_socket, b"HTTP/1.1 400 Bad Request\r\n\r\nMissing Host", flow)
                 return
+            if not self._begin_flow(flow, host, port):
+                self._reject_too_many(client_socket, flow)
+                return
+
+            # 可选 HTTP 缓存：新鲜命中直接返回；过期但有校验器的条目改为条件请求再验证
+            cache_ctx = None
+            if self.http_cache is not None:
+                url = f"http://{host.lower()}:{port}{path}"
+                if method in ('GET', 'HEAD'):
+                    req_headers = self._header_dict(lines)
+                    entry, state = self.http_cache.lookup(url, req_headers)
+                    if state == 'fresh':
+                        self.http_cache.record_hit(entry)
+                        self._send_cached(client_socket, entry, method, req_headers, flow)
+                        return
+                    if state == 'stale' and not (method == 'GET' and entry.has_validators()):
+                        entry = None
+                    cache_ctx = {'url': url, 'method': method, 'req_headers': req_headers,
+                                 'entry': entry, 'request_time': time.time()}
+                else:
+                    self.http_cache.invalidate(url)
 
-            # 重写请求首行为相对路径（origin server 需要）
-            new_first = f"{method} {path} {version}\r\n"
+            # 可选请求合并：相同的并发 GET 只回源一次，其余请求共享同一份响应
+            if self.coalescer is not None and method == 'GET' and not body_bytes and \
+                    (cache_ctx is None or cache_ctx['entry'] is None):
+                req_headers = self._header_dict(lines)
+                if self.coalescer.eligible(req_headers):
+                    key = self.coalescer.key(f"http://{host.lower()}:{port}{path}", req_headers)
+                    fetch, leader = self.coalescer.join(key, req_headers)
+                    if not leader:
+                        served = self._serve_coalesced(client_socket, fetch, req_headers, flow)
+                        fetch = None
+                        if served:
+                            return
 
-            # 过滤 Proxy-Connection 头并确保 Connection: close（简单处理）
-            new_headers = []
-            for l in lines[1:]:
-                if not l:
-                    break
-                if l.lower().startswith('proxy-connection:'):
-                    continue
-                if l.lower().startswith('connection:'):
-                    # replace with close
-                    continue
-                new_headers.append(l)
-            new_headers.append('Connection: close')
-            header_out = new_first + '\r\n'.join(new_headers) + '\r\n\r\n'
+            header_out = self._rewrite_request(method, path, version, lines,
+                                               cache_ctx['entry'] if cache_ctx is not None else None)
 
             # body_bytes already read by caller
             request_out = header_out.encode('iso-8859-1') + (body_bytes or b'')
 
-            # 如果 host 在强制代理列表中，则跳过直连
-            if self._host_in_list(host, self.proxy_list):
-                direct_sock = None
-            else:
-                # 优先尝试直连：建立到目标的普通 TCP 连接并发送请求
-                # 但先检查失败缓存以避免频繁尝试已知不可达目标
-                cached = self._reach_cache.get((host, port))
-                if cached is not None:
-                    ok, expires = cached
-                    if time.time() < expires and not ok:
-                        # recent failure cached -> skip direct
-                        direct_sock = None
-                    else:
-                        direct_sock = self._try_direct_connect(host, port, timeout=4.0)
-                else:
-                    direct_sock = self._try_direct_connect(host, port, timeout=4.0)
-            if direct_sock:
-                try:
-                    direct_sock.sendall(request_out)
-                except Exception as e:
-                    self._log(f"Direct send failed, will try socks fallback: {e}")
-                    try:
-                        direct_sock.close()
-                    except Exception:
-                        pass
-                    direct_sock = None
-
-            if direct_sock:
-                # 从直连读取并转发响应
-                try:
-                    while True:
-                        data = direct_sock.recv(4096)
-                        if not data:
-                            break
-                        try:
-                            client_socket.sendall(data)
-                        except Exception:
-                            break
-                except Exception as e:
-                    self._log(f"Error relaying direct response: {e}")
-                finally:
-                    try:
-                        direct_sock.close()
-                    except Exception:
-                        pass
+            # 按规则打开上游：强制代理列表直接走 SOCKS，否则先直连，失败回退 SOCKS
+            try:
+                upstream, route = self._open_upstream(host, port, direct_timeout=4.0, flow=flow)
+            except UpstreamError as e:
+                self._send_upstream_error(client_socket, e, flow)
                 return
-
-            # 直连不可用或发送失败 -> 回退到 SOCKS
-            if not HAS_PYSOCKS:
+            try:
+                upstream.sendall(request_out)
+                if flow is not None:
+                    flow.bytes_up += len(request_out)
+            except Exception as e:
                 try:
-                    client_socket.send(b"HTTP/1.1 502 Bad Gateway\r\n\r\nPySocks not installed and direct connect failed")
+                    upstream.close()
                 except Exception:
                     pass
-                return
-
-            try:
-                proxy_sock = socks.socksocket()
-                proxy_sock.set_proxy(socks.SOCKS5, self.socks_host, self.socks_port)
-                proxy_sock.settimeout(10.0)
-                proxy_sock.connect((host, port))
-
-                # send request and stream response back to client
-                try:
-                    proxy_sock.sendall(request_out)
-                except Exception as e:
+                if route != 'direct':
                     self._log(f"Error sending request to upstream: {e}")
+                    self._send_reply(client_socket, b"HTTP/1.1 502 Bad Gateway\r\n\r\nUpstream send error", flow)
+                    return
+                # 直连发送失败 -> 回退到 SOCKS
+                self._log(f"Direct send failed, will try socks fallback: {e}")
+                try:
+                    upstream, route = self._open_upstream(host, port, skip_direct=True, flow=flow)
+                    upstream.sendall(request_out)
+                    if flow is not None:
+                        flow.bytes_up += len(request_out)
+                except UpstreamError as e2:
+                    self._send_upstream_error(client_socket, e2, flow)
+                    return
+                except Exception as e2:
+                    self._log(f"Error sending request to upstream: {e2}")
+                    self._send_reply(client_socket, b"HTTP/1.1 502 Bad Gateway\r\n\r\nUpstream send error", flow)
                     try:
-                        client_socket.send(b"HTTP/1.1 502 Bad Gateway\r\n\r\nUpstream send error")
-                    except Exception:
-                        pass
-                    try:
-                        proxy_sock.close()
+                        upstream.close()
                     except Exception:
                         pass
                     return
 
-                # 接收并转发响应（二进制）
-                try:
-                    while True:
-                        data = proxy_sock.recv(4096)
-                        if not data:
-                            break
-                        try:
-                            client_socket.sendall(data)
-                        except Exception:
-                            break
-                except Exception as e:
-                    self._log(f"Error relaying response: {e}")
-
-                try:
-                    proxy_sock.close()
-                except Exception:
-                    pass
+            # 接收并转发响应（二进制）
+            try:
+                self._relay_response(upstream, client_socket, cache_ctx, flow, fetch)
             except Exception as e:
-                self._log(f"Error connecting via socks: {e}")
+                self._log(f"Error relaying {route} response: {e}")
+            finally:
                 try:
-                    client_socket.send(b"HTTP/1.1 502 Bad Gateway\r\n\r\nUpstream connect failed")
+                    upstream.close()
                 except Exception:
                     pass
 
         except Exception as e:
             print(f"Error in HTTP request handling: {e}")
+        finally:
+            if fetch is not None:
+                self.coalescer.finish(fetch)
+
+    def _serve_coalesced(self, client_socket, fetch, req_headers, flow=None) -> bool:
+        """作为跟随者转发领取者取得的响应；响应不可共享时返回 False，由调用方自己回源"""
+        def send(data):
+            if flow is not None and flow.status is None:
+                flow.status = self._status_code(data[:16])
+            self._on_relay(flow, len(data), True)
+            client_socket.sendall(data)
+
+        if flow is not None:
+            flow.route = 'coalesced'
+        try:
+            served = self.coalescer.stream(fetch, req_headers, send)
+        except Exception as e:
+            self._log(f"Error relaying coalesced response: {e}")
+            return True
+        if not served and flow is not None:
+            flow.route = None
+        return served
+
+    def _relay_downstream(self, upstream, client_socket, on_chunk, flow=None, fetch=None, reply=b''):
+        """经 relay() 单向转发上游剩余的响应（不再读取客户端），on_chunk(data) 在每块数据读入后调用；
+        reply 为已读入并处理过的响应开头，最先发给客户端。两端在上游套接字超时内都没有进展时抛出 socket.timeout。
+        作为合并请求的领取者时，客户端断开后继续读完上游供跟随者使用。返回是否已读到上游 EOF"""
+        timeout = upstream.gettimeout()
+        client_timeout = client_socket.gettimeout()
+        finished = []
+
+        def on_data(downstream, data):
+            on_chunk(data)
+            self._on_relay(flow, len(data), True)
+
+        try:
+            relay(client_socket, upstream, self.buffer_pool, high_water=self.relay_high_water,
+                  low_water=self.relay_low_water, on_data=on_data, on_half_close=lambda: finished.append(True),
+                  should_stop=lambda: not self.running, stats=self.relay_stats, reply=reply, upload=False,
+                  timeout=timeout)
+        finally:
+            upstream.settimeout(timeout)
+            client_socket.settimeout(client_timeout)
+        if fetch is not None and not finished and self.running:
+            for data in pooled_chunks(self.buffer_pool, upstream):
+                on_chunk(data)
+            return True
+        return bool(finished)
+
+    def _relay_response(self, upstream, client_socket, cache_ctx=None, flow=None, fetch=None):
+        """把上游响应原样转发给客户端；启用缓存时同时收集响应以便存储，并处理再验证得到的 304。
+        作为合并请求的领取者（fetch）时每块数据同时交给跟随者"""
+        if cache_ctx is None:
+            def on_chunk(data):
+                if flow is not None and flow.status is None:
+                    flow.status = self._status_code(bytes(data[:16]))
+                if fetch is not None:
+                    self.coalescer.feed(fetch, data)
+
+            self._relay_downstream(upstream, client_socket, on_chunk, flow, fetch)
+            return
+
+        from http_cache import parse_response_head, decode_chunked
+        cache = self.http_cache
+        head = b''
+        for data in pooled_chunks(self.buffer_pool, upstream):
+            head += data
+            if b'\r\n\r\n' in head:
+                break
+        idx = head.find(b'\r\n\r\n')
+        try:
+            status, reason, resp_headers = parse_response_head(head[:idx])
+        except Exception:
+            status, reason, resp_headers = None, '', []
+
+        if flow is not None:
+            flow.status = status
+        entry = cache_ctx['entry']
+        if status == 304 and entry is not None:
+            fresh = cache.freshen(entry, resp_headers, cache_ctx['request_time'], time.time())
+            cache.record_hit(fresh, revalidated=True)
+            self._send_cached(client_socket, fresh, cache_ctx['method'], cache_ctx['req_headers'], flow)
+            return
+        cache.record_miss()
+
+        capture = None
+        if status is not None and cache.is_storable(cache_ctx['method'], status, resp_headers, cache_ctx['req_headers']):
+            capture = bytearray(head[idx + 4:])
+        resp = dict((k.lower(), v) for k, v in resp_headers)
+        chunked = 'chunked' in resp.get('transfer-encoding', '').lower()
+        expected = None
+        if not chunked and 'content-length' in resp:
+            try:
+                expected = int(resp['content-length'])
+            except Exception:
+                capture = None
+
+        def store(raw):
+            """响应完整时存入缓存；在把最后一块数据交给客户端之前调用，避免客户端立即重发请求时错过缓存"""
+            body = decode_chunked(raw) if chunked else bytes(raw)
+            if body is not None:
+                cache.store(cache_ctx['url'], cache_ctx['method'], status, reason, resp_headers, body,
+                            cache_ctx['req_headers'], cache_ctx['request_time'], time.time())
+
+        def complete(raw):
+            if chunked:
+                return raw.endswith(b'\r\n\r\n') and decode_chunked(raw) is not None
+            return expected is not None and len(raw) >= expected
+
+        if capture is not None and complete(capture):
+            store(capture[:expected] if expected is not None else capture)
+            capture = None
+        if fetch is not None:
+            self.coalescer.feed(fetch, head)
+        self._on_relay(flow, len(head), True)
+        limit = cache.max_object_size + 65536
+
+        def on_chunk(data):
+            nonlocal capture
+            if capture is not None:
+                capture += data
+                if len(capture) > limit:
+                    capture = None
+                elif complete(capture):
+                    store(capture[:expected] if expected is not None else capture)
+                    capture = None
+            if fetch is not None:
+                self.coalescer.feed(fetch, data)
+
+        eof = self._relay_downstream(upstream, client_socket, on_chunk, flow, fetch, reply=head)
+
+        # 无长度、以关闭连接结束的响应
+        if eof and capture is not None and expected is None and not chunked:
+            store(capture)
+
+    @staticmethod
+    def _status_code(data):
+        """从响应首行 'HTTP/1.1 200 OK' 中取出状态码，无法解析时返回 None"""
+        if not data.startswith(b'HTTP/'):
+            return None
+        try:
+            return int(data.split(b' ', 2)[1])
+        except Exception:
+            return None
+
+    def _send_cached(self, client_socket, entry, method, req_headers, flow=None):
+        """用缓存条目应答客户端（客户端自带条件头且满足时回 304）"""
+        not_modified = self.http_cache.client_not_modified(entry, req_headers)
+        if flow is not None:
+            flow.route = 'cache'
+            flow.status = 304 if not_modified else entry.status
+        payload = self.http_cache.render(entry, head_only=(method == 'HEAD'), not_modified=not_modified)
+        if flow is not None:
+            flow.bytes_down += len(payload)
+        try:
+            client_socket.sendall(payload)
+        except Exception:
+            pass
+
+    def _open_upstream(self, host, port, direct_timeout=3.0, skip_direct=False, flow=None, name=None):
+        """按规则打开到目标的上游连接：强制代理列表中的主机直接走 SOCKS，否则先直连、失败回退 SOCKS；
+        启用路由选择时，不受规则约束的域名按测量结果可能先走 SOCKS、失败再直连。
+        name 为 host 是 IP 时已知的域名（TLS SNI），与 host 一起参与规则匹配并作为选路的键。
+        启用预连接时优先取用备用连接。返回 (socket, route)，route 为 'direct' 或 'socks'；都失败时抛出 UpstreamError"""
+        started = time.monotonic()
+        # 同一次连接只读取一次规则，热重载替换规则时不会混用新旧两套
+        bypass_rules, proxy_rules = self._rules
+        forced = not skip_direct and (self._host_in_list(host, proxy_rules) or
+                                      (name is not None and self._host_in_list(name, proxy_rules)))
+        allow_direct = not skip_direct and not forced
+        if forced and not self._is_ip_literal(host):
+            # 强制代理的域名只交给上游解析，本地不做任何查询
+            with self._dns_lock:
+                self._dns_stats['avoided'] += 1
+        selector = self.route_selector
+        if selector is not None and (not allow_direct or self._host_in_list(host, bypass_rules) or
+                                     (name is not None and self._host_in_list(name, bypass_rules))):
+            selector = None  # 规则优先
+        domain = name or host
+        socks_first = HAS_PYSOCKS and selector is not None and selector.choose(domain) == 'socks'
+        if self.preconnect is not None:
+            spare = self.preconnect.claim(host, port, allow_direct=allow_direct and not socks_first)
+            if spare is not None:
+                return self._upstream_opened(spare[0], spare[1], host, port, started, flow)
+
+        if socks_first:
+            try:
+                attempt = time.monotonic()
+                sock = self._connect_socks(host, port)
+                selector.record_connect(domain, 'socks', time.monotonic() - attempt)
+                return self._upstream_opened(sock, 'socks', host, port, started, flow)
+            except Exception as e:
+                self._log(f"Error connecting via socks to {host}:{port}, trying direct: {e}")
+
+        if allow_direct:
+            attempt = time.monotonic()
+            sock = self._try_direct_connect(host, port, timeout=direct_timeout)
+            if sock:
+                if selector is not None and not self.sockopts.fastopen('direct'):
+                    selector.record_connect(domain, 'direct', time.monotonic() - attempt)
+                return self._upstream_opened(sock, 'direct', host, port, started, flow)
+
+        if socks_first:
+            raise UpstreamError('Upstream connect failed')
+        if not HAS_PYSOCKS:
+            raise UpstreamError('PySocks not installed and direct connect failed')
+        try:
+            attempt = time.monotonic()
+            sock = self._connect_socks(host, port)
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            self._log(f"Error connecting via socks to {host}:{port}: {e}")
+            raise UpstreamError('Upstream connect failed')
+        if selector is not None:
+            selector.record_connect(domain, 'socks', time.monotonic() - attempt)
+        return self._upstream_opened(sock, 'socks', host, port, started, flow)
+
+    def _upstream_opened(self, sock, route, host, port, started, flow):
+        """记录上游连接的路由与建立耗时（重试时累计），并更新预连接的访问模型"""
+        if flow is not None:
+            flow.route = route
+            flow.connect_time = (flow.connect_time or 0.0) + time.monotonic() - started
+            if route == 'socks' and self.scheduler is not None and flow.priority is None:
+                self.scheduler.start(flow)
+        if self.preconnect is not None:
+            self.preconnect.record(host, port, route)
+        return sock, route
+
+    def _connect_socks(self, host, port):
+        """经上游 SOCKS5 连接到 (host, port)，失败时关闭套接字并抛出原异常；
+        断路器打开时不尝试连接，直接抛出 UpstreamUnavailable"""
+        breaker = self.socks_breaker
+        socks_host, socks_port = self._upstream
+        if breaker is not None and not breaker.allow():
+            raise UpstreamUnavailable(f"SOCKS upstream {socks_host}:{socks_port} unavailable")
+        timer = self.connect_timer
+        tkey = timer.key(host, port, 'socks') if timer is not None else None
+        sock = _SocksSocket()
+        try:
+            self.sockopts.apply(sock, 'socks')
+            sock.set_proxy(socks.SOCKS5, socks_host, socks_port)
+            sock.settimeout(timer.timeout(tkey, 10.0) if timer is not None else 10.0)
+            started = time.perf_counter()
+            sock.connect((self._socks_address(host), port))
+        except Exception as e:
+            try:
+                sock.close()
+            except Exception:
+                pass
+            if timer is not None and isinstance(getattr(e, 'socket_err', e), socket.timeout):
+                timer.record_timeout(tkey)
+            if breaker is not None:
+                # only an unreachable upstream counts: TCP connect or greeting/auth failed. Once the CONNECT
+                # request is out, error replies and timeouts depend on the destination, not the upstream
+                if sock.greeted:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        if timer is not None:
+            timer.record(tkey, time.perf_counter() - started)
+            sock.settimeout(10.0)
+        return sock
+
+    def _socks_address(self, host):
+        """交给上游的目标地址：默认传域名由上游解析（ATYP 0x03），local_dns_list 中的主机在本地解析后传 IP"""
+        if self._is_ip_literal(host):
+            return host
+        if self._local_dns_rules.match(host):
+            addrs = self._resolve_host(host)
+            if addrs:
+                with self._dns_lock:
+                    self._dns_stats['socks_by_ip'] += 1
+                return str(addrs[0])
+        with self._dns_lock:
+            self._dns_stats['socks_by_name'] += 1
+        return host
+
+    def _probe_socks(self) -> bool:
+        """断路器探测：连接上游并完成 SOCKS5 问候（NO AUTH），2 秒超时"""
+        try:
+            with socket.create_connection(self._upstream, timeout=2.0) as s:
+                s.sendall(b'\x05\x01\x00')
+                return self._recv_exact(s, 2) == b'\x05\x00'
+        except Exception:
+            return False
+
+    def _preconnect_open(self, host, port, route):
+        """预连接线程使用：按学习到的路由静默建立一条备用连接，失败返回 None"""
+        try:
+            if route == 'direct':
+                return self._dial_direct(host, port, 3.0)
+            if HAS_PYSOCKS:
+                return self._connect_socks(host, port)
+        except Exception:
+            pass
+        return None
 
     def parse_host_port(self, url):
         """解析URL主机和端口"""
@@ -439,7 +1531,8 @@ class ProxyServer:
         # Check proxy_list is handled by caller
         key = (host, int(port))
         now = time.time()
-        cached = self._reach_cache.get(key)
+        with self._reach_lock:
+            cached = self._reach_cache.get(key)
         if cached is not None:
             ok, expires = cached
             if now < expires:
@@ -449,28 +1542,116 @@ class ProxyServer:
                     return None
 
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-            s.connect((host, port))
-            s.settimeout(10.0)
-            # record success
-            self._reach_cache[key] = (True, now + self._success_ttl)
+            s = self._dial_direct(host, port, timeout)
+            # record success; with TCP_FASTOPEN_CONNECT connect() returned before the handshake
+            if not self.sockopts.fastopen('direct'):
+                self._remember_reach(key, True, now + self._success_ttl)
             self._log(f"Direct connect success to {host}:{port}")
             return s
         except Exception as e:
             # record failure
-            self._reach_cache[key] = (False, now + self._fail_ttl)
+            self._remember_reach(key, False, now + self._fail_ttl)
             self._log(f"Direct connect failed to {host}:{port}: {e}")
-            try:
-                s.close()
-            except Exception:
-                pass
             return None
 
+    def _remember_reach(self, key, ok, expires):
+        """写入可达性缓存；超过 REACH_CACHE_SIZE 时先丢弃最久未用的条目"""
+        with self._reach_lock:
+            self._reach_cache[key] = (ok, expires)
+            self._reach_cache.move_to_end(key)
+            while len(self._reach_cache) > self.REACH_CACHE_SIZE:
+                self._reach_cache.popitem(last=False)
+
+    def _dial_direct(self, host, port, timeout):
+        """直接 TCP 连接 (host, port)；启用自适应超时时按该目标的历史连接耗时决定超时并记录本次耗时（出站 TFO 时不记录）。
+        失败时关闭套接字并抛出异常"""
+        timer = self.connect_timer
+        tkey = None
+        if timer is not None:
+            tkey = timer.key(host, port, 'direct')
+            timeout = timer.timeout(tkey, timeout)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.sockopts.apply(s, 'direct')
+            s.settimeout(timeout)
+            # 使用带缓存的解析结果：规则匹配时已解析过的域名不会再查询一次
+            addr = host
+            if not self._is_ip_literal(host):
+                addrs = [a for a in self._resolve_host(host) if a.version == 4]
+                if not addrs:
+                    raise socket.gaierror(f"cannot resolve {host}")
+                addr = str(addrs[0])
+            started = time.perf_counter()
+            s.connect((addr, port))
+        except Exception as e:
+            s.close()
+            if timer is not None and isinstance(e, socket.timeout):
+                timer.record_timeout(tkey)
+            raise
+        if timer is not None and not self.sockopts.fastopen('direct'):
+            timer.record(tkey, time.perf_counter() - started)
+        s.settimeout(10.0)
+        return s
+
+    DNS_CACHE_TTL = 60
+    DNS_CACHE_SIZE = 4096
+    REACH_CACHE_SIZE = 4096
+
+    def _resolve_host(self, host):
+        """解析域名得到 ipaddress 地址列表（带有界缓存，失败返回空列表）；IP 字面量不解析"""
+        if self._is_ip_literal(host):
+            return []
+        now = time.time()
+        with self._dns_lock:
+            cached = self._dns_cache.get(host)
+            if cached is not None and cached[1] > now:
+                self._dns_cache.move_to_end(host)
+                self._dns_stats['cache_hits'] += 1
+                return cached[0]
+        addrs = []
+        started = time.perf_counter()
+        try:
+            for info in socket.getaddrinfo(host, None, type=socket.SOCK_STREAM):
+                try:
+                    addr = ipaddress.ip_address(info[4][0].split('%', 1)[0])
+                except Exception:
+                    continue
+                if addr not in addrs:
+                    addrs.append(addr)
+        except Exception:
+            pass
+        with self._dns_lock:
+            self._dns_stats['lookups'] += 1
+            self._dns_stats['lookup_seconds'] += time.perf_counter() - started
+            if not addrs:
+                self._dns_stats['failures'] += 1
+            self._dns_cache[host] = (addrs, now + (self.DNS_CACHE_TTL if addrs else self._fail_ttl))
+            self._dns_cache.move_to_end(host)
+            while len(self._dns_cache) > self.DNS_CACHE_SIZE:
+                self._dns_cache.popitem(last=False)
+        return addrs
+
+    @staticmethod
+    def _is_ip_literal(host) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
     def _host_in_list(self, host: str, lst) -> bool:
         """判断 host 是否与列表中的任一项匹配。列表项可以是域名（或后缀）、IP 或 CIDR。"""
         if not lst:
             return False
+        if isinstance(lst, (RuleSet, CompiledRuleSet)):
+            if lst.match(host):
+                return True
+            # CIDR 规则同样匹配域名解析得到的地址
+            if self.rule_resolve_ips and lst.has_networks:
+                for addr in self._resolve_host(host):
+                    if lst.match_ip(addr):
+                        return True
+            return False
         for entry in lst:
             entry = str(entry).strip()
             if not entry:
@@ -500,21 +1681,6 @@ class ProxyServer:
                     if h == e or h.endswith('.' + e):
                         return True
         return False
-    def _try_direct_connect(self, host, port, timeout=3.0):
-        """尝试直接 TCP 连接到目标主机:port，成功返回 socket（已连接），失败返回 None"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-            s.connect((host, port))
-            # set a slightly larger timeout for subsequent operations
-            s.settimeout(10.0)
-            return s
-        except Exception:
-            try:
-                s.close()
-            except Exception:
-                pass
-            return None
     def _read_chunked_body(self, sock):
         """从套接字读取 chunked 编码的请求体，返回包含原始 chunked bytes 的字节串"""
         data = b''
@@ -563,39 +1729,60 @@ class ProxyServer:
             pass
         return data
             
-    def forward_data(self, client_socket, socks_socket):
-        """双向转发数据"""
-        def forward(src, dst):
-            try:
-                while True:
-                    data = src.recv(4096)
-                    if not data:
-                        break
-                    dst.send(data)
-            except Exception:
-                pass
-        
-        # 启动两个线程进行双向转发
-        thread1 = threading.Thread(target=forward, args=(client_socket, socks_socket), daemon=True)
-        thread2 = threading.Thread(target=forward, args=(socks_socket, client_socket), daemon=True)
+    def forward_data(self, client_socket, socks_socket, flow=None, preload=None):
+        """双向转发数据：一端读到 EOF 时向另一端传播半关闭（SHUT_WR），空闲/超龄隧道由 TunnelReaper 回收。
+        单线程非阻塞转发，写不出去的数据按方向排队，超过高水位暂停读取（见 relay.py）。
+        preload 为已从客户端读入池中 slab 的数据（SNI 预读），最先发往上游"""
+        tunnel = self.reaper.register(client_socket, socks_socket)
+
+        # TCP_QUICKACK 需要在每次读取后重新设置
+        upstream_role = flow.route if flow is not None and flow.route else 'socks'
+        rearm = {True: self.sockopts.quickack(upstream_role), False: self.sockopts.quickack('client')}
 
-        thread1.start()
-        thread2.start()
+        def on_data(downstream, data):
+            if rearm[downstream]:
+                self.sockopts.rearm_quickack(socks_socket if downstream else client_socket)
+            tunnel.touch()
+            self._on_relay(flow, len(data), downstream)
 
-        # wait briefly for threads to finish; they are daemon threads so will exit on program end
         try:
-            while thread1.is_alive() or thread2.is_alive():
-                thread1.join(timeout=0.1)
-                thread2.join(timeout=0.1)
-                if not self.running:
-                    break
-        except Exception:
-            pass
+            relay(client_socket, socks_socket, self.buffer_pool, high_water=self.relay_high_water,
+                  low_water=self.relay_low_water, on_data=on_data, on_half_close=self.reaper.record_half_close,
+                  should_stop=lambda: tunnel.closed or not self.running, stats=self.relay_stats,
+                  preload=preload)
+        except Exception as e:
+            self._log(f"Relay error: {e}")
+        finally:
+            self.reaper.unregister(tunnel)
+
+# config.json keys that differ from ProxyServer keyword arguments
+CONFIG_KEY_MAP = {
+    'proxy_host': 'local_host',
+    'proxy_port': 'local_port',
+    'upstream_host': 'socks_host',
+    'upstream_port': 'socks_port',
+}
+
+
+def options_from_config(cfg, base_dir=None) -> dict:
+    """把 config.json 内容转换为 ProxyServer 构造参数，未知键忽略。base_dir 为配置文件所在目录，
+    用于解析规则文件等相对路径"""
+    # keyword names straight from the code object: importing inspect costs ~5 ms of daemon startup
+    code = ProxyServer.__init__.__code__
+    params = code.co_varnames[:code.co_argcount]
+    opts = {}
+    for key, value in (cfg or {}).items():
+        name = CONFIG_KEY_MAP.get(key, key)
+        if name in params and name not in ('self', 'logger'):
+            opts[name] = value
+    for name in ('local_port', 'socks_port'):
+        if name in opts:
+            opts[name] = int(opts[name])
+    if base_dir and 'rule_base_dir' not in opts:
+        opts['rule_base_dir'] = str(base_dir)
+    return opts
+
 
 if __name__ == '__main__':
-    server = ProxyServer(8080)
-    try:
-        server.start()
-    except KeyboardInterrupt:
-        print("\nShutting down proxy server...")
-        server.stop()
+    from proxyd import main
+    main()
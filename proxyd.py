@@ -0,0 +1,117 @@
+import time
+
+_STARTED = time.perf_counter()
+
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+
+# Headless entry point for servers: python -m proxyd -c config.json
+# Reads the same config.json as the GUI, never imports tkinter or winreg, and leaves optional
+# modules (cache, shaping, pre-connect, PAC) to ProxyServer's lazy imports when they are enabled.
+# SIGTERM/SIGINT stop the server, SIGHUP re-reads config.json and hot-reloads it, SIGUSR1 starts
+# (or ends early) a sampling profile written as collapsed stacks to profile_dir.
+
+log = logging.getLogger('proxyd')
+
+
+def load_config(path):
+    """读取 config.json；文件不存在时返回空配置"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='proxyd', description='Run the proxy server without the GUI')
+    parser.add_argument('-c', '--config', default='config.json', help='path to config.json (default: ./config.json)')
+    parser.add_argument('--host', help='listen address (overrides proxy_host)')
+    parser.add_argument('--port', type=int, help='listen port (overrides proxy_port)')
+    parser.add_argument('--upstream', metavar='HOST:PORT', help='upstream SOCKS5 server (overrides upstream_host/port)')
+    parser.add_argument('--log-level', default='INFO', help='DEBUG, INFO, WARNING or ERROR (default: INFO)')
+    return parser.parse_args(argv)
+
+
+def build_config(args) -> dict:
+    """合并 config.json 与命令行参数（命令行优先）"""
+    cfg = load_config(args.config)
+    if args.host:
+        cfg['proxy_host'] = args.host
+    if args.port:
+        cfg['proxy_port'] = args.port
+    if args.upstream:
+        host, _, port = args.upstream.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"--upstream must be HOST:PORT, got {args.upstream!r}")
+        cfg['upstream_host'] = host
+        cfg['upstream_port'] = int(port)
+    return cfg
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, str(args.log_level).upper(), logging.INFO),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    from proxy_server import ProxyServer, options_from_config
+
+    base_dir = os.path.dirname(os.path.abspath(args.config))
+    try:
+        cfg = build_config(args)
+        server = ProxyServer(**options_from_config(cfg, base_dir=base_dir))
+    except (OSError, ValueError) as e:
+        log.error(f"Invalid configuration: {e}")
+        return 2
+
+    def on_stop(signum, frame):
+        log.info(f"Received {signal.Signals(signum).name}, shutting down")
+        server.stop()
+
+    # SIGHUP and POST /reload re-read config.json (command-line overrides still apply)
+    server.config_source = lambda: options_from_config(build_config(args), base_dir=base_dir)
+
+    def on_reload(signum, frame):
+        # rules, TTLs and the upstream are swapped in place; listener, pools and socket options need a restart
+        try:
+            report = server.reload_config()
+            if report['restart_required']:
+                log.warning(f"Restart required to apply: {', '.join(report['restart_required'])}")
+        except Exception as e:
+            log.error(f"Reload failed, keeping the current configuration: {e}")
+
+    def on_profile(signum, frame):
+        try:
+            if server.profiler is not None and server.profiler.running:
+                server.stop_profile()
+            else:
+                server.start_profile()
+        except Exception as e:
+            log.error(f"Profiling failed: {e}")
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, on_reload)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, on_profile)
+
+    thread = threading.Thread(target=server.start, name='ProxyServer', daemon=True)
+    thread.start()
+    # 主线程只负责等待与处理信号
+    while thread.is_alive() and not server.ready.wait(0.05):
+        pass
+    if not server.ready.is_set():
+        log.error("Proxy server failed to start")
+        return 1
+    log.info(f"Accepting connections {(time.perf_counter() - _STARTED) * 1000:.1f} ms after startup")
+    while thread.is_alive():
+        thread.join(0.5)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
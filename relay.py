@@ -0,0 +1,254 @@
+import errno
+import select
+import socket
+import threading
+
+from collections import deque
+
+# Flow-controlled bidirectional relay. Both sockets are non-blocking and served by one loop (one thread
+# per tunnel instead of two). Each direction owns a write queue of pool slabs: whatever the destination
+# does not accept right away stays queued and is retried when it becomes writable, so partial sends never
+# lose bytes. Reading from a source pauses once its queue reaches the high watermark and resumes below the
+# low watermark, so a fast sender cannot overrun a slow receiver and buffering per tunnel stays bounded.
+# Plain-HTTP responses use the same loop one way (upload=False): only the upstream is read, the client
+# socket is only written.
+
+_POLLIN = getattr(select, 'POLLIN', 1)
+_POLLOUT = getattr(select, 'POLLOUT', 4)
+_POLLERR = getattr(select, 'POLLERR', 8)
+_POLLHUP = getattr(select, 'POLLHUP', 16)
+_POLLNVAL = getattr(select, 'POLLNVAL', 32)
+
+# poll timeout while the buffer pool is exhausted (seconds)
+_POOL_RETRY = 0.05
+
+
+class RelayStats:
+    """所有隧道共享的转发统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'relays': 0, 'partial_writes': 0, 'paused': 0, 'pool_stalls': 0, 'peak_queued': 0}
+
+    def add(self, partial_writes, paused, pool_stalls, peak_queued):
+        with self._lock:
+            s = self._stats
+            s['relays'] += 1
+            s['partial_writes'] += partial_writes
+            s['paused'] += paused
+            s['pool_stalls'] += pool_stalls
+            if peak_queued > s['peak_queued']:
+                s['peak_queued'] = peak_queued
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+class _Direction:
+    __slots__ = ('src', 'dst', 'downstream', 'queue', 'queued', 'eof', 'shut', 'paused', 'dead')
+
+    def __init__(self, src, dst, downstream):
+        self.src = src
+        self.dst = dst
+        self.downstream = downstream
+        # [slab, start, end] entries waiting to be written to dst
+        self.queue = deque()
+        self.queued = 0
+        self.eof = False  # src will send no more data
+        self.shut = False  # EOF propagated to dst (SHUT_WR)
+        self.paused = False  # reading paused by the high watermark
+        self.dead = False  # dst can no longer be written; drop whatever is queued
+
+    @property
+    def done(self):
+        return self.dead or (self.eof and self.shut)
+
+
+class _Poller:
+    """poll() 的最小封装，没有 poll 的平台（Windows）退回 select()"""
+
+    def __init__(self, socks):
+        self._poll = None
+        self._socks = {s.fileno(): s for s in socks}
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+            for fd in self._socks:
+                self._poll.register(fd, 0)
+        self._masks = dict.fromkeys(self._socks, 0)
+
+    def set(self, sock, mask):
+        fd = sock.fileno()
+        if fd in self._masks and self._masks[fd] != mask:
+            self._masks[fd] = mask
+            if self._poll is not None:
+                self._poll.modify(fd, mask)
+
+    def drop(self, sock):
+        for fd, s in list(self._socks.items()):
+            if s is sock:
+                del self._socks[fd]
+                del self._masks[fd]
+                if self._poll is not None:
+                    self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        """返回 [(socket, events)]；timeout 为秒或 None（无限等待）"""
+        if self._poll is not None:
+            ready = self._poll.poll(None if timeout is None else timeout * 1000)
+            return [(self._socks[fd], ev) for fd, ev in ready if fd in self._socks]
+        rlist = [s for fd, s in self._socks.items() if self._masks[fd] & _POLLIN]
+        wlist = [s for fd, s in self._socks.items() if self._masks[fd] & _POLLOUT]
+        if not rlist and not wlist:
+            return []
+        r, w, _ = select.select(rlist, wlist, [], timeout)
+        events = {}
+        for s in r:
+            events[s] = events.get(s, 0) | _POLLIN
+        for s in w:
+            events[s] = events.get(s, 0) | _POLLOUT
+        return list(events.items())
+
+
+def relay(a, b, pool, high_water=262144, low_water=65536, on_data=None, on_half_close=None,
+          should_stop=None, stats=None, preload=None, reply=b'', upload=True, timeout=None):
+    """在 a（客户端）与 b（上游）之间双向转发直到两个方向都结束或出错。
+    on_data(downstream, view) 在每块数据读入后调用；on_half_close() 在向一端传播 EOF 后调用；
+    should_stop() 返回 True 时提前结束。preload 为已从 a 读入、尚未转发的 [(slab, n)]，
+    先于后续数据写往 b，slab 归 relay 所有并在结束时归还。reply 为调用方已从 b 读入并处理过的数据
+    （如响应头），先于后续数据写往 a，不再调用 on_data。upload=False 时只转发 b 到 a，不读取 a。
+    timeout 秒内两端都没有任何事件时抛出 socket.timeout"""
+    up = _Direction(a, b, False)
+    down = _Direction(b, a, True)
+    directions = (up, down)
+    if not upload:
+        up.dead = True
+    for s in (a, b):
+        s.setblocking(False)
+    poller = _Poller((a, b))
+    partial_writes = paused = pool_stalls = peak_queued = 0
+    starved = False
+
+    def flush(d):
+        """尽量把队列写入 dst；返回 False 表示 dst 已不可写"""
+        nonlocal partial_writes
+        while d.queue:
+            entry = d.queue[0]
+            slab, start, end = entry
+            try:
+                n = d.dst.send(memoryview(slab)[start:end])
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return False
+            d.queued -= n
+            if start + n < end:
+                entry[1] = start + n
+                partial_writes += 1
+                return True
+            d.queue.popleft()
+            pool.release(slab)
+        return True
+
+    def kill(d):
+        d.dead = True
+        while d.queue:
+            pool.release(d.queue.popleft()[0])
+        d.queued = 0
+
+    try:
+        for slab, n in preload or ():
+            if on_data is not None:
+                on_data(False, memoryview(slab)[:n])
+            up.queue.append([slab, 0, n])
+            up.queued += n
+        reply = memoryview(reply)
+        for start in range(0, len(reply), pool.slab_size):
+            chunk = reply[start:start + pool.slab_size]
+            slab = pool.acquire(timeout)
+            slab[:len(chunk)] = chunk
+            down.queue.append([slab, 0, len(chunk)])
+            down.queued += len(chunk)
+        while True:
+            if should_stop is not None and should_stop():
+                return
+            if all(d.done for d in directions):
+                return
+            # 计算每个套接字关心的事件
+            masks = {a: 0, b: 0}
+            for d in directions:
+                if d.dead:
+                    continue
+                if not d.eof and not d.paused and not starved:
+                    masks[d.src] |= _POLLIN
+                if d.queue:
+                    masks[d.dst] |= _POLLOUT
+            for s, mask in masks.items():
+                poller.set(s, mask)
+            events = poller.poll(_POOL_RETRY if starved else timeout)
+            if not events and not starved and timeout is not None:
+                raise socket.timeout('relay timed out')
+            starved = False
+            for sock, ev in events:
+                if ev & _POLLNVAL:
+                    return
+                hangup = ev & (_POLLHUP | _POLLERR)
+                for d in directions:
+                    if d.src is sock and not d.eof and not d.dead and (ev & _POLLIN or hangup):
+                        slab = pool.try_acquire()
+                        if slab is None:
+                            starved = True
+                            pool_stalls += 1
+                            continue
+                        try:
+                            n = sock.recv_into(slab)
+                        except (BlockingIOError, InterruptedError):
+                            pool.release(slab)
+                            continue
+                        except OSError:
+                            pool.release(slab)
+                            return
+                        if not n:
+                            pool.release(slab)
+                            d.eof = True
+                            continue
+                        if on_data is not None:
+                            on_data(d.downstream, memoryview(slab)[:n])
+                        d.queue.append([slab, 0, n])
+                        d.queued += n
+                        # 快速路径：立即尝试写出
+                        if not flush(d):
+                            kill(d)
+                            continue
+                        if d.queued > peak_queued:
+                            peak_queued = d.queued
+                        if d.queued >= high_water and not d.paused:
+                            d.paused = True
+                            paused += 1
+                    if d.dst is sock and d.queue and ev & (_POLLOUT | _POLLERR | _POLLHUP):
+                        if not flush(d):
+                            kill(d)
+                if hangup and all(d.eof or d.dead or d.src is not sock for d in directions):
+                    # 对端已完全关闭且数据已读尽：不再写入该套接字，并停止轮询它避免空转
+                    for d in directions:
+                        if d.dst is sock:
+                            kill(d)
+                    poller.drop(sock)
+            for d in directions:
+                if d.paused and d.queued <= low_water:
+                    d.paused = False
+                if d.eof and not d.shut and not d.queue and not d.dead:
+                    # 源端已结束且数据已全部写出：向目标传播半关闭
+                    d.shut = True
+                    try:
+                        d.dst.shutdown(socket.SHUT_WR)
+                        if on_half_close is not None:
+                            on_half_close()
+                    except OSError as e:
+                        if e.errno not in (errno.ENOTCONN,):
+                            kill(d)
+    finally:
+        for d in directions:
+            kill(d)
+        if stats is not None:
+            stats.add(partial_writes, paused, pool_stalls, peak_queued)
@@ -0,0 +1,372 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+# Timing-faithful replay of captured traffic. The trace is an access log written by the proxy itself
+# (access_log / access_log_format in config.json): it already holds only metadata per request or tunnel
+# -- start time, host, port, method, route, byte counts and durations -- and never payloads.
+#
+# The replay starts a ProxyServer from a config.json and wires it to local stand-ins: an HTTP origin,
+# a tunnel origin and socks5_stub as the upstream. Records that went direct are sent to 127.0.0.1 and
+# records that went through SOCKS to "localhost", which is put on proxy_list so the proxy takes the same
+# route. Every record starts at its original offset (divided by --speed) on its own thread, so
+# inter-arrival times and concurrency follow the trace. Request/response sizes, origin think time and
+# tunnel lifetimes are reproduced from the recorded values.
+#
+#   python replay.py access.log [-c config.json] [--speed 4] [--socks-latency 0.05] [--json result.json]
+
+DIRECT_HOST = '127.0.0.1'
+SOCKS_HOST = 'localhost'
+# rough size of the request / response headers included in the logged byte counts
+HEADER_ESTIMATE = 160
+CTRL = struct.Struct('!QQ')  # tunnel origin control header: bytes to read, bytes to send
+
+
+def load_trace(path):
+    """读取访问日志（JSONL 或二进制格式），按开始时间排序，跳过发给代理自身的请求"""
+    with open(path, 'rb') as f:
+        binary = f.read(8).startswith(b'PXAL')
+    if binary:
+        from access_log import read_binary
+        records = list(read_binary(path))
+    else:
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # truncated last line
+    records = [r for r in records if r.get('route') != 'local' and r.get('method')]
+    records.sort(key=lambda r: r['ts'])
+    return records
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f"p{p}": round(values[min(len(values) - 1, int(len(values) * p / 100))], 3) for p in points}
+    result['max'] = round(values[-1], 3)
+    return result
+
+
+class HttpOrigin(socketserver.ThreadingTCPServer):
+    """HTTP 源站替身：/r?down=N&delay=S 在等待 S 秒后返回 N 字节的响应体"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _HttpOriginHandler)
+
+
+class _HttpOriginHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+        head, _, body = data.partition(b'\r\n\r\n')
+        lines = head.decode('iso-8859-1').split('\r\n')
+        method, target = lines[0].split()[:2]
+        length = 0
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        remaining = length - len(body)
+        while remaining > 0:
+            chunk = sock.recv(min(remaining, 65536))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+        params = dict(p.partition('=')[::2] for p in target.partition('?')[2].split('&') if p)
+        down = int(params.get('down', 0))
+        delay = float(params.get('delay', 0))
+        if delay > 0:
+            time.sleep(delay)
+        header = (f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {down}\r\n"
+                  "Connection: close\r\n\r\n").encode('iso-8859-1')
+        sock.sendall(header)
+        if method != 'HEAD':
+            _send_zeros(sock, down)
+
+
+class TunnelOrigin(socketserver.ThreadingTCPServer):
+    """隧道源站替身：读取控制头 (up, down)，接收 up 字节、发送 down 字节，然后等待对端关闭"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _TunnelOriginHandler)
+
+
+class _TunnelOriginHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        try:
+            up, down = CTRL.unpack(_recv_exact(sock, CTRL.size))
+            drain(sock, up)
+            _send_zeros(sock, down)
+            # 保持连接直到客户端按记录的隧道时长结束后关闭
+            while sock.recv(65536):
+                pass
+        except OSError:
+            pass
+
+
+_ZEROS = bytes(65536)
+
+
+def _send_zeros(sock, n):
+    while n > 0:
+        k = min(n, len(_ZEROS))
+        sock.sendall(_ZEROS[:k])
+        n -= k
+
+
+def drain(sock, n):
+    """读取并丢弃 n 字节，对端提前关闭时抛出 ConnectionError"""
+    while n > 0:
+        chunk = sock.recv(min(n, 65536))
+        if not chunk:
+            raise ConnectionError('peer closed early')
+        n -= len(chunk)
+
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError('peer closed early')
+        data += chunk
+    return data
+
+
+def read_response_head(sock):
+    """读取响应头，返回 (状态码, 已读入的响应体开头)"""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('no response')
+        data += chunk
+    head, _, rest = data.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), rest
+
+
+class Replayer:
+    def __init__(self, records, proxy_addr, http_port, tunnel_port, speed=1.0, origin_delay=True,
+                 max_delay=10.0, max_hold=60.0, timeout=30.0):
+        self.records = records
+        self.proxy_addr = proxy_addr
+        self.http_port = http_port
+        self.tunnel_port = tunnel_port
+        self.speed = float(speed)
+        self.origin_delay = bool(origin_delay)
+        self.max_delay = float(max_delay)
+        self.max_hold = float(max_hold)
+        self.timeout = float(timeout)
+        self._lock = threading.Lock()
+        self._active = 0
+        # per kind: latencies (ms), errors
+        self.results = {}
+        self.lag = []
+        self.peak_concurrency = 0
+
+    def _host(self, rec):
+        return SOCKS_HOST if rec.get('route') == 'socks' else DIRECT_HOST
+
+    def _record(self, kind, latency, ok, total):
+        with self._lock:
+            r = self.results.setdefault(kind, {'count': 0, 'errors': 0, 'latency': [], 'total': []})
+            r['count'] += 1
+            if ok:
+                r['latency'].append(latency * 1000)
+                r['total'].append(total * 1000)
+            else:
+                r['errors'] += 1
+
+    def _http(self, rec):
+        """普通 HTTP 请求：latency 为去掉源站思考时间后的响应头到达时间"""
+        method = rec['method']
+        delay = 0.0
+        if self.origin_delay:
+            delay = max(0.0, (rec.get('duration_ms') or 0) - (rec.get('connect_ms') or 0)) / 1000
+            delay = min(delay, self.max_delay) / self.speed
+        body = b''
+        if method in ('POST', 'PUT', 'PATCH'):
+            body = bytes(max(0, (rec.get('bytes_up') or 0) - HEADER_ESTIMATE))
+        down = max(0, (rec.get('bytes_down') or 0) - HEADER_ESTIMATE)
+        host = f"{self._host(rec)}:{self.http_port}"
+        head = (f"{method} http://{host}/r?down={down}&delay={delay:.6f} HTTP/1.1\r\nHost: {host}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('iso-8859-1')
+        started = time.perf_counter()
+        with socket.create_connection(self.proxy_addr, timeout=self.timeout) as s:
+            s.sendall(head + body)
+            status, _ = read_response_head(s)
+            first = time.perf_counter()
+            while s.recv(65536):
+                pass
+        done = time.perf_counter()
+        return max(0.0, first - started - delay), status == 200, done - started
+
+    def _tunnel(self, rec, socks5):
+        """CONNECT / SOCKS5 隧道：latency 为建立隧道的耗时，之后按记录的字节数与时长收发并保持"""
+        host = self._host(rec)
+        hold = min((rec.get('duration_ms') or 0) / 1000, self.max_hold) / self.speed
+        up = max(0, (rec.get('bytes_up') or 0) - CTRL.size)
+        down = rec.get('bytes_down') or 0
+        started = time.perf_counter()
+        with socket.create_connection(self.proxy_addr, timeout=self.timeout) as s:
+            if socks5:
+                s.sendall(b'\x05\x01\x00')
+                _recv_exact(s, 2)
+                name = host.encode('ascii')
+                s.sendall(b'\x05\x01\x00\x03' + bytes([len(name)]) + name + struct.pack('!H', self.tunnel_port))
+                reply = _recv_exact(s, 10)
+                ok = reply[1] == 0
+            else:
+                s.sendall(f"CONNECT {host}:{self.tunnel_port} HTTP/1.1\r\nHost: {host}:{self.tunnel_port}\r\n\r\n"
+                          .encode('iso-8859-1'))
+                status, rest = read_response_head(s)
+                ok = status == 200 and not rest
+            established = time.perf_counter()
+            if ok:
+                s.sendall(CTRL.pack(up, down))
+                _send_zeros(s, up)
+                drain(s, down)
+                remaining = hold - (time.perf_counter() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        return established - started, ok, time.perf_counter() - started
+
+    def _run_one(self, rec):
+        with self._lock:
+            self._active += 1
+            self.peak_concurrency = max(self.peak_concurrency, self._active)
+        method = rec['method']
+        kind = 'CONNECT' if method == 'CONNECT' else 'SOCKS5' if method == 'SOCKS5' else 'HTTP'
+        try:
+            if kind == 'HTTP':
+                latency, ok, total = self._http(rec)
+            else:
+                latency, ok, total = self._tunnel(rec, kind == 'SOCKS5')
+        except Exception:
+            latency, ok, total = 0.0, False, 0.0
+        self._record(kind, latency, ok, total)
+        with self._lock:
+            self._active -= 1
+
+    def run(self):
+        """按记录的到达间隔（除以 speed）启动每条记录，等待全部完成，返回汇总"""
+        if not self.records:
+            return self.summary(0.0)
+        t0 = self.records[0]['ts']
+        threads = []
+        started = time.perf_counter()
+        for rec in self.records:
+            due = started + (rec['ts'] - t0) / self.speed
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            self.lag.append((time.perf_counter() - due) * 1000)
+            t = threading.Thread(target=self._run_one, args=(rec,), daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed) -> dict:
+        kinds = {}
+        for kind, r in sorted(self.results.items()):
+            kinds[kind] = {'count': r['count'], 'errors': r['errors'],
+                           'latency_ms': percentiles(r['latency']), 'total_ms': percentiles(r['total'])}
+        return {'records': len(self.records), 'speed': self.speed, 'elapsed_s': round(elapsed, 3),
+                'peak_concurrency': self.peak_concurrency, 'schedule_lag_ms': percentiles(self.lag),
+                'kinds': kinds}
+
+
+def format_summary(s) -> str:
+    lines = [f"{s['records']} records in {s['elapsed_s']:.1f}s at {s['speed']}x, "
+             f"peak concurrency {s['peak_concurrency']}, schedule lag p99 "
+             f"{s['schedule_lag_ms'].get('p99', 0):.1f} ms"]
+    lines.append(f"{'kind':8} {'count':>6} {'errors':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (latency ms)")
+    for kind, k in s['kinds'].items():
+        lat = k['latency_ms']
+        lines.append(f"{kind:8} {k['count']:>6} {k['errors']:>6} " +
+                     ' '.join(f"{lat.get(p, 0):>9.2f}" for p in ('p50', 'p90', 'p99', 'max')))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay a captured access log against a local proxy')
+    parser.add_argument('trace', help='access log written with access_log (jsonl or binary)')
+    parser.add_argument('-c', '--config', help='config.json with the engine settings to test')
+    parser.add_argument('--speed', type=float, default=1.0, help='divide inter-arrival times and durations')
+    parser.add_argument('--limit', type=int, default=0, help='replay only the first N records')
+    parser.add_argument('--no-origin-delay', action='store_true', help='answer HTTP requests immediately')
+    parser.add_argument('--max-hold', type=float, default=60.0, help='cap on tunnel lifetime (seconds)')
+    parser.add_argument('--socks-latency', type=float, default=0.0, help='handshake latency of the SOCKS stand-in')
+    parser.add_argument('--json', metavar='PATH', help='also write the summary as JSON')
+    args = parser.parse_args(argv)
+
+    records = load_trace(args.trace)
+    if args.limit:
+        records = records[:args.limit]
+
+    from proxy_server import ProxyServer, options_from_config
+    from socks5_stub import Socks5Server
+
+    http_origin, tunnel_origin = HttpOrigin(), TunnelOrigin()
+    for srv in (http_origin, tunnel_origin):
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    stub = Socks5Server('127.0.0.1', 0, handshake_latency=args.socks_latency)
+    threading.Thread(target=stub.start, daemon=True).start()
+    stub.ready.wait(5)
+
+    cfg = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            cfg = json.load(f)
+    opts = options_from_config(cfg, base_dir=os.path.dirname(os.path.abspath(args.config)) if args.config else None)
+    # 替身拓扑：直连目标为 127.0.0.1，强制代理目标为 localhost；不写访问日志、不打开 PAC
+    opts.update(local_host='127.0.0.1', local_port=0, socks_host='127.0.0.1', socks_port=stub.port,
+                bypass_list=[], proxy_list=[SOCKS_HOST], rule_files=None, rule_snapshot=None, access_log=None,
+                socks_inbound=True, socks_listen_port=0, pac_enabled=False, log_level='WARNING')
+    server = ProxyServer(**opts)
+    threading.Thread(target=server.start, daemon=True).start()
+    if not server.ready.wait(5):
+        print('proxy failed to start', file=sys.stderr)
+        return 1
+    proxy_addr = ('127.0.0.1', server.socket.getsockname()[1])
+
+    replayer = Replayer(records, proxy_addr, http_origin.server_address[1], tunnel_origin.server_address[1],
+                        speed=args.speed, origin_delay=not args.no_origin_delay, max_hold=args.max_hold)
+    summary = replayer.run()
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    server.stop()
+    stub.stop()
+    for srv in (http_origin, tunnel_origin):
+        srv.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+# Latency-based route selection. For every domain that matches neither the bypass nor the proxy rules
+# the proxy keeps, per route ('direct' and 'socks'), an EWMA of the connect time and of the transfer
+# throughput of flows large enough to measure. A new connection goes over the route with the lower
+# expected cost: connect time plus the time to move REF_BYTES at the measured throughput when both routes
+# have throughput samples, connect time alone otherwise. The current choice is only abandoned when the
+# other route is better by `switch_margin`, so routes do not flap on noise. Once per `probe_interval` the
+# route that is not chosen gets one connection so its numbers stay current. Domains without history use
+# the default route (direct first, as without route selection).
+
+ROUTES = ('direct', 'socks')
+ALPHA = 0.3
+# flows that moved less than this say nothing about throughput
+MIN_TRANSFER = 128 * 1024
+# transfer size the cost estimate is based on
+REF_BYTES = 256 * 1024
+# how many recently decided domains /stats explains
+EXPLAIN_TOP = 20
+
+
+class RouteSelector:
+    def __init__(self, probe_interval=300.0, switch_margin=1.25, max_entries=4096):
+        self.probe_interval = float(probe_interval)
+        self.switch_margin = max(1.0, float(switch_margin))
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        # domain -> {'route', 'reason', 'decided', route: [connect_ewma, kbps_ewma, samples, updated, probed]}
+        self._table = OrderedDict()
+        self._stats = {'decisions': 0, 'direct': 0, 'socks': 0, 'probes': 0, 'switches': 0,
+                       'connect_samples': 0, 'transfer_samples': 0}
+
+    def _entry(self, domain):
+        entry = self._table.get(domain)
+        if entry is None:
+            entry = {'route': 'direct', 'reason': 'no-data', 'decided': 0.0}
+            for r in ROUTES:
+                entry[r] = [None, None, 0, 0.0, 0.0]
+            self._table[domain] = entry
+            if len(self._table) > self.max_entries:
+                self._table.popitem(last=False)
+        else:
+            self._table.move_to_end(domain)
+        return entry
+
+    @staticmethod
+    def _cost(m, with_transfer):
+        connect, rate = m[0], m[1]
+        if with_transfer:
+            return connect + REF_BYTES / rate
+        return connect
+
+    def _prefer(self, entry):
+        """由测量值决定偏好路由，返回 (route, reason)"""
+        d, s = entry['direct'], entry['socks']
+        if d[0] is None or s[0] is None:
+            return entry['route'], entry['reason'] if entry['reason'] != 'probe' else 'no-data'
+        with_transfer = bool(d[1] and s[1])
+        reason = 'throughput' if with_transfer else 'connect'
+        current = entry['route']
+        other = 'socks' if current == 'direct' else 'direct'
+        if self._cost(entry[other], with_transfer) * self.switch_margin < self._cost(entry[current], with_transfer):
+            return other, reason
+        return current, reason
+
+    def choose(self, domain, now=None) -> str:
+        """为一次新连接选择路由（'direct' 或 'socks'）"""
+        domain = str(domain).lower()
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entry(domain)
+            route, reason = self._prefer(entry)
+            if route != entry['route']:
+                self._stats['switches'] += 1
+            entry['route'], entry['reason'] = route, reason
+            other = entry['socks' if route == 'direct' else 'direct']
+            # 只有已经用过的域名才探测另一条路由，一次性访问的域名不多花一次连接
+            if entry[route][2] and now - max(other[3], other[4]) >= self.probe_interval:
+                other[4] = now
+                route = 'socks' if route == 'direct' else 'direct'
+                entry['reason'] = 'probe'
+                self._stats['probes'] += 1
+            entry['decided'] = now
+            self._stats['decisions'] += 1
+            self._stats[route] += 1
+        return route
+
+    def record_connect(self, domain, route, seconds, now=None):
+        """记录一次成功连接的耗时"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            m = self._entry(str(domain).lower())[route]
+            m[0] = seconds if m[0] is None else (1 - ALPHA) * m[0] + ALPHA * seconds
+            m[2] += 1
+            m[3] = now
+            self._stats['connect_samples'] += 1
+
+    def record_transfer(self, domain, route, nbytes, seconds, now=None):
+        """流结束时记录下行吞吐；数据量太小的流以及未经路由选择的域名（规则匹配）不计入"""
+        if nbytes < MIN_TRANSFER or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._table.get(str(domain).lower())
+            if entry is None:
+                return
+            m = entry[route]
+            m[1] = rate if m[1] is None else (1 - ALPHA) * m[1] + ALPHA * rate
+            m[3] = now
+            self._stats['transfer_samples'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['tracked'] = len(self._table)
+            domains = {}
+            recent = sorted(self._table.items(), key=lambda kv: kv[1]['decided'], reverse=True)[:EXPLAIN_TOP]
+            for domain, entry in recent:
+                explain = {'route': entry['route'], 'reason': entry['reason']}
+                for r in ROUTES:
+                    m = entry[r]
+                    explain[r] = {'connect_ms': None if m[0] is None else round(m[0] * 1000, 1),
+                                  'kbps': None if m[1] is None else round(m[1] / 1024, 1), 'samples': m[2]}
+                domains[domain] = explain
+            s['domains'] = domains
+        return s
@@ -0,0 +1,480 @@
+import base64
+import bisect
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from urllib.parse import urlparse
+
+# Compiled bypass/proxy rules. Entries may be domains (suffix match), IP literals or CIDR.
+# Domain lookups walk the host's label suffixes against a set instead of scanning the list; IP lookups
+# bisect merged, sorted ranges built from the CIDR entries.
+#
+# Large rule sets (CN-IP CIDR lists, domain lists, gfwlist) can be loaded from files and compiled
+# into a binary snapshot that is memory-mapped on startup: sorted 64-bit domain hashes plus sorted,
+# merged IPv4/IPv6 ranges, all searched with bisect directly on the mapping.
+
+
+class RuleSet:
+    def __init__(self, entries=None):
+        self.domains = set()
+        self.ips = set()
+        self.networks = []
+        # networks as merged, sorted (starts, ends) per IP version, built on the first lookup
+        self._ranges = None
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry):
+        """添加一条规则（域名/后缀、IP 或 CIDR），无法识别的空项忽略"""
+        entry = str(entry).strip()
+        if not entry:
+            return
+        if '/' in entry:
+            try:
+                self.networks.append(ipaddress.ip_network(entry, strict=False))
+                self._ranges = None
+            except Exception:
+                pass
+            return
+        try:
+            self.ips.add(ipaddress.ip_address(entry))
+            return
+        except Exception:
+            pass
+        self.domains.add(entry.lower().rstrip('.'))
+
+    def match(self, host) -> bool:
+        """判断 host 是否命中规则：IP 与 IP/CIDR 比较，域名按后缀逐级查找"""
+        if not host:
+            return False
+        try:
+            addr = ipaddress.ip_address(host)
+        except Exception:
+            addr = None
+        if addr is not None:
+            return self.match_ip(addr)
+        return self.match_domain(host)
+
+    def match_ip(self, addr) -> bool:
+        if addr in self.ips:
+            return True
+        ranges = self._ranges
+        if ranges is None:
+            v4, v6 = _ip_ranges((), self.networks)
+            ranges = self._ranges = {4: ([s for s, e in v4], [e for s, e in v4]),
+                                     6: ([s for s, e in v6], [e for s, e in v6])}
+        starts, ends = ranges[addr.version]
+        n = int(addr)
+        i = bisect.bisect_right(starts, n) - 1
+        return i >= 0 and n <= ends[i]
+
+    def match_domain(self, host) -> bool:
+        if not self.domains:
+            return False
+        h = host.lower().rstrip('.')
+        while True:
+            if h in self.domains:
+                return True
+            idx = h.find('.')
+            if idx == -1:
+                return False
+            h = h[idx + 1:]
+
+    @property
+    def has_networks(self) -> bool:
+        return bool(self.networks)
+
+    def __len__(self):
+        return len(self.domains) + len(self.ips) + len(self.networks)
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+# ---------------------------------------------------------------------------
+# rule file loaders
+
+def _read_text(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-8', errors='ignore')
+    # gfwlist is usually distributed base64-encoded
+    stripped = ''.join(text.split())
+    sample = stripped[:200]
+    if stripped and '.' not in sample and ':' not in sample and '!' not in sample:
+        try:
+            return base64.b64decode(stripped + '=' * (-len(stripped) % 4)).decode('utf-8', errors='ignore')
+        except Exception:
+            pass
+    return text
+
+
+def load_domain_list(path):
+    """读取纯域名列表：每行一个域名，支持 # 注释、前导 '.'/'*.' 以及 domain:/full: 前缀"""
+    entries = []
+    for line in _read_text(path).splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        for prefix in ('domain:', 'full:'):
+            if line.startswith(prefix):
+                line = line[len(prefix):]
+        line = line.lstrip('*').lstrip('.')
+        if line:
+            entries.append(line)
+    return entries
+
+
+def load_cidr_list(path):
+    """读取 CIDR/IP 列表：每行一个网段或地址，无效行忽略"""
+    entries = []
+    for line in _read_text(path).splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            ipaddress.ip_network(line, strict=False)
+            entries.append(line)
+        except Exception:
+            pass
+    return entries
+
+
+def _gfw_host(rule):
+    if '://' in rule:
+        return urlparse(rule).hostname
+    host = rule.split('/', 1)[0].split(':', 1)[0]
+    if '*' in host or not host or '.' not in host:
+        return None
+    return host
+
+
+def load_gfwlist(path):
+    """读取 gfwlist/AutoProxy 格式，返回 (需要代理的条目, 例外条目)。正则与通配规则无法转换为域名，忽略"""
+    proxy, bypass = [], []
+    for line in _read_text(path).splitlines():
+        line = line.strip()
+        if not line or line.startswith(('!', '[')):
+            continue
+        target = proxy
+        if line.startswith('@@'):
+            target = bypass
+            line = line[2:]
+        if line.startswith('/') and line.endswith('/'):
+            continue
+        if line.startswith('||'):
+            host = _gfw_host(line[2:])
+        elif line.startswith('|'):
+            host = _gfw_host(line[1:])
+        else:
+            host = _gfw_host(line.lstrip('.'))
+        if host:
+            target.append(host.lower())
+    return proxy, bypass
+
+
+RULE_FORMATS = ('domains', 'cidr', 'gfwlist')
+
+
+def load_rule_files(rule_files, base_dir=None):
+    """按配置读取规则文件，返回 (bypass 条目, proxy 条目)。
+    rule_files 为 [{"path": ..., "format": "domains|cidr|gfwlist", "list": "bypass|proxy"}]"""
+    bypass, proxy = [], []
+    for spec in rule_files or []:
+        path = spec['path']
+        if base_dir and not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        fmt = spec.get('format', 'domains')
+        target = proxy if spec.get('list', 'proxy' if fmt == 'gfwlist' else 'bypass') == 'proxy' else bypass
+        if fmt == 'domains':
+            target.extend(load_domain_list(path))
+        elif fmt == 'cidr':
+            target.extend(load_cidr_list(path))
+        elif fmt == 'gfwlist':
+            p, b = load_gfwlist(path)
+            target.extend(p)
+            bypass.extend(b)
+        else:
+            raise ValueError(f"unknown rule file format: {fmt}")
+    return bypass, proxy
+
+
+# ---------------------------------------------------------------------------
+# binary snapshot
+
+SNAPSHOT_MAGIC = b'PXRS'
+SNAPSHOT_VERSION = 1
+# magic, version, byteorder flag, digest, n_domains, blob_len, n_v4, n_v6 (padded to 64 bytes)
+_HEADER = struct.Struct('<4sIB32sIIII7x')
+_NATIVE_LITTLE = sys.byteorder == 'little'
+
+
+def _domain_hash(domain) -> int:
+    return int.from_bytes(hashlib.blake2b(domain.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _ip_ranges(ips, networks):
+    """把 IP 与网段转换为合并后的有序区间列表，返回 (v4, v6)，每项为 [start, end] 整数对"""
+    v4, v6 = [], []
+    for ip in ips:
+        (v4 if ip.version == 4 else v6).append((int(ip), int(ip)))
+    for net in networks:
+        (v4 if net.version == 4 else v6).append((int(net.network_address), int(net.broadcast_address)))
+    return _merge_ranges(v4), _merge_ranges(v6)
+
+
+def source_digest(entries, rule_files, base_dir=None) -> bytes:
+    """规则来源摘要（内联条目 + 文件路径/大小/修改时间），用于判断快照是否过期"""
+    h = hashlib.sha256()
+    h.update(json.dumps(list(entries)).encode('utf-8'))
+    for spec in rule_files or []:
+        path = spec['path']
+        if base_dir and not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        st = os.stat(path)
+        h.update(json.dumps([path, spec.get('format'), spec.get('list'), st.st_size, st.st_mtime_ns]).encode('utf-8'))
+    return h.digest()
+
+
+def write_snapshot(path, entries, digest=b'\0' * 32):
+    """把规则条目编译成二进制快照文件（先写临时文件再原子替换）"""
+    rs = RuleSet(entries)
+    hashed = sorted((_domain_hash(d), d.encode('utf-8')) for d in rs.domains)
+    blob = bytearray()
+    hashes = array('Q')
+    offsets = array('I')
+    for h, d in hashed:
+        hashes.append(h)
+        offsets.append(len(blob))
+        blob += d
+    offsets.append(len(blob))
+    v4, v6 = _ip_ranges(rs.ips, rs.networks)
+    v4_arr = array('I', [s for s, e in v4] + [e for s, e in v4])
+    if not _NATIVE_LITTLE:
+        hashes.byteswap()
+        offsets.byteswap()
+        v4_arr.byteswap()
+    v6_bytes = b''.join(s.to_bytes(16, 'big') for s, e in v6) + b''.join(e.to_bytes(16, 'big') for s, e in v6)
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 1, digest, len(hashed), len(blob), len(v4), len(v6))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(hashes.tobytes())
+        f.write(offsets.tobytes())
+        f.write(bytes(blob))
+        # keep the IP sections 8-byte aligned for cast()
+        f.write(b'\0' * (-(len(header) + len(hashes) * 8 + len(offsets) * 4 + len(blob)) % 8))
+        f.write(v4_arr.tobytes())
+        f.write(v6_bytes)
+    os.replace(tmp, path)
+
+
+def read_snapshot_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            magic, version, little, digest = _HEADER.unpack(f.read(_HEADER.size))[:4]
+        if magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION:
+            return digest
+    except Exception:
+        pass
+    return None
+
+
+class _V6Keys:
+    """把 16 字节大端地址数组包装成可 bisect 的序列（bytes 按字典序比较即按数值比较）"""
+    __slots__ = ('mv', 'n')
+
+    def __init__(self, mv, n):
+        self.mv = mv
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return bytes(self.mv[i * 16:(i + 1) * 16])
+
+
+class CompiledRuleSet:
+    """内存映射的规则快照，接口与 RuleSet 一致；查找不需要把规则载入 Python 对象"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, little, self.digest, n_dom, blob_len, n_v4, n_v6 = _HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or bool(little) != _NATIVE_LITTLE:
+            self._mm.close()
+            raise ValueError(f"incompatible rule snapshot: {path}")
+        mv = memoryview(self._mm)
+        pos = _HEADER.size
+        self._hashes = mv[pos:pos + n_dom * 8].cast('Q')
+        pos += n_dom * 8
+        self._offsets = mv[pos:pos + (n_dom + 1) * 4].cast('I')
+        pos += (n_dom + 1) * 4
+        self._blob = mv[pos:pos + blob_len]
+        pos += blob_len
+        pos += -pos % 8
+        self._v4_starts = mv[pos:pos + n_v4 * 4].cast('I')
+        self._v4_ends = mv[pos + n_v4 * 4:pos + n_v4 * 8].cast('I')
+        pos += n_v4 * 8
+        self._v6_starts = _V6Keys(mv[pos:pos + n_v6 * 16], n_v6)
+        self._v6_ends = _V6Keys(mv[pos + n_v6 * 16:pos + n_v6 * 32], n_v6)
+        self._n_dom = n_dom
+        self._n_v4 = n_v4
+        self._n_v6 = n_v6
+
+    def match(self, host) -> bool:
+        if not host:
+            return False
+        try:
+            addr = ipaddress.ip_address(host)
+        except Exception:
+            addr = None
+        if addr is not None:
+            return self.match_ip(addr)
+        return self.match_domain(host)
+
+    def match_ip(self, addr) -> bool:
+        if addr.version == 4:
+            n = int(addr)
+            i = bisect.bisect_right(self._v4_starts, n) - 1
+            return i >= 0 and n <= self._v4_ends[i]
+        key = addr.packed
+        i = bisect.bisect_right(self._v6_starts, key) - 1
+        return i >= 0 and key <= self._v6_ends[i]
+
+    def _has_domain(self, domain) -> bool:
+        h = _domain_hash(domain)
+        i = bisect.bisect_left(self._hashes, h)
+        raw = domain.encode('utf-8')
+        while i < self._n_dom and self._hashes[i] == h:
+            if self._blob[self._offsets[i]:self._offsets[i + 1]] == raw:
+                return True
+            i += 1
+        return False
+
+    def match_domain(self, host) -> bool:
+        if not self._n_dom:
+            return False
+        h = host.lower().rstrip('.')
+        while True:
+            if self._has_domain(h):
+                return True
+            idx = h.find('.')
+            if idx == -1:
+                return False
+            h = h[idx + 1:]
+
+    @property
+    def has_networks(self) -> bool:
+        return bool(self._n_v4 or self._n_v6)
+
+    # PAC generation needs the full rule list; decoded lazily and only on demand
+    @property
+    def domains(self):
+        return {bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8') for i in range(self._n_dom)}
+
+    @property
+    def ips(self):
+        return set()
+
+    @property
+    def networks(self):
+        nets = []
+        for i in range(self._n_v4):
+            nets.extend(ipaddress.summarize_address_range(ipaddress.IPv4Address(self._v4_starts[i]),
+                                                          ipaddress.IPv4Address(self._v4_ends[i])))
+        for i in range(self._n_v6):
+            nets.extend(ipaddress.summarize_address_range(ipaddress.IPv6Address(self._v6_starts[i]),
+                                                          ipaddress.IPv6Address(self._v6_ends[i])))
+        return nets
+
+    def close(self):
+        for name in ('_hashes', '_offsets', '_blob', '_v4_starts', '_v4_ends'):
+            try:
+                getattr(self, name).release()
+            except Exception:
+                pass
+        self._v6_starts = self._v6_ends = None
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return self._n_dom + self._n_v4 + self._n_v6
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+def build_rules(entries, rule_files=None, snapshot_path=None, base_dir=None, which='bypass'):
+    """根据内联条目与规则文件构建 which（'bypass' 或 'proxy'）规则集。
+    给出 snapshot_path 时使用内存映射快照，只有来源变化时才读取规则文件并重新编译；否则在内存中编译为 RuleSet"""
+    entries = list(entries or [])
+
+    def all_entries():
+        file_bypass, file_proxy = load_rule_files(rule_files, base_dir)
+        return entries + (file_proxy if which == 'proxy' else file_bypass)
+
+    if snapshot_path:
+        digest = source_digest(entries, rule_files, base_dir)
+        if read_snapshot_digest(snapshot_path) != digest:
+            compiled = all_entries()
+            try:
+                write_snapshot(snapshot_path, compiled, digest)
+            except OSError:
+                # e.g. the old snapshot is still mapped on Windows: fall back to an in-memory rule set
+                return RuleSet(compiled)
+        return CompiledRuleSet(snapshot_path)
+    if not rule_files:
+        return RuleSet(entries)
+    return RuleSet(all_entries())
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Compile or query bypass/proxy rule snapshots')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    c = sub.add_parser('compile', help='compile rule snapshots described by config.json')
+    c.add_argument('-c', '--config', default='config.json')
+    q = sub.add_parser('lookup', help='check which lists a host matches')
+    q.add_argument('-c', '--config', default='config.json')
+    q.add_argument('hosts', nargs='+')
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        cfg = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(args.config))
+    snap = cfg.get('rule_snapshot')
+    if snap and not os.path.isabs(snap):
+        snap = os.path.join(base_dir, snap)
+    sets = {}
+    for name, inline in (('bypass', cfg.get('bypass_list')), ('proxy', cfg.get('proxy_list'))):
+        path = f"{snap}.{name}" if snap else None
+        sets[name] = build_rules(inline, cfg.get('rule_files'), path, base_dir, name)
+        print(f"{name}: {len(sets[name])} rules" + (f" -> {path}" if path else ''))
+    if args.cmd == 'lookup':
+        for host in args.hosts:
+            print(host, {name: rs.match(host) for name, rs in sets.items()})
+
+
+if __name__ == '__main__':
+    main()
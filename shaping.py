@@ -0,0 +1,132 @@
+import threading
+import time
+
+# Per-client and per-destination traffic shaping: token-bucket rate limits applied inside the
+# relay loops, plus caps on concurrent connections. Keys are the client IP and the destination host.
+
+# drop idle buckets once this many have been created since the last sweep
+_SWEEP_EVERY = 1024
+_IDLE_SECONDS = 60.0
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'last', 'lock')
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n, now=None) -> float:
+        """预留 n 个令牌，返回需要等待的秒数（令牌可透支，由等待偿还）"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def idle(self, now) -> bool:
+        return self.tokens + (now - self.last) * self.rate >= self.burst and now - self.last > _IDLE_SECONDS
+
+
+class TrafficShaper:
+    def __init__(self, client_rate=0, client_burst=0, dest_rate=0, dest_burst=0,
+                 max_conns_per_client=0, max_conns_per_dest=0):
+        # rates in bytes/second, 0 = unlimited; burst defaults to one second worth of tokens
+        self.client_rate = float(client_rate or 0)
+        self.client_burst = float(client_burst or client_rate or 0)
+        self.dest_rate = float(dest_rate or 0)
+        self.dest_burst = float(dest_burst or dest_rate or 0)
+        self.max_conns_per_client = int(max_conns_per_client or 0)
+        self.max_conns_per_dest = int(max_conns_per_dest or 0)
+        self._lock = threading.Lock()
+        self._client_buckets = {}
+        self._dest_buckets = {}
+        self._client_conns = {}
+        self._dest_conns = {}
+        self._created = 0
+        self._stats = {'throttled_bytes': 0, 'throttle_wait_seconds': 0.0,
+                       'rejected_client_conns': 0, 'rejected_dest_conns': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.client_rate or self.dest_rate or self.max_conns_per_client or self.max_conns_per_dest)
+
+    # ---- concurrency caps ----
+    def _acquire(self, table, key, limit, stat) -> bool:
+        with self._lock:
+            n = table.get(key, 0)
+            if limit and n >= limit:
+                self._stats[stat] += 1
+                return False
+            table[key] = n + 1
+            return True
+
+    def _release(self, table, key):
+        with self._lock:
+            n = table.get(key, 0) - 1
+            if n > 0:
+                table[key] = n
+            else:
+                table.pop(key, None)
+
+    def acquire_client(self, client) -> bool:
+        """为客户端占用一个连接名额，超过上限返回 False"""
+        return self._acquire(self._client_conns, client, self.max_conns_per_client, 'rejected_client_conns')
+
+    def release_client(self, client):
+        self._release(self._client_conns, client)
+
+    def acquire_dest(self, host) -> bool:
+        """为目标域名占用一个连接名额，超过上限返回 False"""
+        return self._acquire(self._dest_conns, host, self.max_conns_per_dest, 'rejected_dest_conns')
+
+    def release_dest(self, host):
+        self._release(self._dest_conns, host)
+
+    # ---- rate limits ----
+    def _bucket(self, table, key, rate, burst):
+        bucket = table.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = table.get(key)
+                if bucket is None:
+                    bucket = table[key] = TokenBucket(rate, burst)
+                    self._created += 1
+                    if self._created >= _SWEEP_EVERY:
+                        self._sweep()
+        return bucket
+
+    def _sweep(self):
+        now = time.monotonic()
+        for table in (self._client_buckets, self._dest_buckets):
+            for key in [k for k, b in table.items() if b.idle(now)]:
+                del table[key]
+        self._created = 0
+
+    def throttle(self, client, host, nbytes):
+        """在转发循环中调用：按客户端与目标的令牌桶节流，必要时阻塞当前转发线程"""
+        now = time.monotonic()
+        wait = 0.0
+        if self.client_rate and client is not None:
+            wait = self._bucket(self._client_buckets, client, self.client_rate, self.client_burst).reserve(nbytes, now)
+        if self.dest_rate and host is not None:
+            wait = max(wait, self._bucket(self._dest_buckets, host, self.dest_rate, self.dest_burst).reserve(nbytes, now))
+        if wait > 0:
+            with self._lock:
+                self._stats['throttled_bytes'] += nbytes
+                self._stats['throttle_wait_seconds'] += wait
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['throttle_wait_seconds'] = round(s['throttle_wait_seconds'], 3)
+            s['active_clients'] = len(self._client_conns)
+            s['active_destinations'] = len(self._dest_conns)
+        return s
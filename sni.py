@@ -0,0 +1,119 @@
+import socket
+import time
+
+# TLS SNI peek for CONNECT tunnels to IP literals. After the proxy has answered "200 Connection
+# Established" the client's first bytes are read into buffer-pool slabs until the ClientHello can be
+# parsed; the server_name extension then stands in for the missing host name in rule matching and route
+# selection. The slabs are not copied: relay() is handed the same slabs as already-queued upstream data,
+# so the ClientHello goes out as the first bytes of the tunnel.
+
+# ClientHellos larger than this (or that need more than the peek timeout) are relayed without SNI
+MAX_HELLO = 32 * 1024
+
+
+def _server_name(body):
+    """从 ClientHello 消息体中取出 server_name 扩展里的主机名"""
+    p = 2 + 32  # client_version, random
+    p += 1 + body[p]  # session_id
+    p += 2 + int.from_bytes(body[p:p + 2], 'big')  # cipher_suites
+    p += 1 + body[p]  # compression_methods
+    if p + 2 > len(body):
+        return None  # no extensions
+    ext_end = min(len(body), p + 2 + int.from_bytes(body[p:p + 2], 'big'))
+    p += 2
+    while p + 4 <= ext_end:
+        etype = int.from_bytes(body[p:p + 2], 'big')
+        elen = int.from_bytes(body[p + 2:p + 4], 'big')
+        p += 4
+        if etype == 0:
+            q, end = p + 2, min(p + elen, ext_end)
+            while q + 3 <= end:
+                ntype = body[q]
+                nlen = int.from_bytes(body[q + 1:q + 3], 'big')
+                q += 3
+                if ntype == 0:
+                    name = bytes(body[q:q + nlen]).decode('ascii').rstrip('.').lower()
+                    return name or None
+                q += nlen
+            return None
+        p += elen
+    return None
+
+
+def parse_sni(data):
+    """解析客户端发来的前几个 TLS 记录。返回 (done, hostname)：done 为 False 表示 ClientHello 尚不完整；
+    不是 TLS、不是 ClientHello 或没有 SNI 时返回 (True, None)"""
+    handshake = b''
+    pos = 0
+    while True:
+        if len(data) < pos + 5:
+            return False, None
+        # content type handshake(22), major version 3
+        if data[pos] != 0x16 or data[pos + 1] != 3:
+            return True, None
+        end = pos + 5 + int.from_bytes(data[pos + 3:pos + 5], 'big')
+        handshake += bytes(data[pos + 5:min(end, len(data))])
+        if len(handshake) >= 4:
+            if handshake[0] != 0x01:
+                return True, None
+            need = 4 + int.from_bytes(handshake[1:4], 'big')
+            if need > MAX_HELLO:
+                return True, None
+            if len(handshake) >= need:
+                try:
+                    return True, _server_name(handshake[4:need])
+                except (IndexError, ValueError):
+                    return True, None
+        if end > len(data):
+            return False, None
+        pos = end
+
+
+def peek_client_hello(sock, pool, timeout=1.0):
+    """读入客户端最先发送的数据直到能判断 SNI（或超时、对端关闭），返回 ([(slab, n)], hostname 或 None)。
+    数据留在池中的 slab 里，由调用方交给 relay(preload=...) 先行转发，或自行归还"""
+    slabs = []
+    total = 0
+    deadline = time.monotonic() + timeout
+    saved = sock.gettimeout()
+    name = None
+    try:
+        while total < MAX_HELLO:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not slabs or slabs[-1][1] == len(slabs[-1][0]):
+                try:
+                    slabs.append([pool.acquire(remaining), 0])
+                except socket.timeout:
+                    break
+            slab = slabs[-1]
+            sock.settimeout(remaining)
+            try:
+                n = sock.recv_into(memoryview(slab[0])[slab[1]:])
+            except socket.timeout:
+                break
+            if not n:
+                break
+            slab[1] += n
+            total += n
+            if len(slabs) == 1:
+                data = memoryview(slab[0])[:slab[1]]
+            else:
+                data = b''.join(memoryview(s)[:k] for s, k in slabs)
+            done, name = parse_sni(data)
+            if done:
+                break
+    except Exception:
+        for s, _ in slabs:
+            pool.release(s)
+        raise
+    finally:
+        sock.settimeout(saved)
+    kept = []
+    for s, k in slabs:
+        if k:
+            kept.append((s, k))
+        else:
+            pool.release(s)
+    return kept, name
@@ -0,0 +1,340 @@
+import gc
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+from replay import HttpOrigin, TunnelOrigin, CTRL, drain, read_response_head
+
+# Soak test for resource leaks. A ProxyServer runs in this process against local stand-ins (the replay
+# origins and socks5_stub) while worker threads hammer it with a mix of plain HTTP (direct and through
+# SOCKS), CONNECT tunnels, tunnels the client abandons, connects to closed ports, garbage and idle
+# clients. Thread count, open file descriptors, RSS and the proxy's own tables are sampled throughout.
+#
+# The verdict compares two idle points: the baseline, taken after a warm-up round of the same load has
+# allocated whatever is allocated once (pool slabs, lazily created helpers), and the final sample taken
+# once the main load has stopped and settled. A metric that grew past its threshold between the two
+# is reported as a leak and the exit status is 1. The proxy's caches and its client thread list may
+# legitimately fill up under load, so they are checked against their own size bound instead.
+#
+#   python soak.py [-c config.json] [--duration 600] [--workers 32] [--json soak.json]
+
+DIRECT_HOST = '127.0.0.1'
+SOCKS_HOST = 'localhost'
+
+# action -> weight
+MIX = {'http_direct': 30, 'http_socks': 15, 'connect': 25, 'connect_abort': 5, 'refused': 10,
+       'garbage': 5, 'idle': 5, 'half_request': 5}
+
+# metric -> default allowed growth between the idle baseline and the idle final sample
+THRESHOLDS = {'threads': 4, 'fds': 16, 'rss_mb': 24.0, 'tunnels': 0, 'timers': 1024, 'pool_in_use': 0}
+# metric -> ProxyServer attribute holding its size bound (the thread list is pruned lazily; threads that
+# really stay alive show up in 'threads')
+BOUNDED = {'client_threads': '_prune_threads_at', 'reach_cache': 'REACH_CACHE_SIZE', 'dns_cache': 'DNS_CACHE_SIZE'}
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def sample(server):
+    """采集一次资源指标"""
+    stats = server.get_stats()
+    rss = _rss_mb()
+    return {
+        't': time.monotonic(),
+        'threads': threading.active_count(),
+        'fds': _open_fds(),
+        'rss_mb': None if rss is None else round(rss, 1),
+        'client_threads': len(server._client_threads),
+        'reach_cache': stats['reach_cache_entries'],
+        'dns_cache': stats['dns_cache_entries'],
+        'tunnels': stats['tunnels']['active_tunnels'],
+        'timers': stats['tunnels']['timers'],
+        'pool_in_use': stats['buffer_pool']['in_use'],
+    }
+
+
+def slope_per_min(samples, metric):
+    """负载期间的线性趋势（每分钟增量），用于报告"""
+    points = [(s['t'], s[metric]) for s in samples if s.get(metric) is not None]
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mt = sum(t for t, _ in points) / n
+    mv = sum(v for _, v in points) / n
+    var = sum((t - mt) ** 2 for t, _ in points)
+    if not var:
+        return 0.0
+    return sum((t - mt) * (v - mv) for t, v in points) / var * 60
+
+
+class Load:
+    def __init__(self, proxy_addr, http_port, tunnel_port, workers=32, timeout=10.0, seed=None):
+        self.proxy_addr = proxy_addr
+        self.http_port = http_port
+        self.tunnel_port = tunnel_port
+        self.workers = int(workers)
+        self.timeout = float(timeout)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {k: [0, 0] for k in MIX}  # action -> [ok, errors]
+        self.error_types = {}  # exception name -> count
+        actions, weights = zip(*MIX.items())
+        self._actions, self._weights = actions, weights
+
+    def _connect(self):
+        sock = socket.create_connection(self.proxy_addr, timeout=self.timeout)
+        return sock
+
+    def _http(self, host, rnd):
+        down = rnd.choice((0, 512, 4096, 65536, 262144))
+        with self._connect() as sock:
+            url = f"http://{host}:{self.http_port}/r?down={down}"
+            sock.sendall(f"GET {url} HTTP/1.1\r\nHost: {host}:{self.http_port}\r\nConnection: close\r\n\r\n".encode())
+            status, rest = read_response_head(sock)
+            drain(sock, down - len(rest))
+        return status == 200
+
+    def _tunnel(self, rnd, abort=False):
+        up, down = rnd.choice(((0, 0), (512, 4096), (4096, 65536), (65536, 262144)))
+        with self._connect() as sock:
+            target = f"{DIRECT_HOST}:{self.tunnel_port}"
+            sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+            status, rest = read_response_head(sock)
+            if status != 200:
+                return False
+            sock.sendall(CTRL.pack(up, down) + bytes(up))
+            if abort:
+                # 客户端不读响应就以 RST 断开，隧道必须被回收
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b'\x01\x00\x00\x00\x00\x00\x00\x00')
+                return True
+            drain(sock, down - len(rest))
+        return True
+
+    def _refused(self, rnd):
+        # 每次换一个关闭的端口：直连失败、SOCKS 回退也失败，应答 502
+        port = rnd.randrange(40000, 60000)
+        with self._connect() as sock:
+            target = f"{DIRECT_HOST}:{port}"
+            sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+            status, _ = read_response_head(sock)
+        return status in (502, 504)
+
+    def _garbage(self, rnd):
+        with self._connect() as sock:
+            sock.sendall(bytes(rnd.getrandbits(8) for _ in range(rnd.randrange(1, 512))) + b'\r\n\r\n')
+            try:
+                while sock.recv(4096):
+                    pass
+            except OSError:
+                pass
+        return True
+
+    def _idle(self, rnd):
+        with self._connect():
+            time.sleep(rnd.uniform(0.05, 0.5))
+        return True
+
+    def _half_request(self, rnd):
+        with self._connect() as sock:
+            sock.sendall(f"GET http://{DIRECT_HOST}:{self.http_port}/r?down=1 HTTP/1.1\r\nHost: ".encode())
+        return True
+
+    def _one(self, rnd):
+        action = rnd.choices(self._actions, self._weights)[0]
+        try:
+            if action == 'http_direct':
+                ok = self._http(DIRECT_HOST, rnd)
+            elif action == 'http_socks':
+                ok = self._http(SOCKS_HOST, rnd)
+            elif action == 'connect':
+                ok = self._tunnel(rnd)
+            elif action == 'connect_abort':
+                ok = self._tunnel(rnd, abort=True)
+            elif action == 'refused':
+                ok = self._refused(rnd)
+            elif action == 'garbage':
+                ok = self._garbage(rnd)
+            elif action == 'idle':
+                ok = self._idle(rnd)
+            else:
+                ok = self._half_request(rnd)
+        except Exception as e:
+            ok = False
+            name = type(e).__name__
+            with self._lock:
+                self.error_types[name] = self.error_types.get(name, 0) + 1
+        with self._lock:
+            self.counts[action][0 if ok else 1] += 1
+
+    def run(self, seconds):
+        deadline = time.monotonic() + seconds
+
+        def worker(seed):
+            rnd = random.Random(seed)
+            while time.monotonic() < deadline:
+                self._one(rnd)
+
+        threads = [threading.Thread(target=worker, args=(self._random.random(),), daemon=True)
+                   for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+
+def settle(server, seconds):
+    """等待负载结束后的收尾（隧道回收、线程退出），然后回收垃圾"""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if not server.get_stats()['tunnels']['active_tunnels']:
+            break
+        time.sleep(0.1)
+    time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+    gc.collect()
+
+
+def verdict(baseline, final, thresholds, bounds):
+    """返回 {metric: (baseline, final, growth, limit, ok)}；bounds 中的指标以 final 不超过上限为准，
+    limit 显示为 '<=N'"""
+    result = {}
+    for metric in list(thresholds) + list(bounds):
+        b, f = baseline.get(metric), final.get(metric)
+        if b is None or f is None:
+            continue
+        growth = round(f - b, 1)
+        if metric in bounds:
+            result[metric] = (b, f, growth, f"<={bounds[metric]}", f <= bounds[metric])
+        else:
+            result[metric] = (b, f, growth, thresholds[metric], growth <= thresholds[metric])
+    return result
+
+
+def format_report(report) -> str:
+    lines = [f"soak {report['duration_s']:.0f}s, {report['requests']} requests "
+             f"({report['errors']} errors), {report['samples']} samples"]
+    if report['error_types']:
+        lines.append('errors: ' + ', '.join(f"{k} {v}" for k, v in sorted(report['error_types'].items())))
+    lines.append(f"{'metric':15} {'baseline':>9} {'final':>9} {'growth':>8} {'limit':>7} {'trend/min':>10}")
+    for metric, (b, f, growth, limit, ok) in report['verdict'].items():
+        lines.append(f"{metric:15} {b:>9} {f:>9} {growth:>8} {limit:>7} {report['trend'][metric]:>10.1f}"
+                     f"{'' if ok else '  LEAK'}")
+    lines.append('PASS' if report['passed'] else 'FAIL')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Soak the proxy with mixed traffic and check for leaks')
+    parser.add_argument('-c', '--config', help='config.json with the engine settings to test')
+    parser.add_argument('--duration', type=float, default=600.0, help='seconds of load (default 600)')
+    parser.add_argument('--warmup', type=float, default=0.0, help='seconds of warm-up load (default 10%% of duration, at least 5)')
+    parser.add_argument('--workers', type=int, default=32, help='concurrent client threads')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between samples')
+    parser.add_argument('--settle', type=float, default=10.0, help='max seconds to wait for the load to drain')
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=N',
+                        help='allowed growth, e.g. rss_mb=50 (repeatable; metrics: %s)' % ', '.join(THRESHOLDS))
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', metavar='PATH', help='also write the report and samples as JSON')
+    args = parser.parse_args(argv)
+
+    thresholds = dict(THRESHOLDS)
+    for item in args.threshold:
+        name, _, value = item.partition('=')
+        if name not in thresholds:
+            parser.error(f"unknown metric {name}")
+        thresholds[name] = float(value)
+
+    from proxy_server import ProxyServer, options_from_config
+    from socks5_stub import Socks5Server
+
+    http_origin, tunnel_origin = HttpOrigin(), TunnelOrigin()
+    for srv in (http_origin, tunnel_origin):
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    stub = Socks5Server('127.0.0.1', 0)
+    threading.Thread(target=stub.start, daemon=True).start()
+    stub.ready.wait(5)
+
+    cfg = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            cfg = json.load(f)
+    opts = options_from_config(cfg, base_dir=os.path.dirname(os.path.abspath(args.config)) if args.config else None)
+    # 与 replay.py 相同的替身拓扑：直连目标为 127.0.0.1，强制代理目标为 localhost
+    opts.update(local_host='127.0.0.1', local_port=0, socks_host='127.0.0.1', socks_port=stub.port,
+                bypass_list=[], proxy_list=[SOCKS_HOST], rule_files=None, rule_snapshot=None, access_log=None,
+                pac_enabled=False, log_level='WARNING')
+    server = ProxyServer(**opts)
+    threading.Thread(target=server.start, daemon=True).start()
+    if not server.ready.wait(5):
+        print('proxy failed to start', file=sys.stderr)
+        return 1
+    proxy_addr = ('127.0.0.1', server.socket.getsockname()[1])
+    load = Load(proxy_addr, http_origin.server_address[1], tunnel_origin.server_address[1],
+                workers=args.workers, seed=args.seed)
+
+    warmup = args.warmup or max(5.0, args.duration / 10)
+    load.run(warmup)
+    settle(server, args.settle)
+    baseline = sample(server)
+
+    samples = [baseline]
+    done = threading.Event()
+
+    def sampler():
+        while not done.wait(args.interval):
+            samples.append(sample(server))
+
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    sampler_thread.start()
+    started = time.monotonic()
+    load.counts = {k: [0, 0] for k in MIX}
+    load.error_types = {}
+    load.run(args.duration)
+    elapsed = time.monotonic() - started
+    done.set()
+    sampler_thread.join()
+    settle(server, args.settle)
+    final = sample(server)
+    samples.append(final)
+
+    result = verdict(baseline, final, thresholds, {m: getattr(server, attr) for m, attr in BOUNDED.items()})
+    report = {
+        'duration_s': round(elapsed, 1),
+        'requests': sum(ok + err for ok, err in load.counts.values()),
+        'errors': sum(err for _, err in load.counts.values()),
+        'actions': {k: {'ok': ok, 'errors': err} for k, (ok, err) in load.counts.items()},
+        'error_types': dict(load.error_types),
+        'samples': len(samples),
+        'verdict': result,
+        'trend': {m: round(slope_per_min(samples, m), 2) for m in result},
+        'passed': all(v[4] for v in result.values()),
+    }
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, series=samples), f, indent=2)
+    server.stop()
+    stub.stop()
+    for srv in (http_origin, tunnel_origin):
+        srv.shutdown()
+    return 0 if report['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
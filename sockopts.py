@@ -0,0 +1,155 @@
+import socket
+import sys
+
+# Socket-option profile applied per role: the listening sockets, accepted client sockets, direct
+# upstream connections and connections to the SOCKS upstream. Configured through the "socket_options"
+# key of config.json, e.g. {"client": {"nodelay": true}, "direct": {"fastopen": true}}; values given
+# there override DEFAULT_PROFILE option by option.
+
+ROLES = ('listener', 'client', 'direct', 'socks')
+
+DEFAULT_PROFILE = {
+    # fastopen on the listener is the TFO queue length (0 = off); buffers set before listen()
+    # are inherited by accepted sockets
+    'listener': {'backlog': 128, 'fastopen': 0, 'sndbuf': 0, 'rcvbuf': 0},
+    'client': {'nodelay': True, 'keepalive': True, 'keepidle': 60, 'keepintvl': 10, 'keepcnt': 5,
+               'quickack': False, 'sndbuf': 0, 'rcvbuf': 0},
+    # fastopen on outbound sockets enables TCP_FASTOPEN_CONNECT (Linux 4.11+); connect() then returns
+    # before the handshake, so the proxy does not learn timing or reachability from those connects
+    'direct': {'nodelay': True, 'keepalive': True, 'keepidle': 60, 'keepintvl': 10, 'keepcnt': 5,
+               'quickack': False, 'fastopen': False, 'sndbuf': 0, 'rcvbuf': 0},
+    'socks': {'nodelay': True, 'keepalive': True, 'keepidle': 60, 'keepintvl': 10, 'keepcnt': 5,
+              'quickack': False, 'sndbuf': 0, 'rcvbuf': 0},
+}
+
+# option name -> (level, optname or None if missing on this platform, value type)
+_TCP_FASTOPEN_CONNECT = getattr(socket, 'TCP_FASTOPEN_CONNECT', 30 if sys.platform.startswith('linux') else None)
+OPTIONS = {
+    'nodelay': (socket.IPPROTO_TCP, getattr(socket, 'TCP_NODELAY', None), bool),
+    'keepalive': (socket.SOL_SOCKET, getattr(socket, 'SO_KEEPALIVE', None), bool),
+    # macOS names the idle time TCP_KEEPALIVE
+    'keepidle': (socket.IPPROTO_TCP, getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None)), int),
+    'keepintvl': (socket.IPPROTO_TCP, getattr(socket, 'TCP_KEEPINTVL', None), int),
+    'keepcnt': (socket.IPPROTO_TCP, getattr(socket, 'TCP_KEEPCNT', None), int),
+    'quickack': (socket.IPPROTO_TCP, getattr(socket, 'TCP_QUICKACK', None), bool),
+    'sndbuf': (socket.SOL_SOCKET, getattr(socket, 'SO_SNDBUF', None), int),
+    'rcvbuf': (socket.SOL_SOCKET, getattr(socket, 'SO_RCVBUF', None), int),
+    'fastopen': (socket.IPPROTO_TCP, None, None),  # role dependent, see _fastopen()
+    'backlog': (None, None, int),  # passed to listen(), not a socket option
+}
+_KEEPALIVE_DETAIL = ('keepidle', 'keepintvl', 'keepcnt')
+
+
+class SocketProfile:
+    def __init__(self, overrides=None, logger=None):
+        self._log = logger
+        self.profile = self._validate(overrides or {})
+        # options the platform rejected while probing; they are skipped from then on
+        self.disabled = {}
+        self.errors = 0
+        self._probe()
+
+    @staticmethod
+    def _validate(overrides) -> dict:
+        """合并默认配置并校验角色、选项名与取值类型，配置错误时抛出 ValueError"""
+        if not isinstance(overrides, dict):
+            raise ValueError('socket_options must be an object keyed by role')
+        profile = {role: dict(opts) for role, opts in DEFAULT_PROFILE.items()}
+        for role, opts in overrides.items():
+            if role not in ROLES:
+                raise ValueError(f"socket_options: unknown role '{role}' (expected one of {', '.join(ROLES)})")
+            if not isinstance(opts, dict):
+                raise ValueError(f"socket_options.{role} must be an object")
+            for name, value in opts.items():
+                if name not in DEFAULT_PROFILE[role]:
+                    raise ValueError(f"socket_options.{role}: unknown option '{name}'")
+                default = DEFAULT_PROFILE[role][name]
+                if isinstance(default, bool):
+                    if not isinstance(value, bool):
+                        raise ValueError(f"socket_options.{role}.{name} must be true or false")
+                elif isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                    raise ValueError(f"socket_options.{role}.{name} must be a non-negative integer")
+                profile[role][name] = value
+        return profile
+
+    def _fastopen(self, role):
+        if role == 'listener':
+            return socket.IPPROTO_TCP, getattr(socket, 'TCP_FASTOPEN', None)
+        return socket.IPPROTO_TCP, _TCP_FASTOPEN_CONNECT
+
+    def _settings(self, role):
+        """按角色生成需要设置的 (name, level, optname, value) 列表；0/False 的缓冲区与 TFO 保持系统默认"""
+        opts = self.profile[role]
+        out = []
+        for name, value in opts.items():
+            if name == 'backlog' or name in self.disabled.get(role, ()):
+                continue
+            if name in ('sndbuf', 'rcvbuf', 'fastopen') and not value:
+                continue
+            if name in _KEEPALIVE_DETAIL and not opts.get('keepalive'):
+                continue
+            if name == 'quickack' and not value:
+                continue
+            if name == 'fastopen':
+                level, optname = self._fastopen(role)
+                value = int(value)
+            else:
+                level, optname, kind = OPTIONS[name]
+                value = int(value)
+            out.append((name, level, optname, value))
+        return out
+
+    def _probe(self):
+        """启动时在临时套接字上试设每个选项，平台不支持的选项记录日志并禁用"""
+        for role in ROLES:
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            except Exception:
+                return
+            try:
+                for name, level, optname, value in self._settings(role):
+                    try:
+                        if optname is None:
+                            raise OSError('not supported on this platform')
+                        s.setsockopt(level, optname, value)
+                    except Exception as e:
+                        self.disabled.setdefault(role, set()).add(name)
+                        if self._log:
+                            self._log(f"Socket option {role}.{name} disabled: {e}")
+            finally:
+                s.close()
+
+    def apply(self, sock, role):
+        """把角色对应的选项设置到套接字上（监听套接字须在 bind/listen 之前，出站套接字须在 connect 之前）"""
+        for name, level, optname, value in self._settings(role):
+            try:
+                sock.setsockopt(level, optname, value)
+            except Exception:
+                # e.g. an AF_UNIX or already-closed socket; count it and keep going
+                self.errors += 1
+
+    def backlog(self) -> int:
+        return int(self.profile['listener']['backlog'] or 5)
+
+    def quickack(self, role) -> bool:
+        """TCP_QUICKACK 不是持久选项，内核会自动退回延迟 ACK；启用时转发循环在每次读取后重新设置"""
+        return bool(self.profile[role].get('quickack')) and 'quickack' not in self.disabled.get(role, ())
+
+    def fastopen(self, role) -> bool:
+        """出站启用 TCP_FASTOPEN_CONNECT 时 connect() 不等握手完成就返回，其耗时与成功不能说明目标可达"""
+        return bool(self.profile[role].get('fastopen')) and 'fastopen' not in self.disabled.get(role, ())
+
+    @staticmethod
+    def rearm_quickack(sock):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            'profile': {role: {k: v for k, v in opts.items() if k not in self.disabled.get(role, ())}
+                        for role, opts in self.profile.items()},
+            'disabled': {role: sorted(names) for role, names in self.disabled.items()},
+            'errors': self.errors,
+        }
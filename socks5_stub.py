@@ -1,130 +1,274 @@
+import argparse
+import asyncio
+import ipaddress
+import random
 import socket
+import struct
 import threading
+import time
+
+# SOCKS5 server supporting NO AUTH and CONNECT command only, for local testing.
+# Besides acting as a plain stub it can simulate a real remote SOCKS hop: handshake latency
+# with jitter, per-connection bandwidth limits, random connect failures and connection resets.
+# Runs on asyncio so thousands of concurrent relays cost no threads.
+
+REP_SUCCEEDED = 0x00
+REP_GENERAL_FAILURE = 0x01
+REP_HOST_UNREACHABLE = 0x04
+REP_CONNECTION_REFUSED = 0x05
+REP_COMMAND_NOT_SUPPORTED = 0x07
+REP_ATYP_NOT_SUPPORTED = 0x08
 
-# Minimal SOCKS5 server supporting NO AUTH and CONNECT command only.
-# Designed for local testing only (not production-grade).
 
 class Socks5Server:
-    def __init__(self, host='localhost', port=1080):
+    def __init__(self, host='localhost', port=1080, handshake_latency=0.0, jitter=0.0, bandwidth=None,
+                 connect_fail_rate=0.0, reset_rate=0.0, reset_after=65536, connect_timeout=5.0,
+                 backlog=4096, chunk_size=16384, seed=None):
         self.host = host
         self.port = port
+        # seconds added before the CONNECT reply (models the RTT to a remote SOCKS hop)
+        self.handshake_latency = float(handshake_latency)
+        # +/- seconds of uniform random noise on the handshake latency
+        self.jitter = float(jitter)
+        # bytes/second per connection and direction, None = unlimited
+        self.bandwidth = float(bandwidth) if bandwidth else None
+        # probability that a CONNECT is refused without trying the destination
+        self.connect_fail_rate = float(connect_fail_rate)
+        # probability that an established relay is reset after a random number of bytes (<= reset_after)
+        self.reset_rate = float(reset_rate)
+        self.reset_after = int(reset_after)
+        self.connect_timeout = float(connect_timeout)
+        self.backlog = int(backlog)
+        self.chunk_size = int(chunk_size)
+        self._random = random.Random(seed)
         self._running = False
-        self._sock = None
+        self._loop = None
+        self._server = None
+        self._stop_event = None
+        self._thread = None
+        self.ready = threading.Event()
+        self._stopped = threading.Event()
+        self.stats = {'connections': 0, 'active': 0, 'connect_failures': 0, 'injected_failures': 0,
+                      'resets': 0, 'bytes_up': 0, 'bytes_down': 0}
 
     def start(self):
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._sock.bind((self.host, self.port))
-        self._sock.listen(5)
-        self._running = True
-        while self._running:
-            try:
-                client, addr = self._sock.accept()
-                t = threading.Thread(target=self.handle_client, args=(client,), daemon=True)
-                t.start()
-            except Exception:
-                break
+        """在当前线程运行事件循环直到 stop() 被调用"""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.current_thread()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+            self._stopped.set()
 
     def stop(self):
         self._running = False
+        loop = self._loop
+        if loop is not None and self._stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except Exception:
+                return
+            # wait for the loop thread to finish cancelling relays (unless called from inside it)
+            if self.ready.is_set() and not loop.is_closed() and threading.current_thread() is not getattr(self, '_thread', None):
+                self._stopped.wait(timeout=2.0)
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        family = socket.AF_INET6 if ':' in str(self.host) else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        self.port = sock.getsockname()[1]
+        self._server = await asyncio.start_server(self.handle_client, sock=sock, backlog=self.backlog)
+        self._running = True
+        self.ready.set()
         try:
-            self._sock.close()
-        except Exception:
-            pass
+            await self._stop_event.wait()
+        finally:
+            self._server.close()
+            # cancel relays still in flight so the loop can close cleanly
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
 
-    def handle_client(self, conn):
+    def _latency(self):
+        delay = self.handshake_latency
+        if self.jitter:
+            delay += self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    @staticmethod
+    def _reply(rep, bind=None):
+        """构造 CONNECT 应答，bind 为 (addr, port)，缺省为 0.0.0.0:0"""
+        if bind is None:
+            return bytes([0x05, rep, 0x00, 0x01, 0, 0, 0, 0, 0, 0])
+        addr = ipaddress.ip_address(bind[0].split('%', 1)[0])
+        atyp = 0x01 if addr.version == 4 else 0x04
+        return bytes([0x05, rep, 0x00, atyp]) + addr.packed + struct.pack('!H', bind[1])
+
+    async def handle_client(self, reader, writer):
+        self.stats['connections'] += 1
+        self.stats['active'] += 1
+        remote_writer = None
         try:
-            # Greeting
-            data = conn.recv(2)
-            if not data or len(data) < 2:
-                conn.close()
-                return
-            ver = data[0]
-            nmethods = data[1]
-            methods = conn.recv(nmethods)
+            # greeting
+            ver, nmethods = await reader.readexactly(2)
+            await reader.readexactly(nmethods)
             # reply: version 5, NO AUTH (0x00)
-            conn.send(bytes([0x05, 0x00]))
+            writer.write(bytes([0x05, 0x00]))
 
             # request
-            hdr = conn.recv(4)
-            if not hdr or len(hdr) < 4:
-                conn.close()
-                return
-            ver, cmd, rsv, atyp = hdr[0], hdr[1], hdr[2], hdr[3]
+            ver, cmd, rsv, atyp = await reader.readexactly(4)
             if ver != 0x05:
-                conn.close()
                 return
             if cmd != 0x01:
                 # only support CONNECT
-                # reply: general failure
-                conn.send(bytes([0x05, 0x07, 0x00, 0x01, 0,0,0,0, 0,0]))
-                conn.close()
+                writer.write(self._reply(REP_COMMAND_NOT_SUPPORTED))
+                await writer.drain()
                 return
-
             if atyp == 0x01:
-                addr = conn.recv(4)
-                dest_addr = socket.inet_ntoa(addr)
+                dest_addr = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
             elif atyp == 0x03:
-                length = conn.recv(1)[0]
-                dest_addr = conn.recv(length).decode('utf-8')
+                length = (await reader.readexactly(1))[0]
+                dest_addr = (await reader.readexactly(length)).decode('utf-8')
             elif atyp == 0x04:
-                addr = conn.recv(16)
-                # IPv6 not supported in this stub
-                dest_addr = None
+                dest_addr = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
             else:
-                conn.close()
+                writer.write(self._reply(REP_ATYP_NOT_SUPPORTED))
+                await writer.drain()
+                return
+            dest_port = struct.unpack('!H', await reader.readexactly(2))[0]
+
+            delay = self._latency()
+            if delay:
+                await asyncio.sleep(delay)
+
+            if self.connect_fail_rate and self._random.random() < self.connect_fail_rate:
+                self.stats['injected_failures'] += 1
+                writer.write(self._reply(REP_CONNECTION_REFUSED))
+                await writer.drain()
                 return
-            port_bytes = conn.recv(2)
-            dest_port = int.from_bytes(port_bytes, 'big')
 
             # try to connect to dest
             try:
-                remote = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                remote.settimeout(5.0)
-                remote.connect((dest_addr, dest_port))
+                remote_reader, remote_writer = await asyncio.wait_for(
+                    asyncio.open_connection(dest_addr, dest_port), timeout=self.connect_timeout)
             except Exception:
-                # reply: general failure
-                conn.send(bytes([0x05, 0x01, 0x00, 0x01, 0,0,0,0, 0,0]))
-                conn.close()
+                self.stats['connect_failures'] += 1
+                writer.write(self._reply(REP_HOST_UNREACHABLE))
+                await writer.drain()
                 return
 
-            # reply success
-            # bind addr/port set to zeros
-            conn.send(bytes([0x05, 0x00, 0x00, 0x01, 0,0,0,0, 0,0]))
+            writer.write(self._reply(REP_SUCCEEDED, remote_writer.get_extra_info('sockname')[:2]))
+            await writer.drain()
+
+            reset_budget = None
+            if self.reset_rate and self._random.random() < self.reset_rate:
+                reset_budget = [self._random.randint(0, max(0, self.reset_after))]
 
             # relay
-            def relay(src, dst):
+            await asyncio.gather(
+                self._pipe(reader, remote_writer, 'bytes_up', reset_budget),
+                self._pipe(remote_reader, writer, 'bytes_down', reset_budget))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            # cancelled by stop(): finish normally, asyncio's stream callback calls task.exception()
+            # on the handler task and would report a cancelled task as an unhandled error
+            pass
+        except Exception:
+            pass
+        finally:
+            self.stats['active'] -= 1
+            for w in (remote_writer, writer):
+                if w is None:
+                    continue
                 try:
-                    while True:
-                        data = src.recv(4096)
-                        if not data:
-                            break
-                        dst.sendall(data)
+                    w.close()
                 except Exception:
                     pass
-                finally:
-                    try:
-                        dst.shutdown(socket.SHUT_RDWR)
-                    except Exception:
-                        pass
-
-            t1 = threading.Thread(target=relay, args=(conn, remote), daemon=True)
-            t2 = threading.Thread(target=relay, args=(remote, conn), daemon=True)
-            t1.start()
-            t2.start()
-            t1.join()
-            t2.join()
+
+    async def _pipe(self, reader, writer, counter, reset_budget):
+        """单方向转发；按 bandwidth 节流，并在 reset_budget 用尽时以 RST 中断两端"""
+        next_send = time.monotonic()
+        try:
+            while True:
+                data = await reader.read(self.chunk_size)
+                if not data:
+                    break
+                if reset_budget is not None:
+                    reset_budget[0] -= len(data)
+                    if reset_budget[0] <= 0:
+                        self._reset(writer)
+                        self._reset_peer(reader)
+                        self.stats['resets'] += 1
+                        return
+                if self.bandwidth:
+                    now = time.monotonic()
+                    next_send = max(now, next_send) + len(data) / self.bandwidth
+                    if next_send - now > 0.001:
+                        await asyncio.sleep(next_send - now)
+                self.stats[counter] += len(data)
+                writer.write(data)
+                await writer.drain()
+            # half-close: propagate EOF to the other side
+            if writer.can_write_eof():
+                writer.write_eof()
         except Exception:
-            pass
-        finally:
             try:
-                conn.close()
+                writer.close()
             except Exception:
                 pass
 
-if __name__ == '__main__':
-    s = Socks5Server('localhost', 1080)
+    @staticmethod
+    def _reset(writer):
+        try:
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            writer.transport.abort()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _reset_peer(reader):
+        transport = getattr(reader, '_transport', None)
+        if transport is None:
+            return
+        try:
+            sock = transport.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            transport.abort()
+        except Exception:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SOCKS5 stub / upstream simulator for local testing')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1080)
+    parser.add_argument('--latency', type=float, default=0.0, help='handshake latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of latency jitter')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/second per connection and direction')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of refusing a CONNECT')
+    parser.add_argument('--reset-rate', type=float, default=0.0, help='probability of resetting a relay')
+    parser.add_argument('--reset-after', type=int, default=65536, help='max bytes relayed before a reset')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+    s = Socks5Server(args.host, args.port, handshake_latency=args.latency, jitter=args.jitter,
+                     bandwidth=args.bandwidth, connect_fail_rate=args.fail_rate, reset_rate=args.reset_rate,
+                     reset_after=args.reset_after, seed=args.seed)
     try:
         s.start()
     except KeyboardInterrupt:
         s.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 import platform
-import winreg
 import ctypes
+
+# winreg only exists on Windows; elsewhere set/restore are no-ops
+try:
+    import winreg
+except ImportError:
+    winreg = None
 from pathlib import Path
 
 
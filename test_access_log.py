@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+
+from access_log import AccessLog, read_binary
+from proxy_server import ProxyServer, Flow
+from test_smoke import run_local_http_server
+
+
+def run_proxy(port, log_path, fmt):
+    server = ProxyServer(local_host='localhost', local_port=port, logger=None, bypass_list=['localhost'],
+                         access_log=log_path, access_log_format=fmt)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(2)
+    return server
+
+
+def exercise(port):
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': f'http://localhost:{port}'}))
+    with opener.open('http://localhost:8006/logged', timeout=5) as resp:
+        resp.read()
+    # CONNECT 隧道
+    s = socket.create_connection(('localhost', port))
+    s.sendall(b'CONNECT localhost:8006 HTTP/1.1\r\n\r\n')
+    s.recv(1024)
+    s.sendall(b'GET /tunnel HTTP/1.0\r\nHost: localhost\r\n\r\n')
+    while s.recv(4096):
+        pass
+    s.close()
+    # 本地端点
+    with urllib.request.urlopen(f'http://localhost:{port}/proxy.pac', timeout=5) as resp:
+        resp.read()
+
+
+if __name__ == '__main__':
+    run_local_http_server(port=8006)
+    time.sleep(0.2)
+    tmp = tempfile.mkdtemp(prefix='access-log-')
+
+    for fmt, port in (('jsonl', 8086), ('binary', 8087)):
+        path = os.path.join(tmp, f'access.{fmt}')
+        server = run_proxy(port, path, fmt)
+        try:
+            exercise(port)
+        except Exception as e:
+            print('Request error:', e)
+        time.sleep(0.3)
+        server.stop()
+        if fmt == 'jsonl':
+            with open(path, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+        else:
+            records = list(read_binary(path))
+        for rec in records:
+            print(fmt, rec['method'], rec['host'], rec['route'], rec['status'],
+                  rec['bytes_up'], rec['bytes_down'], rec['connect_ms'] is not None)
+
+    # 轮转与队列满时丢弃
+    path = os.path.join(tmp, 'rotate.jsonl')
+    log = AccessLog(path, max_bytes=4096, backups=2, queue_size=100000)
+    flow = Flow('127.0.0.1')
+    flow.host, flow.port, flow.method, flow.route, flow.status = 'example.com', 443, 'CONNECT', 'socks', 200
+    for _ in range(500):
+        log.log_flow(flow)
+    log.close()
+    print('rotated files:', sorted(os.listdir(tmp)))
+    print('stats:', log.stats())
+    tiny = AccessLog(os.path.join(tmp, 'tiny.jsonl'), queue_size=1, flush_interval=5)
+    for _ in range(1000):
+        tiny.log_flow(flow)
+    tiny.close()
+    print('dropped with queue_size=1:', tiny.stats()['dropped'] > 0)
+
+    shutil.rmtree(tmp, ignore_errors=True)
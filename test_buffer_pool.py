@@ -0,0 +1,94 @@
+import socket
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from buffer_pool import BufferPool, pooled_chunks
+from proxy_server import ProxyServer
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    pool = BufferPool(slab_size=1024, budget=2048)
+    held = [pool.acquire(), pool.acquire()]
+
+    # 预算用尽：带超时的借出在超时后抛出 socket.timeout
+    started = time.monotonic()
+    try:
+        pool.acquire(0.2)
+        print('timeout   : not raised')
+    except socket.timeout:
+        elapsed = time.monotonic() - started
+        print('timeout   :', 0.18 <= elapsed < 0.5 and pool.stats()['timeouts'] == 1, f'{elapsed:.2f}s')
+
+    # 等待期间归还的 slab 被等待者取得
+    threading.Timer(0.1, pool.release, args=(held.pop(),)).start()
+    try:
+        held.append(pool.acquire(2.0))
+        print('handoff   :', pool.stats()['in_use'] == 2)
+    except socket.timeout:
+        print('handoff   : timed out')
+
+    # pooled_chunks 以套接字超时为限等待 slab
+    a, b = socket.socketpair()
+    a.settimeout(0.2)
+    b.sendall(b'data')
+    started = time.monotonic()
+    try:
+        list(pooled_chunks(pool, a))
+        print('chunks    : not raised')
+    except socket.timeout:
+        print('chunks    :', time.monotonic() - started < 0.5, pool.stats()['timeouts'])
+    a.close()
+    b.close()
+    for buf in held:
+        pool.release(buf)
+
+    # 经代理：缓冲池被占满时请求在套接字超时后失败，而不是让处理线程永久阻塞；归还后恢复
+    httpd = ThreadingHTTPServer(('localhost', 8020), PageHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = ProxyServer(local_host='localhost', local_port=8099, logger=None, bypass_list=['localhost'],
+                         buffer_pool_mb=4 / 1024, buffer_slab_kb=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8099'}))
+    slabs = []
+    while True:
+        slab = server.buffer_pool.try_acquire()
+        if slab is None:
+            break
+        slabs.append(slab)
+    started = time.monotonic()
+    try:
+        opener.open('http://localhost:8020/', timeout=20).read()
+        print('exhausted : request succeeded')
+    except Exception as e:
+        elapsed = time.monotonic() - started
+        print('exhausted :', elapsed < 15 and server.buffer_pool.stats()['timeouts'] >= 1, f'{elapsed:.1f}s', e)
+    for slab in slabs:
+        server.buffer_pool.release(slab)
+    try:
+        with opener.open('http://localhost:8020/', timeout=10) as resp:
+            print('recovered :', resp.read() == b'ok')
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
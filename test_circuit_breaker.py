@@ -0,0 +1,123 @@
+import socket
+import threading
+import time
+
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from proxy_server import ProxyServer
+from socks5_stub import Socks5Server
+
+
+class Probe:
+    """可控的探测函数：返回 result，并可在 gate 上阻塞以观察 half_open 状态"""
+
+    def __init__(self):
+        self.result = False
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.gate.wait(5)
+        return self.result
+
+
+def wait_for(cond, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+def connect_status(proxy_port, target):
+    c = socket.create_connection(('localhost', proxy_port), timeout=15)
+    c.sendall(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n'.encode())
+    head = c.recv(1024).decode('latin-1')
+    c.close()
+    return head.split('\r\n')[0], 'Retry-After: 1' in head
+
+
+if __name__ == '__main__':
+    probe = Probe()
+    breaker = CircuitBreaker(probe, failure_threshold=3, probe_interval=0.2)
+
+    # 成功会清零连续失败计数
+    for outcome in (False, False, True, False, False):
+        breaker.record_success() if outcome else breaker.record_failure()
+    print('reset cnt :', breaker.state == CLOSED and breaker.allow(), breaker.stats()['consecutive_failures'])
+
+    # 连续失败达到阈值后打开并快速失败
+    breaker.record_failure()
+    print('open      :', breaker.state == OPEN and not breaker.allow(), breaker.stats()['rejected'])
+
+    # 探测期间为 half_open，仍拒绝请求；探测失败回到 open
+    probe.gate.clear()
+    half_open = wait_for(lambda: breaker.state == HALF_OPEN)
+    print('half open :', half_open and not breaker.allow())
+    probe.gate.set()
+    print('probe fail:', wait_for(lambda: breaker.stats()['probe_failures'] == 1) and breaker.state in (OPEN, HALF_OPEN))
+
+    # 探测成功后闭合，探测线程退出
+    probe.result = True
+    closed = wait_for(lambda: breaker.state == CLOSED)
+    calls = probe.calls
+    time.sleep(0.5)
+    print('close     :', closed and breaker.allow() and probe.calls == calls, breaker.stats())
+
+    # reset() 直接闭合
+    for _ in range(3):
+        breaker.record_failure()
+    breaker.reset()
+    print('reset     :', breaker.state == CLOSED and breaker.stats()['closes'] == 2)
+
+    # 经代理：上游 SOCKS 不可达时先 502，断路器打开后 503 + Retry-After；上游恢复后探测闭合
+    server = ProxyServer(local_host='localhost', local_port=8097, socks_host='127.0.0.1', socks_port=1087,
+                         logger=None, proxy_list=['127.0.0.1'], socks_breaker_threshold=2,
+                         socks_breaker_probe_interval=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    try:
+        statuses = [connect_status(8097, '127.0.0.1:8018') for _ in range(3)]
+        print('proxy open:', [s[0].split(' ')[1] for s in statuses] == ['502', '502', '503'] and statuses[2][1],
+              [s[0] for s in statuses])
+        stub = Socks5Server('127.0.0.1', 1087)
+        threading.Thread(target=stub.start, daemon=True).start()
+        stub.ready.wait(5)
+        recovered = wait_for(lambda: server.get_stats()['socks_breaker']['state'] == CLOSED, timeout=5)
+        print('recovered :', recovered, server.get_stats()['socks_breaker'])
+
+        # 上游可用但目标拒绝连接（SOCKS5 错误应答）不计入失败，断路器保持闭合
+        statuses = [connect_status(8097, '127.0.0.1:8018')[0] for _ in range(3)]
+        breaker_stats = server.get_stats()['socks_breaker']
+        print('reply err :', all(' 502 ' in s for s in statuses) and breaker_stats['state'] == CLOSED
+              and breaker_stats['consecutive_failures'] == 0, breaker_stats)
+
+        # 先学到很短的建连超时，再让上游推迟 CONNECT 应答：超时取决于目标而不是上游，断路器保持闭合
+        origin = socket.socket()
+        origin.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        origin.bind(('127.0.0.1', 8023))
+        origin.listen(16)
+
+        def accept_and_close():
+            while True:
+                try:
+                    origin.accept()[0].close()
+                except OSError:
+                    return
+
+        threading.Thread(target=accept_and_close, daemon=True).start()
+        for _ in range(3):
+            connect_status(8097, '127.0.0.1:8023')
+        learned = server.connect_timer.timeout(server.connect_timer.key('127.0.0.1', 8023, 'socks'), 10.0)
+        stub.handshake_latency = learned + 0.5
+        statuses = [connect_status(8097, '127.0.0.1:8023')[0] for _ in range(3)]
+        breaker_stats = server.get_stats()['socks_breaker']
+        print('slow dest :', all(' 502 ' in s for s in statuses) and breaker_stats['state'] == CLOSED
+              and server.get_stats()['connect_timeouts']['timeouts'] >= 3,
+              f'learned {learned:.2f}s', breaker_stats)
+        origin.close()
+        stub.stop()
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    time.sleep(0.2)
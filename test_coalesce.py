@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from coalesce import Coalescer
+from proxy_server import ProxyServer
+
+HITS = {}
+BODY = bytes(range(256)) * 2048  # 512 KB
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        HITS[self.path] = HITS.get(self.path, 0) + 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(BODY)))
+        if self.path.startswith('/cookie'):
+            self.send_header('Set-Cookie', 'session=secret')
+        if self.path.startswith('/vary'):
+            self.send_header('Vary', 'User-Agent')
+        self.end_headers()
+        # 分块慢速发送，让后到的请求在传输中途加入
+        for i in range(0, len(BODY), 32768):
+            self.wfile.write(BODY[i:i + 32768])
+            time.sleep(0.03)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def fetch_all(opener, url, count, delay=0.0, headers=None):
+    results = []
+
+    def one(i):
+        h = dict(headers(i)) if headers else {}
+        with opener.open(urllib.request.Request(url, headers=h), timeout=20) as resp:
+            results.append(hashlib.sha256(resp.read()).hexdigest())
+
+    threads = []
+    for i in range(count):
+        t = threading.Thread(target=one, args=(i,))
+        t.start()
+        threads.append(t)
+        if delay and i == count // 2 - 1:
+            time.sleep(delay)
+    for t in threads:
+        t.join()
+    expected = hashlib.sha256(BODY).hexdigest()
+    return len(results), all(r == expected for r in results)
+
+
+def stalled_follower():
+    """一个不读数据的跟随者落后超过缓冲上限后被立即丢弃，领取者的转发不被拖慢"""
+    co = Coalescer(max_buffer=64 * 1024)
+    leader_headers, follower_headers = {}, {}
+    fetch, _ = co.join('k', leader_headers)
+    co.join('k', follower_headers)
+    release = threading.Event()
+    done = threading.Event()
+
+    def follow():
+        co.stream(fetch, follower_headers, lambda data: release.wait(20))
+        done.set()
+
+    threading.Thread(target=follow, daemon=True).start()
+    head = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(BODY)
+    start = time.monotonic()
+    co.feed(fetch, head)
+    for i in range(0, len(BODY), 16384):
+        co.feed(fetch, BODY[i:i + 16384])
+    co.finish(fetch)
+    elapsed = time.monotonic() - start
+    release.set()
+    done.wait(5)
+    return elapsed < 1.0 and done.is_set() and co.stats()['dropped_followers'] == 1, f'{elapsed:.3f}s'
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(('localhost', 8007), SlowHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    server = ProxyServer(local_host='localhost', local_port=8088, logger=None, coalesce_requests=True)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8088'}))
+    try:
+        print('stalled:', *stalled_follower())
+        print('burst  :', fetch_all(opener, 'http://localhost:8007/manifest', 12), 'origin hits', HITS['/manifest'])
+        # 一半请求在响应传输中途才到达
+        print('late   :', fetch_all(opener, 'http://localhost:8007/late', 8, delay=0.3), 'origin hits', HITS['/late'])
+        # 带 Set-Cookie 的响应不能共享
+        print('cookie :', fetch_all(opener, 'http://localhost:8007/cookie', 4), 'origin hits', HITS['/cookie'])
+        # Vary: User-Agent，两种 UA 只有相同的才共享
+        print('vary   :', fetch_all(opener, 'http://localhost:8007/vary', 6,
+                                    headers=lambda i: {'User-Agent': f'ua{i % 2}'}), 'origin hits', HITS['/vary'])
+    except Exception as e:
+        print('Request error:', e)
+
+    time.sleep(0.3)
+    print('stats  :', server.get_stats()['coalescing'])
+
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
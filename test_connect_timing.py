@@ -0,0 +1,74 @@
+import socket
+import threading
+import time
+
+from connect_timing import ConnectTimer, ALPHA, BETA
+from proxy_server import ProxyServer
+
+
+def close(a, b):
+    return abs(a - b) < 1e-9
+
+
+if __name__ == '__main__':
+    timer = ConnectTimer(min_timeout=0.1, max_timeout=10.0, k=4.0, max_entries=2)
+    key = timer.key('Example.COM', 443, 'direct')
+
+    # 没有历史：使用调用方的默认值，同样受上下限约束
+    print('default   :', timer.timeout(key, 5.0) == 5.0 and timer.timeout(key, 0.01) == 0.1
+          and timer.timeout(key, 60) == 10.0)
+
+    # 第一个样本：srtt = R，rttvar = R/2，超时 = R + k*R/2 = 3R
+    timer.record(key, 0.2)
+    print('first     :', timer.snapshot(key) == (0.2, 0.1, 1) and close(timer.timeout(key, 5.0), 0.6),
+          timer.snapshot(key))
+
+    # 之后按 RFC 6298：先用旧 srtt 更新 rttvar，再更新 srtt
+    timer.record(key, 0.4)
+    rttvar = (1 - BETA) * 0.1 + BETA * abs(0.2 - 0.4)
+    srtt = (1 - ALPHA) * 0.2 + ALPHA * 0.4
+    srtt2, rttvar2, n = timer.snapshot(key)
+    print('update    :', close(srtt2, srtt) and close(rttvar2, rttvar) and n == 2,
+          f'srtt {srtt2:.4f} rttvar {rttvar2:.4f}')
+
+    # 超时：偏差加倍（加 min_timeout/k），下次给更长时间
+    before = timer.timeout(key, 5.0)
+    timer.record_timeout(key)
+    print('backoff   :', close(timer.snapshot(key)[1], rttvar * 2 + 0.1 / 4.0) and timer.timeout(key, 5.0) > before)
+
+    # 上下限：很快的本地连接不低于 min_timeout，很慢的不超过 max_timeout
+    fast, slow = timer.key('lan', 80, 'direct'), timer.key('far', 80, 'direct')
+    timer.record(fast, 0.001)
+    timer.record(slow, 30.0)
+    print('clamp     :', timer.timeout(fast, 5.0) == 0.1 and timer.timeout(slow, 5.0) == 10.0)
+
+    # 经 SOCKS 上游的连接不低于 SOCKS_MIN_TIMEOUT
+    socks_key = timer.key('lan', 80, 'socks')
+    timer.record(socks_key, 0.001)
+    print('socks min :', timer.timeout(socks_key, 5.0) == 1.0 and timer.timeout(timer.key('x', 1, 'socks'), 0.2) == 1.0)
+
+    # 条目数超过 max_entries 时淘汰最久未更新的目标
+    print('evict     :', timer.snapshot(key) is None and timer.snapshot(fast) is None
+          and timer.snapshot(socks_key) is not None, timer.stats()['destinations'])
+
+    # 经代理：直连成功后记录该目标的建连耗时
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('127.0.0.1', 8019))
+    lsock.listen(8)
+    server = ProxyServer(local_host='localhost', local_port=8098, logger=None, bypass_list=['127.0.0.1'])
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    try:
+        c = socket.create_connection(('localhost', 8098), timeout=5)
+        c.sendall(b'CONNECT 127.0.0.1:8019 HTTP/1.1\r\nHost: 127.0.0.1:8019\r\n\r\n')
+        c.recv(1024)
+        c.close()
+        learned = server.connect_timer.snapshot(server.connect_timer.key('127.0.0.1', 8019, 'direct'))
+        print('proxy     :', learned is not None and learned[2] == 1
+              and server.connect_timer.timeout(('127.0.0.1', 8019, 'direct'), 5.0) < 1.0, learned)
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    lsock.close()
+    time.sleep(0.2)
@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from proxy_server import ProxyServer
+
+HITS = {'origin': 0, 'not_modified': 0}
+
+
+class CacheableHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        HITS['origin'] += 1
+        etag = '"v1"'
+        if self.path.startswith('/revalidate') and self.headers.get('If-None-Match') == etag:
+            HITS['not_modified'] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'max-age=0')
+            self.end_headers()
+            return
+        body = b'cached body for ' + self.path.encode('utf-8') + b'x' * 2048
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if self.path.startswith('/revalidate'):
+            self.send_header('Cache-Control', 'max-age=0')
+        else:
+            self.send_header('Cache-Control', 'max-age=60')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def fetch(opener, url, headers=None):
+    req = urllib.request.Request(url, headers=headers or {})
+    with opener.open(req, timeout=10) as resp:
+        return resp.status, resp.headers.get('X-Cache'), resp.read()
+
+
+if __name__ == '__main__':
+    httpd = HTTPServer(('localhost', 8003), CacheableHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    cache_dir = tempfile.mkdtemp(prefix='proxy-cache-')
+    # 内存层只够放一个对象，第二个对象会被降级到磁盘层
+    server = ProxyServer(local_host='localhost', local_port=8083, logger=None,
+                         cache_enabled=True, cache_memory_mb=0.003, cache_dir=cache_dir, cache_disk_mb=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    time.sleep(0.5)
+
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8083'}))
+    try:
+        print('first :', fetch(opener, 'http://localhost:8003/static')[:2], 'origin hits', HITS['origin'])
+        print('second:', fetch(opener, 'http://localhost:8003/static')[:2], 'origin hits', HITS['origin'])
+        # 不同的 Accept-Encoding 是另一个变体（Vary）
+        print('vary  :', fetch(opener, 'http://localhost:8003/static', {'Accept-Encoding': 'br'})[:2],
+              'origin hits', HITS['origin'])
+        print('disk  :', fetch(opener, 'http://localhost:8003/static')[:2], 'origin hits', HITS['origin'])
+        # max-age=0 + ETag：每次都再验证，源站回 304 由缓存应答
+        fetch(opener, 'http://localhost:8003/revalidate')
+        print('reval :', fetch(opener, 'http://localhost:8003/revalidate')[:2], '304s', HITS['not_modified'])
+    except Exception as e:
+        print('Request error:', e)
+
+    print('stats :', server.get_stats()['http_cache'])
+
+    server.stop()
+    httpd.shutdown()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    time.sleep(0.2)
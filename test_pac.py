@@ -0,0 +1,74 @@
+import json
+import shutil
+import subprocess
+import threading
+import time
+import urllib.request
+
+from proxy_server import ProxyServer
+
+# dnsResolve/isInNet stand-ins so the generated PAC can be evaluated with node
+PAC_RUNTIME = """
+var HOSTS = %s;
+function dnsResolve(host) { return hasOwn.call(HOSTS, host) ? HOSTS[host] : null; }
+function ipToInt(ip) { return ip.split(".").reduce(function (a, b) { return a * 256 + (+b); }, 0); }
+function isInNet(ip, net, mask) {
+    var m = ipToInt(mask);
+    return (ipToInt(ip) & m) >>> 0 === (ipToInt(net) & m) >>> 0;
+}
+console.log(JSON.stringify(%s.map(function (h) { return FindProxyForURL("http://" + h + "/", h); })));
+"""
+
+
+def eval_pac(pac, hosts, resolved):
+    """用 node 执行 PAC，返回每个 host 的 FindProxyForURL 结果"""
+    script = pac + PAC_RUNTIME % (json.dumps(resolved), json.dumps(hosts))
+    out = subprocess.run(['node', '-e', script], capture_output=True, text=True, timeout=10)
+    return json.loads(out.stdout)
+
+
+if __name__ == '__main__':
+    server = ProxyServer(local_host='localhost', local_port=8082, socks_host='localhost', socks_port=1080,
+                         logger=print, bypass_list=['baidu.com', '10.0.0.0/8', '::1', 'lan'],
+                         proxy_list=['google.com'])
+    t = threading.Thread(target=server.start, daemon=True)
+    t.start()
+
+    time.sleep(0.5)
+
+    # PAC 直接从监听端口获取（不经过代理）
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open('http://localhost:8082/proxy.pac', timeout=5) as resp:
+            pac = resp.read().decode('utf-8')
+            print('PAC status:', resp.status, resp.headers.get('Content-Type'))
+            assert 'FindProxyForURL' in pac
+            assert '"baidu.com":1' in pac
+            assert 'PROXY localhost:8082' in pac
+    except Exception as e:
+        print('PAC request error:', e)
+
+    # 规则变化后 PAC 重新生成
+    server.set_rules(['baidu.com', 'qq.com'], [])
+    pac = server.get_pac()
+    print('PAC regenerated:', '"qq.com":1' in pac)
+
+    print('rule match www.baidu.com:', server._host_in_list('www.baidu.com', server._bypass_rules))
+    print('rule match notbaidu.com:', server._host_in_list('notbaidu.com', server._bypass_rules))
+
+    # rule_resolve_ips：PAC 与服务端一样用解析出的地址匹配 CIDR 规则
+    if shutil.which('node'):
+        server.set_rules(['10.0.0.0/8'], [])
+        hosts = ['intranet.example', 'public.example', '10.1.1.1']
+        resolved = {'intranet.example': '10.1.2.3', 'public.example': '93.184.216.34'}
+        print('PAC resolve:', eval_pac(server.get_pac(), hosts, resolved) == ['DIRECT', 'PROXY localhost:8082', 'DIRECT'])
+        server.reload(rule_resolve_ips=False)
+        print('PAC no resolve:', eval_pac(server.get_pac(), hosts, resolved) == ['PROXY localhost:8082'] * 2 + ['DIRECT'])
+    else:
+        print('PAC resolve: skipped (node not found)')
+
+    try:
+        server.stop()
+    except Exception as e:
+        print('Error stopping server:', e)
+    time.sleep(0.2)
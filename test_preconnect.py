@@ -0,0 +1,103 @@
+import socket
+import threading
+import time
+
+from preconnect import Preconnector
+from proxy_server import ProxyServer
+
+
+class Origin:
+    """接受连接并保持打开，统计 accept 次数；drop() 关闭已接受的连接"""
+
+    def __init__(self, port):
+        self.accepted = 0
+        self.conns = []
+        self.lsock = socket.socket()
+        self.lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.lsock.bind(('127.0.0.1', port))
+        self.lsock.listen(64)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.lsock.accept()
+            self.accepted += 1
+            self.conns.append(conn)
+
+    def drop(self):
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+
+
+def wait_for(cond, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return cond()
+
+
+def dial(host, port, route):
+    return socket.create_connection((host, port), timeout=3)
+
+
+if __name__ == '__main__':
+    origin = Origin(8017)
+
+    # 访问一次不足 MIN_SCORE，连续三次后成为热门目标；得分按半衰期衰减
+    pc = Preconnector(dial, top_n=5, spares=2, spare_idle=5.0, half_life=10.0)
+    pc.record('127.0.0.1', 8017, 'direct')
+    once = pc.top()
+    pc.record('127.0.0.1', 8017, 'direct')
+    pc.record('127.0.0.1', 8017, 'direct')
+    now = time.monotonic()
+    print('top       :', once == [] and pc.top(now) == [(('127.0.0.1', 8017), 'direct')] and pc.top(now + 10.0) == [],
+          pc.top(now))
+
+    # 补足备用连接后取用命中；直连备用连接在不允许直连时不被取出
+    pc._running = True
+    pc.refill()
+    print('refill    :', pc.stats()['spares'] == 2 and wait_for(lambda: origin.accepted == 2), pc.stats())
+    print('no direct :', pc.claim('127.0.0.1', 8017, allow_direct=False) is None)
+    spare = pc.claim('127.0.0.1', 8017)
+    print('claim     :', spare is not None and spare[1] == 'direct', pc.stats()['hits'])
+    spare[0].close()
+
+    # 对端关闭的备用连接被丢弃并计入 stale
+    origin.drop()
+    time.sleep(0.1)
+    print('stale     :', pc.claim('127.0.0.1', 8017) is None and pc.stats()['stale'] == 1, pc.stats())
+
+    # 超过 spare_idle 的备用连接在下次补充时关闭并重新建立
+    pc.spare_idle = 0.2
+    pc.refill()
+    wait_for(lambda: origin.accepted == 4)
+    time.sleep(0.3)
+    pc.refill()
+    print('expired   :', pc.stats()['expired'] == 2 and wait_for(lambda: origin.accepted == 6), pc.stats())
+    pc.stop()
+    print('cleared   :', pc.stats()['spares'] == 0)
+
+    # 经代理：三次 CONNECT 后后台为该目标保持备用连接，下一条隧道直接取用
+    server = ProxyServer(local_host='localhost', local_port=8096, logger=None, bypass_list=['127.0.0.1'],
+                         preconnect_top_n=5, preconnect_spares=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+
+    def tunnel():
+        c = socket.create_connection(('localhost', 8096), timeout=5)
+        c.sendall(b'CONNECT 127.0.0.1:8017 HTTP/1.1\r\nHost: 127.0.0.1:8017\r\n\r\n')
+        c.recv(1024)
+        c.close()
+
+    try:
+        for i in range(3):
+            tunnel()
+        wait_for(lambda: server.get_stats()['preconnect']['spares'] >= 1)
+        tunnel()
+        stats = server.get_stats()['preconnect']
+        print('proxy     :', stats['hits'] == 1, stats)
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    time.sleep(0.2)
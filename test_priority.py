@@ -0,0 +1,104 @@
+import socket
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from proxy_server import ProxyServer
+from shaping import TokenBucket
+from socks5_stub import Socks5Server
+
+# 所有连接共用一个令牌桶，模拟一条共享的上游链路
+LINK = TokenBucket(8 * 1024 * 1024)
+CHUNK = b'x' * 16384
+
+
+class LinkHandler(BaseHTTPRequestHandler):
+    def handle(self):
+        # 停止 bulk 下载时客户端中途断开，复位是预期的
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def setup(self):
+        # 小发送缓冲，让下游的背压尽快回到共享链路上（真实链路的缓冲与带宽时延积相当）
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+        super().setup()
+
+    def do_GET(self):
+        size = int(self.path.rsplit('/', 1)[-1])
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        sent = 0
+        while sent < size:
+            n = min(len(CHUNK), size - sent)
+            wait = LINK.reserve(n)
+            if wait:
+                time.sleep(wait)
+            self.wfile.write(CHUNK[:n])
+            sent += n
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run(scheduling, port):
+    server = ProxyServer(local_host='localhost', local_port=port, socks_port=1091, logger=None,
+                         proxy_list=['localhost'], priority_scheduling=scheduling,
+                         socket_options={'socks': {'rcvbuf': 131072}})
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': f'http://localhost:{port}'}))
+    stop = threading.Event()
+
+    def bulk():
+        while not stop.is_set():
+            with opener.open('http://localhost:8009/bulk/67108864', timeout=60) as resp:
+                while not stop.is_set() and resp.read(65536):
+                    pass
+
+    for _ in range(4):
+        threading.Thread(target=bulk, daemon=True).start()
+    # 下载流先被归为 bulk；之后一直有页面加载时 bulk 才被限速，还要等沿途（本机回环上很大的）套接字缓冲
+    # 填满，背压才回到共享链路，所以调度时先预热，只统计最后 40 次
+    latencies = []
+    deadline = time.monotonic() + (15 if scheduling else 3)
+    while time.monotonic() < deadline or len(latencies) < 40:
+        started = time.monotonic()
+        with opener.open(f'http://localhost:8009/page{len(latencies)}/65536', timeout=30) as resp:
+            resp.read()
+        latencies.append(time.monotonic() - started)
+    stop.set()
+    stats = server.get_stats().get('priority')
+    server.stop()
+    latencies = sorted(latencies[-40:])
+    return latencies[len(latencies) // 2], latencies[-1], stats
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(('localhost', 8009), LinkHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    socks = Socks5Server('localhost', 1091)
+    threading.Thread(target=socks.start, daemon=True).start()
+    time.sleep(0.3)
+
+    try:
+        p50, worst, _ = run(False, 8089)
+        print(f'fifo     : 64 KB page p50 {p50 * 1000:.0f} ms, max {worst * 1000:.0f} ms')
+        p50, worst, stats = run(True, 8090)
+        print(f'priority : 64 KB page p50 {p50 * 1000:.0f} ms, max {worst * 1000:.0f} ms')
+        # 4 条下载流在统计时仍在进行，且都已转为 bulk
+        print('bulk     :', stats['bulk']['flows'] >= 4 and stats['bulk']['demoted'] >= 4, stats['bulk'])
+        print('stats    :', stats)
+    except Exception as e:
+        print('Request error:', e)
+
+    httpd.shutdown()
+    time.sleep(0.2)
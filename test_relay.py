@@ -0,0 +1,63 @@
+import hashlib
+import socket
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from proxy_server import ProxyServer
+
+BODY = bytes(range(256)) * (16 * 1024)  # 4 MB
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def slow_get(proxy_port, url):
+    """经代理发 GET，并以小块、带停顿的方式读取响应，模拟慢客户端"""
+    c = socket.create_connection(('localhost', proxy_port), timeout=10)
+    c.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    c.sendall(f'GET {url} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    data = b''
+    while True:
+        chunk = c.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        time.sleep(0.001)
+    c.close()
+    return data
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(('localhost', 8021), FileHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = ProxyServer(local_host='localhost', local_port=8100, logger=None, bypass_list=['localhost'],
+                         relay_high_water_kb=128, relay_low_water_kb=32)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    try:
+        # HTTP 响应同样经流控转发：慢客户端收到完整数据，排队量受高水位约束
+        data = slow_get(8100, 'http://localhost:8021/file')
+        body = data[data.find(b'\r\n\r\n') + 4:]
+        stats = server.get_stats()['relay']
+        print('intact    :', hashlib.sha256(body).digest() == hashlib.sha256(BODY).digest(), f'{len(body)} bytes')
+        print('bounded   :', stats['relays'] == 1 and stats['peak_queued'] <= 128 * 1024 + server.buffer_pool.slab_size,
+              stats)
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
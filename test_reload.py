@@ -0,0 +1,142 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from proxy_server import ProxyServer, options_from_config
+from socks5_stub import Socks5Server
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def echo_server(port):
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('localhost', port))
+    lsock.listen(8)
+
+    def serve(conn):
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            conn.sendall(data)
+        conn.close()
+
+    def accept():
+        while True:
+            conn, _ = lsock.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+
+def open_tunnel(proxy_port, target):
+    s = socket.create_connection(('localhost', proxy_port), timeout=5)
+    s.sendall(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n'.encode())
+    reply = b''
+    while b'\r\n\r\n' not in reply:
+        reply += s.recv(1024)
+    return s
+
+
+def echo(s, payload):
+    s.sendall(payload)
+    data = b''
+    while len(data) < len(payload):
+        data += s.recv(4096)
+    return data == payload
+
+
+def which_upstream(opener, url, stubs):
+    before = [stub.stats['connections'] for stub in stubs]
+    with opener.open(url, timeout=5) as resp:
+        resp.read()
+    after = [stub.stats['connections'] for stub in stubs]
+    used = [i for i, (a, b) in enumerate(zip(before, after)) if b > a]
+    return f"socks{used[0] + 1}" if used else 'direct'
+
+
+def post_reload(proxy_port):
+    req = urllib.request.Request(f'http://localhost:{proxy_port}/reload', method='POST')
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(('localhost', 8013), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    echo_server(8014)
+    stub1, stub2 = Socks5Server('localhost', 1094), Socks5Server('localhost', 1095)
+    for stub in (stub1, stub2):
+        threading.Thread(target=stub.start, daemon=True).start()
+    time.sleep(0.3)
+
+    server = ProxyServer(local_host='localhost', local_port=8093, socks_port=1094, logger=None,
+                         proxy_list=['localhost'])
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8093'}))
+    url = 'http://localhost:8013/'
+
+    try:
+        print('before   :', which_upstream(opener, url, (stub1, stub2)))
+        tunnel = open_tunnel(8093, 'localhost:8014')
+        print('tunnel   :', echo(tunnel, b'before reload'))
+        server._remember_reach(('warm.example', 80), True, time.time() + 300)
+
+        # 换上游、改 TTL，并修改一项需要重启的设置；未给出的选项保持当前值
+        report = server.reload(socks_port=1095, fail_ttl=5, tunnel_idle_timeout=60)
+        print('report   :', {k: report[k] for k in ('applied', 'restart_required')},
+              'swap < 5 ms', report['swap_ms'] < 5)
+        print('after    :', which_upstream(opener, url, (stub1, stub2)))
+        print('in flight:', echo(tunnel, b'after reload'), 'reach cache kept', ('warm.example', 80) in server._reach_cache)
+        tunnel.close()
+
+        # 只给出一项：其余设置（强制代理列表、上游）不变
+        report = server.reload(success_ttl=120)
+        print('partial  :', report['applied'] == ['success_ttl'] and not report['restart_required'],
+              which_upstream(opener, url, (stub1, stub2)))
+
+        # 规则文件不存在：编译失败，当前配置保持不变
+        try:
+            server.reload(rule_files=[{'path': '/nonexistent/rules.txt'}])
+            print('bad rules: reloaded?!')
+        except OSError:
+            print('bad rules: rejected, still', which_upstream(opener, url, (stub1, stub2)))
+
+        # POST /reload 重新读取配置文件：去掉强制代理后直连
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'proxy_host': 'localhost', 'proxy_port': 8093, 'upstream_port': 1095,
+                       'bypass_list': ['localhost']}, f)
+        server.config_source = lambda: options_from_config(json.load(open(path)), base_dir=os.path.dirname(path))
+        result = post_reload(8093)
+        print('endpoint :', result['applied'], 'then', which_upstream(opener, url, (stub1, stub2)))
+        os.unlink(path)
+    except Exception as e:
+        print('Request error:', e)
+
+    print('stats    :', {k: v for k, v in server.get_stats()['reload'].items() if k != 'last'})
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
@@ -0,0 +1,109 @@
+import ipaddress
+import socket
+import struct
+import threading
+import time
+
+from proxy_server import ProxyServer
+
+
+class RecordingSocks5:
+    """最小 SOCKS5 上游：记录每个 CONNECT 的地址类型与地址，应答成功后保持连接直到客户端关闭"""
+
+    def __init__(self, port):
+        self.requests = []
+        self.lsock = socket.socket()
+        self.lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.lsock.bind(('127.0.0.1', port))
+        self.lsock.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.lsock.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _read(conn, n):
+        data = b''
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('closed')
+            data += chunk
+        return data
+
+    def _serve(self, conn):
+        try:
+            nmethods = self._read(conn, 2)[1]
+            self._read(conn, nmethods)
+            conn.sendall(b'\x05\x00')
+            ver, cmd, rsv, atyp = self._read(conn, 4)
+            if atyp == 0x01:
+                addr = socket.inet_ntoa(self._read(conn, 4))
+            elif atyp == 0x03:
+                addr = self._read(conn, self._read(conn, 1)[0]).decode()
+            else:
+                addr = socket.inet_ntop(socket.AF_INET6, self._read(conn, 16))
+            self._read(conn, 2)
+            self.requests.append((atyp, addr))
+            conn.sendall(b'\x05\x00\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', 0))
+            conn.recv(1024)
+        except (OSError, ConnectionError):
+            pass
+        conn.close()
+
+
+def tunnel(proxy_port, target):
+    c = socket.create_connection(('localhost', proxy_port), timeout=10)
+    c.sendall(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n'.encode())
+    status = c.recv(1024).split(b'\r\n')[0]
+    c.close()
+    return status
+
+
+if __name__ == '__main__':
+    upstream = RecordingSocks5(1088)
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('127.0.0.1', 8022))
+    lsock.listen(8)
+
+    # 本机主机名通常由 hosts 文件解析，充当内网域名；.invalid 永远解析失败
+    intranet = socket.gethostname()
+    server = ProxyServer(local_host='localhost', local_port=8101, socks_host='127.0.0.1', socks_port=1088,
+                         logger=None, proxy_list=['localhost', intranet, 'intranet.invalid'],
+                         local_dns_list=[intranet, 'intranet.invalid'])
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    try:
+        # 强制代理的域名原样交给上游解析（ATYP 0x03），本地不做查询
+        print('remote    :', tunnel(8101, 'localhost:443').endswith(b'200 Connection Established')
+              and upstream.requests[-1] == (0x03, 'localhost'), upstream.requests[-1])
+        dns = server.dns_stats()
+        print('avoided   :', dns['avoided'] == 1 and dns['lookups'] == 0 and dns['socks_by_name'] == 1, dns)
+
+        # local_dns_list 中的主机在本地解析后以 IP 交给上游（ATYP 0x01/0x04）
+        tunnel(8101, f'{intranet}:443')
+        atyp, addr = upstream.requests[-1]
+        print('local     :', atyp in (0x01, 0x04) and ipaddress.ip_address(addr) is not None
+              and server.dns_stats()['socks_by_ip'] == 1, upstream.requests[-1])
+
+        # 本地解析失败时仍把域名交给上游
+        tunnel(8101, 'intranet.invalid:443')
+        print('fallback  :', upstream.requests[-1] == (0x03, 'intranet.invalid') and server.dns_stats()['failures'] == 1,
+              upstream.requests[-1])
+
+        # 直连：规则匹配与连接共用一次解析结果，之后命中缓存
+        server.set_rules(['localhost', '127.0.0.0/8'], [])
+        before = server.dns_stats()
+        statuses = [tunnel(8101, 'localhost:8022') for _ in range(3)]
+        dns = server.dns_stats()
+        print('cached    :', all(s.endswith(b'200 Connection Established') for s in statuses)
+              and dns['lookups'] - before['lookups'] <= 1 and dns['cache_hits'] > before['cache_hits'],
+              f"lookups +{dns['lookups'] - before['lookups']} cache hits +{dns['cache_hits'] - before['cache_hits']}")
+    except Exception as e:
+        print('Request error:', e)
+    server.stop()
+    lsock.close()
+    time.sleep(0.2)
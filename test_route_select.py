@@ -0,0 +1,111 @@
+import socket
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from proxy_server import ProxyServer
+from socks5_stub import Socks5Server
+
+BODY = b'x' * (512 * 1024)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def congested_link(listen_port, target_port, latency=0.08, rate=1024 * 1024):
+    """模拟拥塞的直连路径：建立连接多 latency 秒，下行限速 rate 字节/秒"""
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('localhost', listen_port))
+    lsock.listen(16)
+
+    def pipe(src, dst, paced):
+        try:
+            while True:
+                data = src.recv(16384)
+                if not data:
+                    break
+                dst.sendall(data)
+                if paced:
+                    time.sleep(len(data) / rate)
+        except Exception:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except Exception:
+                    pass
+
+    def serve():
+        while True:
+            conn, _ = lsock.accept()
+            time.sleep(latency)
+            upstream = socket.create_connection(('localhost', target_port))
+            threading.Thread(target=pipe, args=(conn, upstream, False), daemon=True).start()
+            threading.Thread(target=pipe, args=(upstream, conn, True), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def fetch_series(server, opener, url, count):
+    routes = []
+    for _ in range(count):
+        before = server.get_stats()['route_selection']
+        started = time.monotonic()
+        with opener.open(url, timeout=20) as resp:
+            ok = resp.read() == BODY
+        after = server.get_stats()['route_selection']
+        route = 'socks' if after['socks'] > before['socks'] else 'direct'
+        routes.append(f"{route}{'' if ok else '!'} {(time.monotonic() - started) * 1000:.0f}ms")
+    return routes
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(('localhost', 8011), FileHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    congested_link(8012, 8011)
+    socks = Socks5Server('localhost', 1092, handshake_latency=0.01)
+    threading.Thread(target=socks.start, daemon=True).start()
+    time.sleep(0.3)
+
+    server = ProxyServer(local_host='localhost', local_port=8091, socks_port=1092, logger=None,
+                         bypass_list=['127.0.0.1'], route_selection=True, route_probe_interval=1)
+    # 直连经过拥塞链路，SOCKS 路径不受影响
+    dial_direct = server._dial_direct
+    server._dial_direct = lambda host, port, timeout: dial_direct(host, 8012 if port == 8011 else port, timeout)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8091'}))
+    try:
+        print('domain  :', fetch_series(server, opener, 'http://localhost:8011/file', 6))
+        print('explain :', server.get_stats()['route_selection']['domains'].get('localhost'))
+        # 探测间隔过后直连会被再试一次
+        time.sleep(1.1)
+        print('reprobe :', fetch_series(server, opener, 'http://localhost:8011/file', 2))
+        # 绕过规则优先于测量结果
+        print('bypass  :', fetch_series(server, opener, 'http://127.0.0.1:8011/file', 2))
+    except Exception as e:
+        print('Request error:', e)
+
+    stats = server.get_stats()['route_selection']
+    stats.pop('domains')
+    print('stats   :', stats)
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
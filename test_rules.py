@@ -0,0 +1,58 @@
+import ipaddress
+import os
+import random
+import tempfile
+import time
+
+from rules import RuleSet, CompiledRuleSet, write_snapshot
+
+
+def random_rules(rng, count):
+    entries = []
+    for _ in range(count):
+        prefix = rng.choice([16, 20, 24, 32])
+        entries.append(str(ipaddress.ip_network((rng.getrandbits(32), prefix), strict=False)))
+    entries += ['2001:db8::/32', '2400:cb00::/32', '::1', '10.0.0.1', 'example.com']
+    return entries
+
+
+def probes(rng, rules, count):
+    """随机地址加上每个网段两端及其外侧的边界地址"""
+    addrs = [ipaddress.ip_address(rng.getrandbits(32)) for _ in range(count)]
+    for net in rules.networks:
+        for n in (int(net.network_address) - 1, int(net.network_address), int(net.broadcast_address),
+                  int(net.broadcast_address) + 1):
+            if 0 <= n < 2 ** net.max_prefixlen:
+                addrs.append(ipaddress.ip_address(n) if net.version == 4 else ipaddress.IPv6Address(n))
+    return addrs
+
+
+if __name__ == '__main__':
+    rng = random.Random(7)
+    entries = random_rules(rng, 8000)
+    rules = RuleSet(entries)
+    addrs = probes(rng, rules, 20000)
+
+    # 与逐个网段比较的结果一致
+    linear = [addr in rules.ips or any(addr.version == n.version and addr in n for n in rules.networks)
+              for addr in addrs[:3000]]
+    print('linear    :', [rules.match_ip(a) for a in addrs[:3000]] == linear)
+
+    # 与内存映射快照的结果一致
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    write_snapshot(path, entries)
+    compiled = CompiledRuleSet(path)
+    print('snapshot  :', [rules.match_ip(a) for a in addrs] == [compiled.match_ip(a) for a in addrs],
+          f'{sum(map(rules.match_ip, addrs))}/{len(addrs)} match')
+    compiled.close()
+    os.unlink(path)
+
+    # 添加网段后重新构建区间
+    rules.add('198.51.100.0/24')
+    print('add       :', rules.match('198.51.100.7'))
+
+    started = time.perf_counter()
+    for a in addrs:
+        rules.match_ip(a)
+    print('lookup    :', f'{(time.perf_counter() - started) / len(addrs) * 1e6:.2f} us/addr with {len(rules.networks)} networks')
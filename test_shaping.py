@@ -0,0 +1,107 @@
+import socket
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from proxy_server import ProxyServer
+from shaping import TokenBucket
+
+BODY = b'x' * (512 * 1024)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def bucket_waits():
+    """令牌桶：满桶可突发 burst 字节，透支部分按 rate 偿还"""
+    b = TokenBucket(rate=1000, burst=1000)
+    t0 = b.last
+    return [b.reserve(1000, t0), b.reserve(500, t0), b.reserve(500, t0 + 0.5), b.reserve(100, t0 + 2.0)]
+
+
+def wait_idle(server, timeout=5):
+    """等到限流统计里没有占用连接名额的客户端"""
+    deadline = time.monotonic() + timeout
+    while server.get_stats()['shaping']['active_clients'] and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+if __name__ == '__main__':
+    print('bucket    :', bucket_waits() == [0.0, 0.5, 0.5, 0.0], bucket_waits())
+
+    httpd = ThreadingHTTPServer(('localhost', 8016), FileHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = ProxyServer(local_host='localhost', local_port=8094, logger=None, bypass_list=['localhost'],
+                         dest_rate=256 * 1024, max_conns_per_client=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': 'http://localhost:8094'}))
+
+    try:
+        # 512 KB 以 256 KB/s（突发 256 KB）下行约需 1 秒
+        started = time.monotonic()
+        with opener.open('http://localhost:8016/file', timeout=10) as resp:
+            ok = resp.read() == BODY
+        elapsed = time.monotonic() - started
+        print('rate      :', ok and 0.8 <= elapsed < 1.6, f'{elapsed:.2f}s')
+
+        # 等上一个请求释放连接名额，否则隧道本身可能被拒绝
+        wait_idle(server)
+        # 同一客户端第二个并发连接被拒绝（429）
+        tunnel = socket.create_connection(('localhost', 8094), timeout=5)
+        tunnel.sendall(b'CONNECT localhost:8016 HTTP/1.1\r\nHost: localhost:8016\r\n\r\n')
+        reply = tunnel.recv(1024)
+        print('tunnel    :', reply.startswith(b'HTTP/1.1 200'), reply.split(b'\r\n', 1)[0].decode())
+        try:
+            opener.open('http://localhost:8016/file', timeout=5)
+            print('cap       : not rejected')
+        except urllib.error.HTTPError as e:
+            print('cap       :', e.code == 429, e.code)
+        tunnel.close()
+        wait_idle(server)
+        with opener.open('http://localhost:8016/file', timeout=10) as resp:
+            print('released  :', resp.status == 200)
+    except Exception as e:
+        print('Request error:', e)
+
+    print('stats     :', server.get_stats()['shaping'])
+    server.stop()
+
+    # SOCKS5 入站超过目标连接上限时回复 0x02，并和 429 一样计入 rejected_dest_conns
+    server = ProxyServer(local_host='localhost', local_port=8102, logger=None, bypass_list=['localhost'],
+                         socks_inbound=True, max_conns_per_dest=1)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    replies = []
+    clients = []
+    try:
+        for _ in range(2):
+            c = socket.create_connection(('localhost', 8102), timeout=5)
+            c.sendall(b'\x05\x01\x00')
+            c.recv(2)
+            c.sendall(b'\x05\x01\x00\x03\x09localhost' + (8016).to_bytes(2, 'big'))
+            replies.append(c.recv(10)[1])
+            clients.append(c)
+    except Exception as e:
+        print('Request error:', e)
+    rejected = server.get_stats()['shaping']['rejected_dest_conns']
+    print('socks cap :', replies == [0x00, 0x02] and rejected == 1, replies, 'rejected', rejected)
+    for c in clients:
+        c.close()
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
@@ -0,0 +1,93 @@
+import socket
+import ssl
+import threading
+import time
+
+from proxy_server import ProxyServer
+from socks5_stub import Socks5Server
+
+RECEIVED = []
+
+
+def client_hello(server_name):
+    """用内存 BIO 生成真实的 TLS ClientHello（不需要服务端）"""
+    ctx = ssl.create_default_context()
+    incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+    obj = ctx.wrap_bio(incoming, outgoing, server_hostname=server_name)
+    try:
+        obj.do_handshake()
+    except ssl.SSLWantReadError:
+        pass
+    return outgoing.read()
+
+
+def origin(port):
+    """记录每个连接收到的全部数据并回显长度"""
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('127.0.0.1', port))
+    lsock.listen(16)
+
+    def serve(conn):
+        data = b''
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        RECEIVED.append(data)
+        conn.sendall(str(len(data)).encode())
+        conn.close()
+
+    def accept():
+        while True:
+            conn, _ = lsock.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+
+def tunnel(proxy_port, target, payload, split=None):
+    s = socket.create_connection(('localhost', proxy_port), timeout=5)
+    s.sendall(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n'.encode())
+    reply = b''
+    while b'\r\n\r\n' not in reply:
+        reply += s.recv(1024)
+    # 分两段发送，验证跨 TCP 段的 ClientHello 也能完整解析
+    for part in ([payload[:split], payload[split:]] if split else [payload]):
+        s.sendall(part)
+        time.sleep(0.05)
+    s.shutdown(socket.SHUT_WR)
+    answer = s.recv(64)
+    s.close()
+    return reply.split(b'\r\n')[0].decode(), int(answer or 0) == len(payload) and RECEIVED[-1] == payload
+
+
+if __name__ == '__main__':
+    origin(8443)
+    socks = Socks5Server('localhost', 1093)
+    threading.Thread(target=socks.start, daemon=True).start()
+    time.sleep(0.3)
+
+    server = ProxyServer(local_host='localhost', local_port=8092, socks_port=1093, logger=None,
+                         proxy_list=['blocked.example'], sni_peek=True, sni_peek_ports=[8443],
+                         sni_peek_timeout=0.5)
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+
+    try:
+        hello = client_hello('blocked.example') + b'application data after the hello'
+        before = socks.stats['connections']
+        print('sni proxied :', tunnel(8092, '127.0.0.1:8443', hello, split=100),
+              'via socks', socks.stats['connections'] > before)
+        hello = client_hello('open.example')
+        before = socks.stats['connections']
+        print('sni direct  :', tunnel(8092, '127.0.0.1:8443', hello), 'via socks', socks.stats['connections'] > before)
+        # 不是 TLS 的数据：超时或判定后照常转发
+        print('not tls     :', tunnel(8092, '127.0.0.1:8443', b'SSH-2.0-test\r\n'))
+    except Exception as e:
+        print('Request error:', e)
+
+    print('stats       :', server.get_stats()['sni'])
+    server.stop()
+    time.sleep(0.2)
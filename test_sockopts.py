@@ -0,0 +1,79 @@
+import socket
+import threading
+import time
+
+from proxy_server import ProxyServer
+from sockopts import SocketProfile
+
+
+def rejected(overrides):
+    try:
+        SocketProfile(overrides)
+        return False
+    except ValueError:
+        return True
+
+
+if __name__ == '__main__':
+    # 配置错误在启动时报错
+    print('validate  :', all(rejected(o) for o in ({'uplink': {}}, {'client': {'nodelay': 1}},
+                                                   {'client': {'keepidle': -1}}, {'direct': {'backlog': 10}})))
+
+    # 覆盖项逐个合并进默认配置并设置到套接字上
+    profile = SocketProfile({'client': {'keepidle': 30, 'sndbuf': 65536}})
+    s = socket.socket()
+    profile.apply(s, 'client')
+    got = {
+        'nodelay': s.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY),
+        'keepalive': s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE),
+        'keepidle': s.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE),
+        'keepcnt': s.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT),
+    }
+    # Linux 返回翻倍后的缓冲区大小
+    sndbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    print('client    :', got == {'nodelay': 1, 'keepalive': 1, 'keepidle': 30, 'keepcnt': 5} and sndbuf >= 65536,
+          got, 'sndbuf', sndbuf)
+    s.close()
+
+    # keepalive 关闭时不设置 keepidle 等细节选项
+    profile = SocketProfile({'direct': {'keepalive': False, 'keepidle': 30}})
+    s = socket.socket()
+    profile.apply(s, 'direct')
+    print('no keepalv:', s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 0
+          and s.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) != 30)
+    s.close()
+
+    # 已关闭的套接字：计入 errors，不抛出异常
+    s = socket.socket()
+    s.close()
+    profile.apply(s, 'client')
+    print('errors    :', profile.stats()['errors'] > 0, profile.stats()['errors'])
+
+    # 出站 TFO：connect() 在握手前返回，不记录连接耗时与可达性
+    origin = socket.socket()
+    origin.bind(('127.0.0.1', 0))
+    origin.listen(8)
+    port = origin.getsockname()[1]
+    learned = {}
+    for fastopen in (False, True):
+        server = ProxyServer(logger=None, socket_options={'direct': {'fastopen': fastopen}})
+        conn = server._try_direct_connect('127.0.0.1', port)
+        conn.close()
+        learned[fastopen] = (server.connect_timer.snapshot(server.connect_timer.key('127.0.0.1', port, 'direct'))
+                             is not None, ('127.0.0.1', port) in server._reach_cache)
+    active = 'fastopen' not in server.sockopts.disabled.get('direct', ())
+    print('fastopen  :', learned[False] == (True, True) and (learned[True] == (False, False) or not active),
+          learned, 'active' if active else 'unsupported')
+    origin.close()
+
+    # 监听端配置作用于代理的监听套接字
+    server = ProxyServer(local_host='localhost', local_port=8095, logger=None,
+                         socket_options={'listener': {'backlog': 64, 'rcvbuf': 131072}, 'client': {'keepidle': 45}})
+    threading.Thread(target=server.start, daemon=True).start()
+    server.ready.wait(5)
+    rcvbuf = server.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    stats = server.get_stats()['socket_options']
+    print('listener  :', rcvbuf >= 131072 and server.sockopts.backlog() == 64, 'rcvbuf', rcvbuf)
+    print('stats     :', stats['profile']['client']['keepidle'] == 45, stats['disabled'])
+    server.stop()
+    time.sleep(0.2)
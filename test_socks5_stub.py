@@ -0,0 +1,129 @@
+import socket
+import struct
+import threading
+import time
+
+from socks5_stub import Socks5Server
+
+PAYLOAD = b'x' * (256 * 1024)
+
+
+def origin(port):
+    """每个连接发送 PAYLOAD 后关闭"""
+    lsock = socket.socket()
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind(('127.0.0.1', port))
+    lsock.listen(16)
+
+    def serve(conn):
+        try:
+            conn.sendall(PAYLOAD)
+        except OSError:
+            pass
+        conn.close()
+
+    def accept():
+        while True:
+            conn, _ = lsock.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+
+def start_stub(**kwargs):
+    stub = Socks5Server(kwargs.pop('host', '127.0.0.1'), 0, **kwargs)
+    threading.Thread(target=stub.start, daemon=True).start()
+    stub.ready.wait(5)
+    return stub
+
+
+def socks_connect(stub, port, family=socket.AF_INET):
+    """完成 SOCKS5 握手并 CONNECT 到 127.0.0.1:port，返回 (socket, 应答码, 握手耗时)"""
+    s = socket.socket(family, socket.SOCK_STREAM)
+    s.settimeout(5)
+    s.connect((stub.host, stub.port))
+    started = time.monotonic()
+    s.sendall(b'\x05\x01\x00')
+    s.recv(2)
+    s.sendall(b'\x05\x01\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', port))
+    reply = b''
+    while len(reply) < 10:
+        chunk = s.recv(10 - len(reply))
+        if not chunk:
+            break
+        reply += chunk
+    return s, reply[1] if len(reply) > 1 else None, time.monotonic() - started
+
+
+def download(s):
+    data = b''
+    while True:
+        chunk = s.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+if __name__ == '__main__':
+    origin(8015)
+
+    # 握手延迟
+    stub = start_stub(handshake_latency=0.2)
+    s, rep, elapsed = socks_connect(stub, 8015)
+    print('latency   :', rep == 0 and 0.18 <= elapsed < 0.4, f'{elapsed * 1000:.0f} ms')
+    s.close()
+    stub.stop()
+
+    # 抖动：延迟落在 latency +/- jitter 内且不是常数
+    stub = start_stub(handshake_latency=0.1, jitter=0.05, seed=1)
+    samples = []
+    for _ in range(5):
+        s, rep, elapsed = socks_connect(stub, 8015)
+        samples.append(elapsed)
+        s.close()
+    print('jitter    :', min(samples) >= 0.045 and max(samples) < 0.25 and max(samples) - min(samples) > 0.005,
+          [f'{x * 1000:.0f}' for x in samples])
+    stub.stop()
+
+    # 带宽：256 KB 以 256 KB/s 下行约需 1 秒
+    stub = start_stub(bandwidth=256 * 1024)
+    s, rep, _ = socks_connect(stub, 8015)
+    started = time.monotonic()
+    data = download(s)
+    elapsed = time.monotonic() - started
+    print('bandwidth :', data == PAYLOAD and 0.8 <= elapsed < 1.6, f'{len(data) / elapsed / 1024:.0f} KB/s')
+    s.close()
+    stub.stop()
+
+    # 注入连接失败：客户端收到 connection refused (0x05)
+    stub = start_stub(connect_fail_rate=1.0)
+    s, rep, _ = socks_connect(stub, 8015)
+    print('fail rate :', rep == 0x05, 'injected', stub.stats['injected_failures'])
+    s.close()
+    stub.stop()
+
+    # 注入 RST：传输中途被复位，客户端收不到完整数据
+    stub = start_stub(reset_rate=1.0, reset_after=1000)
+    s, rep, _ = socks_connect(stub, 8015)
+    try:
+        data = download(s)
+        outcome = f'eof after {len(data)} bytes'
+        ok = len(data) < len(PAYLOAD)
+    except ConnectionResetError:
+        outcome, ok = 'ConnectionResetError', True
+    print('reset     :', ok, outcome, 'resets', stub.stats['resets'])
+    s.close()
+    stub.stop()
+
+    # IPv6 监听
+    if socket.has_ipv6:
+        try:
+            stub = start_stub(host='::1')
+            s, rep, _ = socks_connect(stub, 8015, socket.AF_INET6)
+            print('ipv6      :', rep == 0 and download(s) == PAYLOAD)
+            s.close()
+            stub.stop()
+        except OSError as e:
+            print('ipv6      : skipped', e)
+    time.sleep(0.2)
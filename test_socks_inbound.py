@@ -0,0 +1,56 @@
+import threading
+import time
+import socket
+
+import socks
+
+from proxy_server import ProxyServer
+from test_smoke import run_local_http_server
+
+
+def fetch_via_socks(port, target_port):
+    s = socks.socksocket()
+    s.set_proxy(socks.SOCKS5, 'localhost', port)
+    s.settimeout(10)
+    s.connect(('localhost', target_port))
+    s.sendall(b'GET /socks HTTP/1.0\r\nHost: localhost\r\n\r\n')
+    data = b''
+    while True:
+        chunk = s.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    s.close()
+    return data
+
+
+if __name__ == '__main__':
+    httpd = run_local_http_server(8004)
+
+    # 主端口自动识别 SOCKS5，另外在 1085 端口提供独立的 SOCKS5 监听
+    server = ProxyServer(local_host='localhost', local_port=8085, logger=print,
+                         socks_inbound=True, socks_listen_port=1085)
+    t = threading.Thread(target=server.start, daemon=True)
+    t.start()
+
+    time.sleep(0.5)
+
+    for port in (8085, 1085):
+        try:
+            data = fetch_via_socks(port, 8004)
+            print(f'SOCKS5 via {port}:', data.split(b'\r\n', 1)[0], data.rsplit(b'\r\n', 1)[-1])
+        except Exception as e:
+            print(f'SOCKS5 via {port} error:', e)
+
+    # 同一端口上的 HTTP 请求照常处理
+    try:
+        c = socket.create_connection(('localhost', 8085), timeout=5)
+        c.sendall(b'GET http://localhost:8004/http HTTP/1.1\r\nHost: localhost:8004\r\n\r\n')
+        print('HTTP on same port:', c.recv(4096).split(b'\r\n', 1)[0])
+        c.close()
+    except Exception as e:
+        print('HTTP error:', e)
+
+    server.stop()
+    httpd.shutdown()
+    time.sleep(0.2)
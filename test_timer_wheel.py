@@ -0,0 +1,50 @@
+import socket
+import time
+
+from tunnel_reaper import TimerWheel, TunnelReaper
+
+
+def fire_ticks(delays, slots=512):
+    """按 tick 逐步推进时间轮，返回每个定时器实际触发时经过的 tick 数"""
+    wheel = TimerWheel(tick=1.0, slots=slots)
+    t0 = wheel._last
+    fired = {}
+    for d in delays:
+        wheel.schedule(d, lambda d=d: fired.setdefault(d, elapsed))
+    for elapsed in range(1, 3 * slots + 2):
+        wheel.advance(t0 + elapsed)
+    return [fired.get(d) for d in delays]
+
+
+if __name__ == '__main__':
+    delays = [1, 2, 511, 512, 513, 1023, 1024, 1025]
+    got = fire_ticks(delays)
+    print('fires at  :', dict(zip(delays, got)))
+    # 恰好为槽数整数倍的延迟（512、1024）也不能晚一整圈
+    print('on time   :', got == delays)
+    wheel = TimerWheel(tick=1.0, slots=512)
+    t0 = wheel._last
+    fired = []
+    timer = wheel.schedule(512, lambda: fired.append('cancelled'))
+    wheel.cancel(timer)
+    wheel.advance(t0 + 1024)
+    print('cancel    :', fired == [])
+
+    # stop() 之后登记的隧道不受管理，也不会重新启动回收线程
+    reaper = TunnelReaper(idle_timeout=60)
+    a, b = socket.socketpair()
+    tunnel = reaper.register(a, b)
+    started = reaper._thread is not None and reaper._thread.is_alive()
+    before = tunnel.last_activity
+    time.sleep(0.01)
+    tunnel.touch()
+    reaper.unregister(tunnel)
+    reaper.stop()
+    reaper._thread.join(2)
+    timers = reaper.stats()['timers']
+    late = reaper.register(a, b)
+    stats = reaper.stats()
+    print('stopped   :', started and tunnel.last_activity > before and not reaper._thread.is_alive()
+          and late.idle_timer is None and stats['tunnels'] == 1 and stats['timers'] == timers, stats)
+    a.close()
+    b.close()
@@ -0,0 +1,212 @@
+import socket
+import threading
+import time
+
+# Central lifecycle management for relayed tunnels. Instead of per-socket timeouts, each tunnel
+# gets idle / max-lifetime timers in a single hashed timer wheel driven by one thread. When a timer
+# fires for a tunnel that is really idle (or too old) both sockets are shut down, which wakes the
+# relay loop blocked in poll() so it exits and releases the file descriptors.
+
+
+class TimerWheel:
+    """单层哈希时间轮：O(1) 添加/取消，每个 tick 只处理一个槽位"""
+
+    # cancelled timers are swept out of every slot once there are this many and they outnumber live ones
+    COMPACT_MIN = 1024
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = float(tick)
+        self.slots = [[] for _ in range(int(slots))]
+        self._cursor = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._cancelled = 0
+
+    def schedule(self, delay, callback):
+        """delay 秒后调用 callback()，返回可传给 cancel() 的句柄"""
+        ticks = max(1, int(-(-float(delay) // self.tick)))
+        # the slot is reached after ((ticks - 1) % slots) + 1 ticks, then once more per remaining round
+        timer = [(ticks - 1) // len(self.slots), callback, False]  # rounds, callback, cancelled
+        with self._lock:
+            self.slots[(self._cursor + ticks) % len(self.slots)].append(timer)
+            self._pending += 1
+        return timer
+
+    def cancel(self, timer):
+        """取消定时器并立即释放回调（回调闭包通常引用隧道及其套接字）；
+        已取消的条目过多时整体清理一次，均摊 O(1)"""
+        if timer is None:
+            return
+        with self._lock:
+            if timer[2]:
+                return
+            timer[2] = True
+            timer[1] = None
+            self._cancelled += 1
+            if self._cancelled >= self.COMPACT_MIN and 2 * self._cancelled > self._pending:
+                for i, slot in enumerate(self.slots):
+                    self.slots[i] = [t for t in slot if not t[2]]
+                self._pending -= self._cancelled
+                self._cancelled = 0
+
+    def advance(self, now=None):
+        """推进到 now，触发所有到期的定时器（回调在锁外执行）"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            while now - self._last >= self.tick:
+                self._last += self.tick
+                self._cursor = (self._cursor + 1) % len(self.slots)
+                slot = self.slots[self._cursor]
+                keep = []
+                for timer in slot:
+                    if timer[2]:
+                        self._pending -= 1
+                        self._cancelled -= 1
+                        continue
+                    if timer[0] > 0:
+                        timer[0] -= 1
+                        keep.append(timer)
+                    else:
+                        # 到期即视为已取消，之后的 cancel() 不再计数
+                        timer[2] = True
+                        self._pending -= 1
+                        due.append((timer, timer[1]))
+                self.slots[self._cursor] = keep
+        for timer, callback in due:
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:
+                    pass
+
+
+class Tunnel:
+    __slots__ = ('a', 'b', 'started', 'last_activity', 'idle_timer', 'life_timer', 'closed')
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+        self.started = time.monotonic()
+        # updated through touch() by the relay loop on every chunk; read by the reaper
+        self.last_activity = self.started
+        self.idle_timer = None
+        self.life_timer = None
+        self.closed = False
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def shutdown(self):
+        """关闭两端的读写，唤醒阻塞在 recv 上的转发线程"""
+        self.closed = True
+        for s in (self.a, self.b):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+
+class TunnelReaper:
+    def __init__(self, idle_timeout=300.0, max_lifetime=0.0, tick=1.0, logger=None):
+        # seconds; 0 disables the corresponding limit
+        self.idle_timeout = float(idle_timeout or 0)
+        self.max_lifetime = float(max_lifetime or 0)
+        self.wheel = TimerWheel(tick=tick)
+        self._log = logger
+        self._lock = threading.Lock()
+        self._tunnels = set()
+        self._thread = None
+        self._running = False
+        # set by stop(): later registrations are not tracked and never restart the thread
+        self._stopped = False
+        self._stats = {'tunnels': 0, 'reaped_idle': 0, 'reaped_lifetime': 0, 'half_closes': 0}
+
+    def start(self):
+        """（重新）启用回收；线程在配置了超时时才运行，也可由第一条隧道登记时启动"""
+        with self._lock:
+            self._stopped = False
+        if self.idle_timeout or self.max_lifetime:
+            self._ensure_running()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._running = False
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.wheel.tick)
+            self.wheel.advance()
+
+    def register(self, a, b) -> Tunnel:
+        """登记一条隧道并为其安排空闲/最长存活定时器；stop() 之后只返回不受管理的 Tunnel"""
+        tunnel = Tunnel(a, b)
+        with self._lock:
+            if self._stopped:
+                return tunnel
+            self._tunnels.add(tunnel)
+            self._stats['tunnels'] += 1
+        if self.idle_timeout:
+            tunnel.idle_timer = self.wheel.schedule(self.idle_timeout, lambda: self._check_idle(tunnel))
+        if self.max_lifetime:
+            tunnel.life_timer = self.wheel.schedule(self.max_lifetime, lambda: self._expire(tunnel))
+        if (self.idle_timeout or self.max_lifetime) and not self._running:
+            self._ensure_running()
+        return tunnel
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._running or self._stopped:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='TunnelReaper', daemon=True)
+            self._thread.start()
+
+    def unregister(self, tunnel):
+        tunnel.closed = True
+        self.wheel.cancel(tunnel.idle_timer)
+        self.wheel.cancel(tunnel.life_timer)
+        with self._lock:
+            self._tunnels.discard(tunnel)
+
+    def shutdown_all(self):
+        """服务器停止时调用：关闭所有登记中的隧道"""
+        with self._lock:
+            tunnels = list(self._tunnels)
+        for tunnel in tunnels:
+            tunnel.shutdown()
+
+    def record_half_close(self):
+        with self._lock:
+            self._stats['half_closes'] += 1
+
+    def _check_idle(self, tunnel):
+        if tunnel.closed:
+            return
+        idle = time.monotonic() - tunnel.last_activity
+        if idle < self.idle_timeout:
+            # activity since the timer was armed: re-arm for the remaining idle window
+            tunnel.idle_timer = self.wheel.schedule(self.idle_timeout - idle, lambda: self._check_idle(tunnel))
+            return
+        self._reap(tunnel, 'reaped_idle', f"idle for {idle:.0f}s")
+
+    def _expire(self, tunnel):
+        if not tunnel.closed:
+            self._reap(tunnel, 'reaped_lifetime', f"exceeded max lifetime {self.max_lifetime:.0f}s")
+
+    def _reap(self, tunnel, stat, reason):
+        tunnel.shutdown()
+        with self._lock:
+            self._stats[stat] += 1
+        if self._log:
+            self._log(f"Reclaimed tunnel: {reason}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s['active_tunnels'] = len(self._tunnels)
+        with self.wheel._lock:
+            s['timers'] = self.wheel._pending
+        return s